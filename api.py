@@ -0,0 +1,315 @@
+"""Read-only JSON API, mounted at /api/v1.
+
+    GET /api/v1/timeline                  the logged-in user's home timeline
+    GET /api/v1/users/<id>                a profile
+    GET /api/v1/users/<id>/messages       their messages
+    GET /api/v1/users/<id>/likes          messages they liked
+    GET /api/v1/users/<id>/followers      users following them
+    GET /api/v1/users/<id>/following      users they follow
+    GET /api/v1/messages/<id>             a message
+
+Lists come a page at a time as `{"data": [...], "before": ..., "after":
+...}`, walked with the same `before`/`after` cursors as the HTML pages
+(see pagination.py); `limit` sets the page size. `fields=id,text` picks the
+fields to send (sparse fieldsets). Lists asked for with `format=ndjson` (or
+`Accept: application/x-ndjson`) instead stream every row from the cursor
+on, one JSON object per line, read from the database in batches.
+
+Queries select only the columns sent, and rows are encoded from their
+tuples by per-field encoders built once per request, with no ORM objects or
+intermediate dicts. Authentication is the web session's, like the pages:
+the timeline, likes and follow lists need a logged-in user.
+"""
+
+from datetime import datetime
+from json import dumps
+from json.encoder import encode_basestring_ascii
+
+from flask import (Blueprint, Response, abort, g, jsonify, request,
+                   stream_with_context)
+from sqlalchemy import tuple_
+from werkzeug.exceptions import HTTPException
+
+from models import db, Follows, LikedMessage, Message, User
+from pagination import PER_PAGE, decode_cursor, paginate
+
+MAX_LIMIT = 200
+EXPORT_BATCH = 1000
+NDJSON = 'application/x-ndjson'
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'user_id': Message.user_id,
+    'likes_count': Message.likes_count,
+    'username': User.username.label('username'),
+    'image_url': User.image_url.label('image_url'),
+}
+AUTHOR_FIELDS = {'username', 'image_url'}
+MESSAGE_ORDER = [Message.timestamp, Message.id]
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+}
+USER_ORDER = [User.id]
+
+
+##############################################################################
+# Encoding
+
+
+def _nullable(encode):
+    return lambda value: 'null' if value is None else encode(value)
+
+
+ENCODERS = {
+    int: _nullable(str),
+    str: _nullable(encode_basestring_ascii),
+    datetime: _nullable(lambda value: f'"{value.isoformat()}"'),
+    bool: _nullable(lambda value: 'true' if value else 'false'),
+}
+
+
+class RowEncoder:
+    """Encodes row tuples as JSON objects of the chosen `fields`.
+
+    `fields` are (name, column) pairs and the row's first values are in
+    the same order; extra trailing values (sort keys) are ignored.
+    """
+
+    def __init__(self, fields):
+        self._parts = [
+            (f'{"," if position else ""}"{name}":',
+             ENCODERS[column.type.python_type])
+            for position, (name, column) in enumerate(fields)]
+
+    def __call__(self, row):
+        return '{' + ''.join([prefix + encode(value)
+                              for (prefix, encode), value
+                              in zip(self._parts, row)]) + '}'
+
+
+def _fields(available):
+    """The (name, column) pairs asked for with `fields`, default all."""
+
+    names = request.args.get('fields')
+    if not names:
+        return list(available.items())
+
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, f"unknown fields: {', '.join(unknown)}")
+
+    return [(name, available[name]) for name in dict.fromkeys(names)]
+
+
+def _columns(fields, order):
+    """Columns to select: the fields, then any sort keys not among them."""
+
+    columns = [column for (_, column) in fields]
+    # by identity: `in` would compare SQL expressions with ==
+    return columns + [column for column in order
+                      if not any(column is chosen for chosen in columns)]
+
+
+##############################################################################
+# Responses
+
+
+def _wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == NDJSON)
+
+
+def _limit():
+    try:
+        limit = int(request.args.get('limit', PER_PAGE))
+    except ValueError:
+        abort(400, "limit must be a number")
+
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _walk(query, order, descending):
+    """Every row of `query` from the `before` cursor on, in batches."""
+
+    row_key = tuple_(*order)
+    sort = [column.desc() if descending else column.asc()
+            for column in order]
+
+    # decoded up front: a bad cursor must 400 before the stream starts
+    cursor = request.args.get('before')
+    if cursor:
+        cursor = decode_cursor(cursor,
+                               [column.type.python_type for column in order])
+
+    def rows(cursor):
+        while True:
+            batch = query
+            if cursor:
+                batch = batch.filter(row_key < cursor if descending
+                                     else row_key > cursor)
+            found = batch.order_by(*sort).limit(EXPORT_BATCH).all()
+
+            yield from found
+
+            if len(found) < EXPORT_BATCH:
+                return
+            cursor = tuple(getattr(found[-1], column.key)
+                           for column in order)
+
+    return rows(cursor)
+
+
+def _listing(query, fields, order, descending=True):
+    """A page of `query` as JSON, or all of it as NDJSON."""
+
+    encode = RowEncoder(fields)
+
+    if _wants_ndjson():
+        lines = (encode(row) + '\n'
+                 for row in _walk(query, order, descending))
+        return Response(stream_with_context(lines), mimetype=NDJSON)
+
+    page = paginate(query, order, _limit(), descending)
+    body = (f'{{"data":[{",".join([encode(row) for row in page])}],'
+            f'"before":{dumps(page.before)},"after":{dumps(page.after)}}}')
+
+    return Response(body, mimetype='application/json')
+
+
+def _one(query, fields):
+    row = query.first()
+    if row is None:
+        abort(404)
+
+    return Response(RowEncoder(fields)(row), mimetype='application/json')
+
+
+def _require_login():
+    if not g.user:
+        abort(401)
+
+
+def _messages(fields):
+    query = (db.session
+             .query(*_columns(fields, MESSAGE_ORDER))
+             .select_from(Message)
+             .filter(Message.user.has(deleted_at=None)))
+    if AUTHOR_FIELDS & {name for (name, _) in fields}:
+        query = query.join(User, User.id == Message.user_id)
+    return query
+
+
+def _users(fields):
+    return (db.session
+            .query(*_columns(fields, USER_ORDER))
+            .select_from(User))
+
+
+def _user_exists(user_id):
+    if not db.session.query(User.active().filter_by(id=user_id)
+                            .exists()).scalar():
+        abort(404)
+
+
+@bp.errorhandler(HTTPException)
+def api_error(error):
+    return jsonify(error=error.description), error.code
+
+
+##############################################################################
+# Routes
+
+
+@bp.route('/timeline')
+def timeline():
+    """Messages of the logged-in user and everyone they follow."""
+
+    _require_login()
+    fields = _fields(MESSAGE_FIELDS)
+    following_ids = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == g.user.id))
+
+    return _listing(
+        _messages(fields).filter((Message.user_id == g.user.id) |
+                                 (Message.user_id.in_(following_ids))),
+        fields, MESSAGE_ORDER)
+
+
+@bp.route('/users/<int:user_id>')
+def user(user_id):
+    fields = _fields(USER_FIELDS)
+    return _one(_users(fields).filter(User.id == user_id,
+                                      User.deleted_at.is_(None)),
+                fields)
+
+
+@bp.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    _user_exists(user_id)
+    fields = _fields(MESSAGE_FIELDS)
+
+    return _listing(_messages(fields).filter(Message.user_id == user_id),
+                    fields, MESSAGE_ORDER)
+
+
+@bp.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    _require_login()
+    _user_exists(user_id)
+    fields = _fields(MESSAGE_FIELDS)
+
+    return _listing(
+        _messages(fields)
+        .join(LikedMessage, LikedMessage.message_id == Message.id)
+        .filter(LikedMessage.user_id == user_id),
+        fields, MESSAGE_ORDER)
+
+
+@bp.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    _require_login()
+    _user_exists(user_id)
+    fields = _fields(USER_FIELDS)
+
+    return _listing(
+        _users(fields)
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user_id,
+                User.deleted_at.is_(None)),
+        fields, USER_ORDER, descending=False)
+
+
+@bp.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    _require_login()
+    _user_exists(user_id)
+    fields = _fields(USER_FIELDS)
+
+    return _listing(
+        _users(fields)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user_id,
+                User.deleted_at.is_(None)),
+        fields, USER_ORDER, descending=False)
+
+
+@bp.route('/messages/<int:message_id>')
+def message(message_id):
+    fields = _fields(MESSAGE_FIELDS)
+    return _one(_messages(fields).filter(Message.id == message_id), fields)
@@ -1,11 +1,36 @@
+import logging
 import os
+import signal
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, abort, render_template, request, flash, redirect,
+                   session, g, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError, DataError
 
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message, LikedMessage
+from models import db, connect_db, User, Message, LikedMessage, Follows
+from pagination import paginate
+from principal import current_user, principals
+from viewer import (follow_state, like_state, load_follow_state,
+                    load_like_state)
+import api
+import assets
+import availability
+import conditional
+import counters
+import fragments
+import instrumentation
+import jobs
+import likes
+import loaders
+import pagecache
+import passwords
+import purge
+import search
+import streaming
+import timeline
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +45,83 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Home timeline engine: "query" (read from messages on every request),
+# "materialized" (fan-out-on-write into timeline_entries) or "ring"
+# (merge per-author in-memory buffers on read). Run `flask timeline-rebuild`
+# after switching to "materialized".
+app.config['TIMELINE_ENGINE'] = os.environ.get('TIMELINE_ENGINE', 'query')
+app.config['TIMELINE_MAX_ENTRIES'] = 800
+
+# Password hashing cost. Set BCRYPT_TARGET_MS to instead calibrate the cost
+# at startup to the slowest hash that fits in that many milliseconds.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_TARGET_MS'] = os.environ.get('BCRYPT_TARGET_MS')
+# Hashes running at once, and waiting, per process before logins get a 503.
+# Keep the sum below gunicorn's --threads in the Procfile (see passwords.py).
+app.config['PASSWORD_POOL_WORKERS'] = 2
+app.config['PASSWORD_POOL_QUEUE'] = 2
+
+# Share of requests that count/time their SQL; of those, ones slower than
+# SLOW_REQUEST_MS are logged with their slowest statements (and EXPLAIN
+# ANALYZE plans if SLOW_REQUEST_EXPLAIN is set). Their totals are only sent
+# in a Server-Timing header in debug mode or with SERVER_TIMING set, as
+# they tell anyone how much work a page is.
+app.config['SQL_STATS_SAMPLE_RATE'] = float(
+    os.environ.get('SQL_STATS_SAMPLE_RATE', 0.01))
+app.config['SERVER_TIMING'] = bool(os.environ.get('SERVER_TIMING'))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['SLOW_REQUEST_EXPLAIN'] = bool(
+    os.environ.get('SLOW_REQUEST_EXPLAIN'))
+
+# Cache-Control per endpoint; the rest get DEFAULT_CACHE_POLICY.
+app.config['DEFAULT_CACHE_POLICY'] = 'no-store'
+app.config['CACHE_POLICIES'] = {
+    endpoint: 'private, no-cache'
+    for endpoint in ('list_users', 'users_show', 'show_following',
+                     'users_followers', 'messages_show')
+}
+# fingerprinted files never change under the same name
+app.config['CACHE_POLICIES']['assets'] = 'public, max-age=31536000, immutable'
+# change on deploys that change templates, so old ETags (and cached
+# fragments) stop matching
+app.config['ETAG_SALT'] = os.environ.get('ETAG_SALT', '')
+# Rendered message/user cards: "lru" (per worker), "shared" (files in
+# FRAGMENT_CACHE_DIR, seen by every worker on the host) or "none". Shared
+# entries expire after FRAGMENT_CACHE_MAX_AGE seconds.
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', 'lru')
+app.config['FRAGMENT_CACHE_SIZE'] = 20000
+app.config['FRAGMENT_CACHE_MAX_AGE'] = 24 * 3600
+if os.environ.get('FRAGMENT_CACHE_DIR'):
+    app.config['FRAGMENT_CACHE_DIR'] = os.environ['FRAGMENT_CACHE_DIR']
+# Logged-out responses are cached per worker for PAGE_CACHE_TTL seconds, then
+# served stale for up to PAGE_CACHE_STALE more while they re-render.
+app.config['PAGE_CACHE_TTL'] = float(os.environ.get('PAGE_CACHE_TTL', 30))
+app.config['PAGE_CACHE_STALE'] = float(os.environ.get('PAGE_CACHE_STALE', 300))
+app.config['PAGE_CACHE_SIZE'] = 2000
+# where `flask assets-build` writes hashed, precompressed static files
+app.config['ASSETS_DIR'] = os.environ.get(
+    'ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+# Deleted accounts' rows are purged this many per transaction, with a pause
+# (seconds) between transactions.
+app.config['PURGE_BATCH_SIZE'] = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+app.config['PURGE_BATCH_PAUSE'] = float(
+    os.environ.get('PURGE_BATCH_PAUSE', 0.1))
+# Background jobs (see jobs.py): each worker claims up to JOB_BATCH_SIZE at a
+# time, polling every JOB_POLL_INTERVAL seconds when there are none, and may
+# take JOB_LEASE seconds over one before other workers can claim it again.
+app.config['JOB_BATCH_SIZE'] = int(os.environ.get('JOB_BATCH_SIZE', 10))
+app.config['JOB_POLL_INTERVAL'] = float(
+    os.environ.get('JOB_POLL_INTERVAL', 1.0))
+app.config['JOB_LEASE'] = 300
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+passwords.init_app(app)
+instrumentation.init_app(app)
+assets.init_app(app)
+fragments.init_app(app)
+app.register_blueprint(api.bp)
 
 
 ##############################################################################
@@ -31,15 +130,29 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    `g.user` is a cached Principal, not a full User: use `current_user()`
+    in views that need to change the user.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = principals().get(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+@app.context_processor
+def add_viewer_helpers():
+    """Let templates check the viewer's follows/likes with O(1) set lookups."""
+
+    return dict(
+        is_following=lambda user: follow_state().is_following(user),
+        is_followed_by=lambda user: follow_state().is_followed_by(user),
+        is_liked=lambda message: like_state().is_liked(message))
+
+
 def do_login(user):
     """Log in user."""
 
@@ -68,6 +181,15 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        # reject duplicates before paying for the password hash
+        if availability.username_taken(form.username.data):
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        if availability.email_taken(form.email.data):
+            flash("Email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -76,8 +198,12 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            search.user_changed(user)
+            availability.user_changed(user)
+            pagecache.purge("users")
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -100,6 +226,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves a rehashed password
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -119,36 +247,66 @@ def logout():
     return redirect("/login")
 
 
+@app.route('/api/username-available')
+def username_available():
+    """JSON: is the 'username' param free to sign up with?"""
+
+    username = request.args.get('username', '').strip()
+
+    if not username:
+        return jsonify(error="username is required"), 400
+
+    return jsonify(username=username,
+                   available=not availability.username_taken(username,
+                                                             confirm=True))
+
+
 ##############################################################################
 # General user routes:
 
 @app.route('/users')
+@pagecache.anonymous('users')
+@conditional.versioned(conditional.users_version)
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations; matches are ranked by relevance.
     """
 
-    search = request.args.get('q')
+    term = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if term:
+        users = search.search_users(term)
+        load_follow_state(users)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = streaming.stream_page(
+            User.active().options(*loaders.options('listing')),
+            [User.id], descending=False, on_batch=load_follow_state)
 
-    return render_template('users/index.html', users=users)
+    return streaming.stream_template('users/index.html', users=users)
 
 
 @app.route('/users/<int:user_id>')
+@pagecache.anonymous('user:{user_id}')
+@conditional.versioned(conditional.profile_version)
 def users_show(user_id):
     """Show user profile."""
     
-    user = User.query.get_or_404(user_id)
+    user = (User.active()
+            .options(*loaders.options('profile'))
+            .filter_by(id=user_id)
+            .first_or_404())
+    messages = streaming.stream_page(Message.query.filter_by(user_id=user.id),
+                                     [Message.timestamp, Message.id],
+                                     on_batch=load_like_state)
 
-    return render_template('users/show.html', user=user)
+    return streaming.stream_template('users/show.html', user=user,
+                                     messages=messages)
 
 
 @app.route('/users/<int:user_id>/following')
+@conditional.versioned(conditional.following_version)
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -156,11 +314,24 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = (User.active()
+            .options(*loaders.options('profile'))
+            .filter_by(id=user_id)
+            .first_or_404())
+    load_follow_state([user])
+    following = streaming.stream_page(
+        User.active()
+        .options(*loaders.options('listing'))
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user.id),
+        [User.id], descending=False, on_batch=load_follow_state)
+
+    return streaming.stream_template('users/following.html', user=user,
+                                     following=following)
 
 
 @app.route('/users/<int:user_id>/followers')
+@conditional.versioned(conditional.followers_version)
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -168,8 +339,20 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = (User.active()
+            .options(*loaders.options('profile'))
+            .filter_by(id=user_id)
+            .first_or_404())
+    load_follow_state([user])
+    followers = streaming.stream_page(
+        User.active()
+        .options(*loaders.options('listing'))
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user.id),
+        [User.id], descending=False, on_batch=load_follow_state)
+
+    return streaming.stream_template('users/followers.html', user=user,
+                                     followers=followers)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -180,9 +363,13 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = User.active().filter_by(id=follow_id).first_or_404()
+    db.session.add(Follows(user_following_id=g.user.id,
+                           user_being_followed_id=followed_user.id))
+    counters.follow_added(g.user.id, followed_user.id)
+    timeline.backfill(g.user.id, followed_user.id)
     db.session.commit()
+    pagecache.purge(f"user:{g.user.id}", f"user:{followed_user.id}")
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -195,9 +382,18 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    followed_user = User.query.get_or_404(follow_id)
+    removed = (Follows.query
+               .filter_by(user_following_id=g.user.id,
+                          user_being_followed_id=followed_user.id)
+               .delete())
+
+    # not following them (or a resubmitted form): nothing to count
+    if removed == 1:
+        counters.follow_removed(g.user.id, followed_user.id)
+        timeline.prune(g.user.id, followed_user.id)
+        db.session.commit()
+        pagecache.purge(f"user:{g.user.id}", f"user:{followed_user.id}")
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -206,8 +402,20 @@ def show_liked_messages(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    
-    return render_template("/users/likes.html", user=g.user)
+
+    user = (User.active()
+            .options(*loaders.options('profile'))
+            .filter_by(id=user_id)
+            .first_or_404())
+    likes = paginate(
+        Message.visible()
+        .options(*loaders.options('timeline'))
+        .join(LikedMessage, LikedMessage.message_id == Message.id)
+        .filter(LikedMessage.user_id == user.id),
+        [Message.timestamp, Message.id])
+    load_like_state(likes)
+
+    return render_template("/users/likes.html", user=user, likes=likes)
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
@@ -218,12 +426,22 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    form = EditProfileForm(obj=g.user)
+    user = current_user()
+    form = EditProfileForm(obj=user)
 
     if form.validate_on_submit():
+        if availability.username_taken(form.username.data,
+                                       exclude_id=user.id):
+            flash("Username already taken", 'danger')
+            return render_template("users/edit.html", form=form)
+
+        if availability.email_taken(form.email.data, exclude_id=user.id):
+            flash("Email already taken", 'danger')
+            return render_template("users/edit.html", form=form)
+
         password = form.password.data
 
-        authenticate = User.authenticate(g.user.username, password)
+        authenticate = User.authenticate(user.username, password)
 
         if not authenticate:
             flash("Invalid password")
@@ -231,16 +449,28 @@ def profile():
 
         else:
 
-            g.user.username = form.username.data
-            g.user.email = form.email.data
-            g.user.image_url = form.image_url.data
-            g.user.header_image_url = form.header_image_url.data
-            g.user.bio = form.bio.data
-            g.user.location = form.location.data
-
-            db.session.commit()
-
-            return redirect(f"/users/{g.user.id}")
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data
+            user.header_image_url = form.header_image_url.data
+            user.bio = form.bio.data
+            user.location = form.location.data
+
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # taken through another worker since its filter was built
+                db.session.rollback()
+                flash("Username or email already taken", 'danger')
+                return render_template("users/edit.html", form=form)
+
+            principals().invalidate(user.id)
+            fragments.invalidate('user', user.id)
+            pagecache.purge(f"user:{user.id}", "users")
+            search.user_changed(user)
+            availability.user_changed(user)
+
+            return redirect(f"/users/{user.id}")
 
     return render_template("users/edit.html", form=form)
 
@@ -254,11 +484,14 @@ def delete_user():
 
     do_logout()
 
-    Message.query.filter_by(user_id=g.user.id).delete()
-    db.session.commit()
-
-    db.session.delete(g.user)
+    # the account's rows go later, in batches (see purge.py)
+    current_user().deleted_at = datetime.utcnow()
+    jobs.enqueue('purge_user', {'user_id': g.user.id})
     db.session.commit()
+    principals().invalidate(g.user.id)
+    fragments.invalidate('user', g.user.id)
+    pagecache.purge(f"user:{g.user.id}", "users")
+    search.user_removed(g.user.id)
 
     return redirect("/signup")
 
@@ -280,20 +513,71 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        timeline.fan_out(msg)
         db.session.commit()
+        search.message_added(msg)
+        pagecache.purge(f"user:{g.user.id}")
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Page of messages matching the words in the 'q' param, most relevant
+    and recent first."""
+
+    term = request.args.get('q', '').strip()
+    messages = search.search_messages(term) if term else []
+
+    if g.user:
+        load_like_state(messages)
+
+    return render_template('messages/search.html', messages=messages,
+                           term=term)
+
+
+@app.route('/messages/search.json')
+def messages_search_json():
+    """JSON version of messages_search, paged with the same cursors."""
+
+    term = request.args.get('q', '').strip()
+
+    if not term:
+        return jsonify(messages=[], before=None, after=None)
+
+    page = search.search_messages(term)
+
+    return jsonify(
+        messages=[dict(id=msg.id,
+                       text=msg.text,
+                       timestamp=msg.timestamp.isoformat(),
+                       user_id=msg.user_id,
+                       username=msg.user.username,
+                       likes_count=msg.likes_count)
+                  for msg in page],
+        before=page.before,
+        after=page.after)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@pagecache.anonymous('message:{message_id}')
+@conditional.versioned(conditional.message_version, dated=True)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = (Message.query
+           .options(*loaders.options('message'))
+           .get_or_404(message_id))
+    if msg.user.deleted_at:
+        abort(404)
+    pagecache.tag(f"user:{msg.user_id}")
+
     return render_template('messages/show.html', message=msg)
 
 
@@ -306,34 +590,65 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    author_id = msg.user_id
+    timeline.remove(msg)
+    counters.message_removed(msg)
     db.session.delete(msg)
     db.session.commit()
+    fragments.invalidate('message', message_id)
+    search.message_removed(message_id)
+    pagecache.purge(f"user:{author_id}", f"message:{message_id}")
 
     return redirect(f"/users/{g.user.id}")
 
 @app.route('/messages/<int:message_id>/like', methods=["POST"])
 def add_liked_message(message_id):
+    """Like or unlike a message.
+
+    Toggles, unless the form's 'liked' field ("1"/"0") says which. XHR
+    callers (Accept: application/json) get the new state and count as JSON
+    instead of a redirect back to the page.
+    """
+
+    wants_json = (request.accept_mimetypes
+                  .best_match(['text/html', 'application/json'])
+                  == 'application/json')
+
     if not g.user:
+        if wants_json:
+            return jsonify(error="log in to like messages"), 401
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
-
-    if message in g.user.likes:
-            LikedMessage.query.filter(LikedMessage.message_id == message_id, LikedMessage.user_id == g.user.id).delete()
-            db.session.commit()
-    else: 
-        valid_like = message.check_valid_like(g.user)
+    author = (db.session
+              .query(Message.user_id, User.deleted_at)
+              .join(User, User.id == Message.user_id)
+              .filter(Message.id == message_id)
+              .first())
+    if author is None or author.deleted_at:
+        abort(404)
+
+    if author.user_id == g.user.id:
+        if wants_json:
+            return jsonify(error="You can't like your own messages!"), 403
+        flash("You can't like your own messages!")
+        return redirect(request.referrer or "/")
+
+    wanted = request.form.get('liked')
+    if wanted is None:
+        liked = likes.toggle_like(g.user.id, message_id)
+    else:
+        liked = wanted == '1'
+        likes.set_like(g.user.id, message_id, liked)
+    count = likes.likes_count(message_id)
+    db.session.commit()
 
-        if valid_like:
-            message.users_liked.append(g.user)
-            db.session.commit()
-        else: 
-            flash("You can't like your own messages!")
+    pagecache.purge(f"user:{g.user.id}", f"user:{author.user_id}")
 
-    return redirect(request.referrer)
-        
+    if wants_json:
+        return jsonify(message_id=message_id, liked=liked, likes_count=count)
 
+    return redirect(request.referrer or "/")
 
 
 ##############################################################################
@@ -341,23 +656,18 @@ def add_liked_message(message_id):
 
 
 @app.route('/')
+@pagecache.anonymous('home')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, paged with
+      `before`/`after` cursors
     """
 
     if g.user:
-        following_ids = [user.id for user in g.user.following]
-
-        messages = (Message
-                    .query
-                    .filter((Message.user == g.user) |
-                            (Message.user_id.in_(following_ids)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        messages = timeline.home_timeline(g.user)
+        load_like_state(messages)
 
         return render_template('home.html', messages=messages)
 
@@ -365,17 +675,125 @@ def homepage():
         return render_template('home-anon.html')
 
 
+@app.errorhandler(passwords.PoolBusy)
+def password_pool_busy(error):
+    """Shed logins/signups quickly when password hashing is backed up."""
+
+    return ("Too many sign-ins right now; please try again in a moment.",
+            503, {"Retry-After": "1"})
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('timeline-rebuild')
+def timeline_rebuild():
+    """Rebuild every materialized home timeline from scratch."""
+
+    timeline.rebuild()
+    db.session.commit()
+
+
+@app.cli.command('search-index')
+def search_index():
+    """Install the trigram search indexes on an existing PostgreSQL db."""
+
+    with db.engine.begin() as connection:
+        installed = search.install_trigram_indexes(connection)
+
+    click.echo("trigram indexes installed" if installed
+               else "pg_trgm unavailable; using the in-process n-gram index")
+
+
+@app.cli.command('reindex-messages')
+@click.option('--all', 'everything', is_flag=True,
+              help="Rebuild every message, not only unindexed ones.")
+def reindex_messages(everything):
+    """Build message search documents, e.g. after a bulk load."""
+
+    count = search.reindex_messages(only_missing=not everything)
+    click.echo(f"{count} messages indexed")
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True,
+              help="Only report drifted counters, don't fix them.")
+def reconcile_counters(dry_run):
+    """Find and repair user/message counters that drifted from the data."""
+
+    drift = counters.reconcile(fix=not dry_run)
+
+    for name, rows in drift.items():
+        click.echo(f"{name}: {rows} drifted")
+
+    db.session.commit()
+
+
+@app.cli.command('purge-deleted-users')
+@click.option('--batch-size', type=int,
+              help="Rows per transaction (default PURGE_BATCH_SIZE).")
+@click.option('--pause', type=float,
+              help="Seconds between transactions (default PURGE_BATCH_PAUSE).")
+def purge_deleted_users(batch_size, pause):
+    """Delete the rows of deleted accounts, a batch at a time."""
+
+    for user_id, deleted in purge.purge_deleted(batch_size, pause):
+        click.echo(f"user {user_id}: " + ", ".join(
+            f"{count} {name}" for name, count in deleted.items()))
+
+
+@app.cli.command('jobs-work')
+@click.option('--burst', is_flag=True,
+              help="Exit once no job is ready instead of polling.")
+def jobs_work(burst):
+    """Run background jobs until stopped (SIGTERM finishes the current one)."""
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    worker = jobs.Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(burst=burst)
+
+
+@app.cli.command('jobs-stats')
+def jobs_stats():
+    """Show how many jobs are ready, waiting and failed, per task."""
+
+    for row in jobs.queue_stats():
+        oldest = ("" if row['oldest'] is None
+                  else f", oldest ready {row['oldest']:.0f}s")
+        click.echo(f"{row['task']}: {row['ready']} ready, "
+                   f"{row['waiting']} waiting, {row['failed']} failed{oldest}")
+
+
+@app.cli.command('assets-build')
+def assets_build():
+    """Fingerprint and precompress static/ into ASSETS_DIR."""
+
+    manifest = assets.build(app.static_folder, app.config['ASSETS_DIR'])
+    assets.load_manifest(app)
+
+    click.echo(f"{len(manifest)} assets built into {app.config['ASSETS_DIR']}")
+    if assets.brotli is None:
+        click.echo("brotli not installed; wrote gzip variants only")
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Cache policy
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Pages that answer conditional GETs (see conditional.py) may be kept by
+# the browser as long as it revalidates them; fingerprinted /assets/ files
+# are cached for a year; everything else is no-store. Unhashed /static/
+# files keep the headers Flask gives them.
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Set Cache-Control from CACHE_POLICIES for the matched endpoint."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if request.endpoint != 'static':
+        response.headers['Cache-Control'] = app.config['CACHE_POLICIES'].get(
+            request.endpoint, app.config['DEFAULT_CACHE_POLICY'])
     return response
@@ -0,0 +1,197 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask assets-build` copies every file under static/ into ASSETS_DIR
+(static/dist by default) with a content hash in its name, e.g.
+`stylesheets/style.3f2a9c1b7d4e.css`, plus `.gz` and (if the `brotli`
+package is installed) `.br` variants of text files, and writes a
+`manifest.json` mapping original paths to hashed ones. `url(...)` references
+to other static files inside CSS are rewritten to their hashed names first.
+
+Templates link assets with `asset_url('stylesheets/style.css')`, and image
+URLs kept in the database (the default avatar and header are /static/
+files) with `{{ user.image_url|static_url }}`. Hashed files
+are served from /assets/ with year-long `immutable` caching (see
+CACHE_POLICIES), in the best encoding the client accepts; a changed file
+gets a new name, so browsers never revalidate. Without a manifest (e.g. in
+development) `asset_url` falls back to the plain /static/ URL.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import abort, current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html'}
+
+STATIC_PREFIX = '/static/'
+
+# url("/static/images/x.png"), url('/static/x'), url(/static/x)
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)/static/([^'")]+)\1\s*\)""")
+
+# best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+##############################################################################
+# Build
+
+
+def _fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    base, ext = os.path.splitext(path)
+    return f"{base}.{digest}{ext}"
+
+
+def _write(out_dir, path, content):
+    target = os.path.join(out_dir, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+
+
+def _compressed_variants(content):
+    """(suffix, bytes) for each encoding that makes `content` smaller."""
+
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+
+    return [(suffix, data) for suffix, data in variants
+            if len(data) < len(content)]
+
+
+def build(source_dir, out_dir):
+    """Fingerprint and compress everything in `source_dir` into `out_dir`.
+
+    Returns the manifest dict, which is also written to `out_dir`.
+    """
+
+    out_dir = os.path.abspath(out_dir)
+    sources = []
+
+    for root, dirs, files in os.walk(source_dir):
+        if os.path.abspath(root).startswith(out_dir):
+            continue
+        for name in files:
+            full = os.path.join(root, name)
+            sources.append(os.path.relpath(full, source_dir)
+                           .replace(os.sep, '/'))
+
+    # CSS last: it refers to the hashed names of everything else
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+
+    manifest = {}
+
+    for path in sources:
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            content = CSS_URL_RE.sub(
+                lambda m: (f"url({m[1]}/assets/{manifest[m[2]]}{m[1]})"
+                           if m[2] in manifest else m[0]),
+                content.decode('utf-8')).encode('utf-8')
+
+        hashed = _fingerprint(path, content)
+        manifest[path] = hashed
+        _write(out_dir, hashed, content)
+
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            for suffix, data in _compressed_variants(content):
+                _write(out_dir, hashed + suffix, data)
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+##############################################################################
+# Serving
+
+
+def load_manifest(app):
+    """Read ASSETS_DIR's manifest into the app, if it has been built."""
+
+    path = os.path.join(app.config['ASSETS_DIR'], MANIFEST)
+
+    try:
+        with open(path) as f:
+            app.extensions['assets_manifest'] = json.load(f)
+    except FileNotFoundError:
+        app.extensions['assets_manifest'] = {}
+
+
+def asset_url(path):
+    """URL of static file `path`: fingerprinted if built, else /static/."""
+
+    hashed = current_app.extensions.get('assets_manifest', {}).get(path)
+
+    if hashed is None:
+        return url_for('static', filename=path)
+
+    return url_for('assets', filename=hashed)
+
+
+def static_url(url):
+    """`asset_url` of a /static/ `url`; any other URL is left alone."""
+
+    if url and url.startswith(STATIC_PREFIX):
+        return asset_url(url[len(STATIC_PREFIX):])
+
+    return url
+
+
+def send_asset(filename):
+    """Send a fingerprinted file in the best encoding the client accepts."""
+
+    directory = current_app.config['ASSETS_DIR']
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    for encoding, suffix in ENCODINGS:
+        if (request.accept_encodings[encoding]
+                and os.path.isfile(path + suffix)):
+            response = send_from_directory(directory, filename + suffix,
+                                           mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename,
+                                       mimetype=mimetype)
+
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Add the /assets/ route and the `asset_url` and `static_url` template
+    helpers."""
+
+    app.config.setdefault('ASSETS_DIR',
+                          os.path.join(app.static_folder, 'dist'))
+    load_manifest(app)
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', send_asset)
+    app.add_template_global(asset_url)
+    app.add_template_filter(static_url)
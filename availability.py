@@ -0,0 +1,212 @@
+"""Cheap "is this username/email taken?" checks.
+
+Signing up hashes the password before the INSERT finds a duplicate
+username, so collisions used to cost a full bcrypt hash. Each worker now
+keeps a Bloom filter of every username and email, and only a hit needs a
+query against the unique index to rule out a false positive. A miss only
+means the name wasn't taken when the filter was built, or through this
+worker since: signups and renames go ahead on one and leave the rest to
+the unique constraint, while `/api/username-available`, whose answer is
+all there is, confirms it with the query (`confirm=True`).
+
+The filter is built, and rebuilt every `AVAILABILITY_FILTER_TTL` seconds,
+on a background thread, one build at a time, so no signup waits on a scan
+of the users table. Until the first build is done every check is that
+query; during a rebuild the old filter is used, and names added meanwhile
+are carried over to the new one.
+
+Bloom filters can't forget, so renames leave stale bits (they only cause
+extra queries).
+"""
+
+import logging
+import math
+from hashlib import blake2b
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import current_app
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILTER_TTL = 600
+ERROR_RATE = 0.01
+MIN_CAPACITY = 1024
+
+FIELDS = ('username', 'email')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) /
+                              math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(key))
+
+
+class TakenNames:
+    """Per-worker Bloom filter of usernames and emails, rebuilt from the
+    users table on a background thread every `ttl` seconds."""
+
+    def __init__(self, ttl=DEFAULT_FILTER_TTL):
+        self.ttl = ttl
+        self._filter = None
+        self._built_at = None
+        # names added while a build scans the table; None when none runs
+        self._pending = None
+        # bumped by clear(), so a build already running is thrown away
+        self._generation = 0
+        self._lock = Lock()
+        # held by the one build running at a time
+        self._build_lock = Lock()
+
+    def is_taken(self, field, value, exclude_id=None, confirm=False):
+        """Does a user other than `exclude_id` have `field` == `value`?
+
+        Without `confirm`, a miss in the filter is taken as no, which can
+        be wrong for names taken through other workers since its build.
+        """
+
+        self._refresh()
+        bloom = self._filter
+
+        if (not confirm and bloom is not None
+                and f"{field}:{value}" not in bloom):
+            return False
+
+        column = getattr(User, field)
+        query = User.query.filter(column == value)
+        if exclude_id is not None:
+            query = query.filter(User.id != exclude_id)
+
+        return db.session.query(query.exists()).scalar()
+
+    def add(self, user):
+        """Record a new or renamed `user`. A no-op until the filter is
+        built."""
+
+        keys = [f"{field}:{getattr(user, field)}" for field in FIELDS]
+
+        with self._lock:
+            if self._filter is not None:
+                for key in keys:
+                    self._filter.add(key)
+            if self._pending is not None:
+                self._pending.extend(keys)
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._built_at = None
+            self._generation += 1
+
+    def rebuild(self):
+        """Build the filter now, on this thread. Needs an app context."""
+
+        with self._build_lock:
+            self._build()
+
+    def _refresh(self):
+        """Start a background build if the filter is missing or stale and
+        none is running; checks are queries until it's ready."""
+
+        if self._built_at and monotonic() - self._built_at < self.ttl:
+            return
+        if not self._build_lock.acquire(blocking=False):
+            return
+
+        try:
+            Thread(target=self._build_in_background,
+                   args=(current_app._get_current_object(),),
+                   name='taken-names', daemon=True).start()
+        except BaseException:
+            self._build_lock.release()
+            raise
+
+    def _build_in_background(self, app):
+        try:
+            with app.app_context():
+                self._build()
+        except Exception:
+            logger.exception("taken names filter build failed")
+        finally:
+            self._build_lock.release()
+
+    def _build(self):
+        with self._lock:
+            generation = self._generation
+            self._pending = []
+
+        try:
+            # room to grow until the next rebuild
+            capacity = 2 * len(FIELDS) * db.session.query(
+                db.func.count(User.id)).scalar()
+            bloom = BloomFilter(max(capacity, MIN_CAPACITY))
+
+            rows = db.session.query(User.username,
+                                    User.email).yield_per(10000)
+            for (username, email) in rows:
+                bloom.add(f"username:{username}")
+                bloom.add(f"email:{email}")
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, None
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            for key in pending:
+                bloom.add(key)
+            self._filter = bloom
+            self._built_at = monotonic()
+
+
+_taken_names = None
+
+
+def taken_names():
+    """Return this worker's TakenNames filter."""
+
+    global _taken_names
+
+    if _taken_names is None:
+        _taken_names = TakenNames(
+            ttl=current_app.config.get('AVAILABILITY_FILTER_TTL',
+                                       DEFAULT_FILTER_TTL))
+
+    return _taken_names
+
+
+def username_taken(username, exclude_id=None, confirm=False):
+    return taken_names().is_taken('username', username, exclude_id,
+                                  confirm)
+
+
+def email_taken(email, exclude_id=None, confirm=False):
+    return taken_names().is_taken('email', email, exclude_id, confirm)
+
+
+def user_changed(user):
+    """Add a new or renamed `user` to this worker's filter."""
+
+    if _taken_names is not None:
+        _taken_names.add(user)
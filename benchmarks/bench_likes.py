@@ -0,0 +1,119 @@
+"""Time the like toggle against how many likes the viewer already has.
+
+Seeds one author with enough messages, then for each size gives a viewer
+that many likes and times liking (and, untimed, unliking) other messages
+through the Flask test client. Latency and statements per toggle should
+stay flat across sizes. Run it from the project root against a scratch
+database (every table is dropped):
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_likes --sizes 0,1000,10000,100000
+"""
+
+import argparse
+import statistics
+from time import perf_counter
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, LikedMessage
+from benchmarks.bench_routes import SQLCounter, percentile
+
+INSERT_BATCH = 50000
+
+
+def seed(messages):
+    """An author with `messages` messages; returns their ids."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(User.__table__.insert(), [
+        dict(email="author@example.com", username="author", password="x")])
+    author_id = db.session.query(User.id).scalar()
+
+    for start in range(0, messages, INSERT_BATCH):
+        db.session.execute(Message.__table__.insert(), [
+            dict(text="benchmark warble", user_id=author_id)
+            for _ in range(start, min(messages, start + INSERT_BATCH))])
+    db.session.commit()
+
+    return [message_id for (message_id,) in
+            db.session.query(Message.id).order_by(Message.id)]
+
+
+def add_viewer(name, liked_ids):
+    """A viewer who likes `liked_ids`, counters included."""
+
+    viewer = User(email=f"{name}@example.com", username=name, password="x",
+                  likes_count=len(liked_ids))
+    db.session.add(viewer)
+    db.session.flush()
+
+    for start in range(0, len(liked_ids), INSERT_BATCH):
+        db.session.execute(LikedMessage.__table__.insert(), [
+            dict(user_id=viewer.id, message_id=message_id)
+            for message_id in liked_ids[start:start + INSERT_BATCH]])
+    db.session.commit()
+
+    return viewer.id
+
+
+def time_toggles(viewer_id, message_ids, warmup):
+    counter = SQLCounter(db.engine)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = viewer_id
+
+    timings, statements = [], []
+    headers = {'Accept': 'application/json'}
+
+    for i, message_id in enumerate(message_ids):
+        counter.reset()
+        start = perf_counter()
+        resp = client.post(f'/messages/{message_id}/like', headers=headers)
+        elapsed = perf_counter() - start
+
+        if resp.status_code != 200 or not resp.json['liked']:
+            raise RuntimeError(f"like {message_id}: {resp.status_code}")
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            statements.append(counter.statements)
+
+        client.post(f'/messages/{message_id}/like', headers=headers)
+
+    counter.close()
+    return timings, statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--sizes', default='0,1000,10000,100000',
+                        help="comma-separated numbers of existing likes")
+    parser.add_argument('--toggles', type=int, default=200,
+                        help="timed likes per size")
+    parser.add_argument('--warmup', type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    toggles = args.toggles + args.warmup
+
+    print(f"{'likes':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+          f"{'stmts':>7}")
+
+    with app.app_context():
+        message_ids = seed(max(sizes) + toggles)
+    targets = message_ids[-toggles:]
+
+    for size in sizes:
+        with app.app_context():
+            viewer_id = add_viewer(f"viewer{size}", message_ids[:size])
+
+        # outside any context, so each request gets its own `g`
+        timings, statements = time_toggles(viewer_id, targets, args.warmup)
+        print(f"{size:>8}{statistics.median(timings):>10.2f}"
+              f"{percentile(timings, 95):>10.2f}{max(timings):>10.2f}"
+              f"{statistics.mean(statements):>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+"""Benchmark the main routes at several data scales.
+
+For each scale this generates a dataset with generator/create_csvs.py,
+loads it with loader.py, then drives homepage, users_show, list_users,
+messages_show, add_liked_message and add_follow, in-process through the
+Flask test client and/or over HTTP against a local gunicorn. Run it from
+the project root against a scratch database (every table is dropped):
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_routes --scales 1,10,100 --out new.json
+
+Each (scale, mode, route) reports p50/p95/p99 latency, throughput (timed
+requests over wall-clock time, untimed undo requests included), SQL
+statements and rows fetched per request and peak RSS. In-process runs each
+get a fresh interpreter, so their peak RSS is the app's own and not the
+loader's or an earlier run's.
+Compare two saved runs, failing on regressions beyond a threshold:
+
+    python -m benchmarks.bench_routes --diff old.json new.json
+
+Write requests are made repeatable by an untimed request that undoes them
+(unliking, unfollowing).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter, sleep
+
+from sqlalchemy import event, func
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+import loader
+
+ROUTES = ['homepage', 'users_show', 'list_users', 'messages_show',
+          'add_liked_message', 'add_follow']
+MODES = ['inprocess', 'gunicorn']
+
+GENERATOR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'generator', 'create_csvs.py')
+
+# metrics compared by --diff, and whether higher is better
+METRICS = {'p50_ms': False, 'p95_ms': False, 'p99_ms': False,
+           'throughput_rps': True, 'statements': False, 'rows': False,
+           'peak_rss_mb': False}
+
+
+##############################################################################
+# Data
+
+
+def seed(scale, seed_value):
+    """Generate and load a dataset of `scale` times the default size."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, GENERATOR, '--scale', str(scale),
+                        '--seed', str(seed_value), '--out', directory],
+                       check=True, stdout=subprocess.DEVNULL)
+        loader.load(directory, report=lambda line: None)
+
+
+def sample(query, size):
+    return query.order_by(func.random()).limit(size).all()
+
+
+def workload(route, size, rng):
+    """Return `size` requests for `route` as (method, path, viewer id,
+    undo request or None)."""
+
+    viewers = [user_id for (user_id,) in
+               sample(db.session.query(User.id), size)]
+
+    if route == 'homepage':
+        return [('GET', '/', viewer, None) for viewer in viewers]
+
+    if route == 'users_show':
+        return [('GET', f'/users/{rng.choice(viewers)}', viewer, None)
+                for viewer in viewers]
+
+    if route == 'list_users':
+        return [('GET', '/users', viewer, None) for viewer in viewers]
+
+    messages = sample(db.session.query(Message.id, Message.user_id), size)
+
+    if route == 'messages_show':
+        return [('GET', f'/messages/{message_id}', viewer, None)
+                for viewer, (message_id, _) in zip(viewers, messages)]
+
+    if route == 'add_liked_message':
+        # pairs that aren't liked yet; a second toggle undoes the like
+        liked = set(db.session
+                    .query(LikedMessage.user_id, LikedMessage.message_id)
+                    .filter(LikedMessage.user_id.in_(viewers)))
+        pairs = {(viewer, message_id)
+                 for viewer, (message_id, author) in zip(viewers, messages)
+                 if viewer != author and (viewer, message_id) not in liked}
+        return [('POST', f'/messages/{message_id}/like', viewer,
+                 ('POST', f'/messages/{message_id}/like', viewer))
+                for viewer, message_id in sorted(pairs)]
+
+    if route == 'add_follow':
+        targets = [user_id for (user_id,) in
+                   sample(db.session.query(User.id), size)]
+        following = set(db.session
+                        .query(Follows.user_following_id,
+                               Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id.in_(viewers)))
+        pairs = {(viewer, target)
+                 for viewer, target in zip(viewers, targets)
+                 if viewer != target and (viewer, target) not in following}
+        return [('POST', f'/users/follow/{target}', viewer,
+                 ('POST', f'/users/stop-following/{target}', viewer))
+                for viewer, target in sorted(pairs)]
+
+    raise ValueError(route)
+
+
+def session_cookie(viewer):
+    """A signed Flask session cookie logging in `viewer`."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({CURR_USER_KEY: viewer})
+
+
+##############################################################################
+# Measurement
+
+
+class SQLCounter:
+    """Counts statements and rows fetched on the app's engine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.rows = 0
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements += 1
+        if cursor.description is not None and cursor.rowcount > 0:
+            self.rows += cursor.rowcount
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+
+    def close(self):
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+
+SERVER_TIMING_SQL = re.compile(r'desc="(\d+) statements, (\d+) rows"')
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+def summarize(timings, wall, statements=None, rows=None, rss_mb=None):
+    return dict(
+        requests=len(timings),
+        p50_ms=round(statistics.median(timings), 3),
+        p95_ms=round(percentile(timings, 95), 3),
+        p99_ms=round(percentile(timings, 99), 3),
+        throughput_rps=round(len(timings) / wall, 1),
+        statements=(round(statistics.mean(statements), 2)
+                    if statements else None),
+        rows=round(statistics.mean(rows), 1) if rows else None,
+        peak_rss_mb=rss_mb,
+    )
+
+
+def run_inprocess(requests, warmup):
+    """`_inprocess` in a new interpreter (see `--child`)."""
+
+    child = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_routes',
+         '--child', '--warmup', str(warmup)],
+        input=json.dumps(requests), stdout=subprocess.PIPE, text=True,
+        check=True)
+    return json.loads(child.stdout.splitlines()[-1])
+
+
+def _inprocess(requests, warmup):
+    # no context may be pushed around the test client: its requests would
+    # share that app context, and so `g`
+    counter = SQLCounter(db.engine)
+    client = app.test_client()
+    timings, statements, rows = [], [], []
+    start_wall = None
+
+    for i, (method, path, viewer, undo) in enumerate(requests):
+        if i == warmup:
+            start_wall = perf_counter()
+        client.set_cookie('localhost', app.session_cookie_name,
+                          session_cookie(viewer))
+        counter.reset()
+
+        start = perf_counter()
+        resp = client.open(path, method=method, headers={'Referer': '/'})
+        resp.get_data()  # streamed pages render as they're read
+        elapsed = perf_counter() - start
+
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{method} {path}: {resp.status_code}")
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            statements.append(counter.statements)
+            rows.append(counter.rows)
+
+        if undo:
+            client.open(undo[1], method=undo[0], headers={'Referer': '/'})
+
+    counter.close()
+    wall = perf_counter() - start_wall
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    return summarize(timings, wall, statements, rows, rss)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    """Largest VmHWM of `pid` and its children (Linux), else None."""
+
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+        peaks = []
+        for each in pids:
+            with open(f'/proc/{each}/status') as f:
+                peaks += [int(line.split()[1]) for line in f
+                          if line.startswith('VmHWM:')]
+        return max(peaks) // 1024
+    except OSError:
+        return None
+
+
+class Gunicorn:
+    """A local `gunicorn app:app` for the duration of a `with` block."""
+
+    def __init__(self, workers):
+        self.port = free_port()
+        self.workers = workers
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn.app.wsgiapp', 'app:app',
+             '--bind', f'127.0.0.1:{self.port}',
+             '--workers', str(self.workers),
+             '--log-level', 'warning'],
+            env=dict(os.environ,
+                     DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'],
+                     SQL_STATS_SAMPLE_RATE='1', SERVER_TIMING='1'))
+
+        for _ in range(300):
+            if self.process.poll() is not None:
+                break
+            try:
+                socket.create_connection(('127.0.0.1', self.port),
+                                         timeout=1).close()
+                return self
+            except OSError:
+                sleep(0.1)
+
+        self.process.kill()
+        raise RuntimeError("gunicorn did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_gunicorn(requests, warmup, workers, concurrency):
+    local = threading.local()
+
+    def send(method, path, viewer):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', server.port)
+        local.conn.request(method, path, headers={
+            'Cookie': f"{app.session_cookie_name}={session_cookie(viewer)}",
+            'Referer': '/',
+        })
+        resp = local.conn.getresponse()
+        resp.read()
+        if resp.status >= 400:
+            raise RuntimeError(f"{method} {path}: {resp.status}")
+        return resp
+
+    def timed(request):
+        method, path, viewer, undo = request
+        start = perf_counter()
+        resp = send(method, path, viewer)
+        elapsed = perf_counter() - start
+        if undo:
+            send(*undo)
+        sql = SERVER_TIMING_SQL.search(resp.getheader('Server-Timing', ''))
+        return elapsed * 1000, sql and int(sql[1]), sql and int(sql[2])
+
+    with Gunicorn(workers) as server:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(timed, requests[:warmup]))
+            start = perf_counter()
+            measured = list(pool.map(timed, requests[warmup:]))
+            wall = perf_counter() - start
+        rss = peak_rss_mb(server.process.pid)
+
+    timings, statements, rows = zip(*measured)
+    # counts come from the app's Server-Timing header (see instrumentation)
+    sampled = [i for i, count in enumerate(statements) if count is not None]
+
+    return summarize(list(timings), wall,
+                     [statements[i] for i in sampled],
+                     [rows[i] for i in sampled], rss)
+
+
+##############################################################################
+# Diffing
+
+
+def diff(old_path, new_path, threshold):
+    """Print metric changes between two runs; return the regressions."""
+
+    def index(path):
+        with open(path) as f:
+            return {(r['scale'], r['mode'], r['route']): r
+                    for r in json.load(f)['results']}
+
+    old, new = index(old_path), index(new_path)
+    regressions = []
+
+    print(f"{'scale':>7} {'mode':<10}{'route':<19}{'metric':<16}"
+          f"{'old':>10}{'new':>10}{'change':>9}")
+
+    for key in sorted(old.keys() & new.keys()):
+        for metric, higher_is_better in METRICS.items():
+            before, after = old[key].get(metric), new[key].get(metric)
+            if before is None or after is None:
+                continue
+
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append((key, metric, change))
+
+            print(f"{key[0]:>7} {key[1]:<10}{key[2]:<19}{metric:<16}"
+                  f"{before:>10.2f}{after:>10.2f}{change:>+8.1f}%{flag}")
+
+    return regressions
+
+
+##############################################################################
+# Main
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--scales', default='1,10',
+                        help="comma-separated generator scale factors")
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--requests', type=int, default=200,
+                        help="timed requests per route")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2,
+                        help="gunicorn workers")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="parallel clients against gunicorn")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="use the current database at every scale")
+    parser.add_argument('--out', help="save results to this JSON file")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two saved runs instead")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="percent change --diff reports as a regression")
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # one in-process run: requests on stdin, its result on stdout
+        print(json.dumps(_inprocess(json.load(sys.stdin), args.warmup)))
+        return
+
+    if args.diff:
+        regressions = diff(*args.diff, args.threshold)
+        print(f"\n{len(regressions)} regression(s)")
+        sys.exit(1 if regressions else 0)
+
+    rng = random.Random(args.seed)
+    results = []
+
+    print(f"{'scale':>7} {'mode':<10}{'route':<19}{'p50':>8}{'p95':>8}"
+          f"{'p99':>8}{'req/s':>8}{'stmts':>7}{'rows':>8}{'rss MB':>8}")
+
+    for scale in args.scales.split(','):
+        if not args.no_seed:
+            with app.app_context():
+                seed(scale, args.seed)
+
+        for route in args.routes.split(','):
+            with app.app_context():
+                requests = workload(route, args.requests + args.warmup, rng)
+
+            for mode in args.modes.split(','):
+                if mode == 'inprocess':
+                    result = run_inprocess(requests, args.warmup)
+                else:
+                    result = run_gunicorn(requests, args.warmup,
+                                          args.workers, args.concurrency)
+
+                result.update(scale=float(scale), mode=mode, route=route)
+                results.append(result)
+                print(f"{scale:>7} {mode:<10}{route:<19}"
+                      f"{result['p50_ms']:>8.2f}{result['p95_ms']:>8.2f}"
+                      f"{result['p99_ms']:>8.2f}"
+                      f"{result['throughput_rps']:>8.0f}"
+                      f"{result['statements'] or '-':>7}"
+                      f"{result['rows'] or '-':>8}"
+                      f"{result['peak_rss_mb'] or '-':>8}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(dict(
+                created=datetime.utcnow().isoformat(),
+                timeline_engine=app.config['TIMELINE_ENGINE'],
+                args=vars(args),
+                results=results,
+            ), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Measure /users?q= search latency at scale.
+
+Compares the old leading-wildcard LIKE scan with the trigram (PostgreSQL
+with pg_trgm) and in-process n-gram backends of `search.py`. Run it from
+the project root against a scratch database:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_search --seed --users 1000000
+
+--seed drops and recreates every table before inserting the users.
+"""
+
+import argparse
+import random
+import resource
+import statistics
+from time import perf_counter
+
+from sqlalchemy import text
+
+from app import app
+from models import db, User
+import search
+
+WORDS = ("soup bread cheese river mountain coffee garden winter summer "
+         "music paint code forest ocean city quiet happy lucky").split()
+CITIES = ("Oakland Berkeley Paris Lagos Lima Osaka Denver Austin Boston "
+          "Seattle Porto Lyon Leeds").split()
+
+BATCH = 20000
+
+
+def seed(num_users):
+    """Insert `num_users` users with random bios and locations."""
+
+    db.drop_all()
+    db.create_all()
+
+    for start in range(0, num_users, BATCH):
+        db.session.execute(User.__table__.insert(), [
+            dict(email=f"user{i}@example.com",
+                 username=f"{random.choice(WORDS)}{i}",
+                 password="x",
+                 bio=" ".join(random.choices(WORDS, k=6)),
+                 location=random.choice(CITIES))
+            for i in range(start, min(start + BATCH, num_users))])
+        db.session.commit()
+
+    db.session.execute(text("ANALYZE users"))
+    db.session.commit()
+
+
+def like_search(term):
+    """The original `/users?q=` query."""
+
+    return User.query.filter(User.username.like(f"%{term}%")).limit(51).all()
+
+
+def time_backend(run, terms, repeat):
+    """Latencies of `run(term)`, each call in a fresh request context (and
+    so with its own `g` and db session), like a request."""
+
+    timings = []
+    for _ in range(repeat):
+        for term in terms:
+            with app.test_request_context():
+                start = perf_counter()
+                run(term)
+                timings.append((perf_counter() - start) * 1000)
+    return sorted(timings)
+
+
+def report(name, timings):
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<10}{statistics.median(timings):>10.2f}{p95:>10.2f}"
+          f"{timings[-1]:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--seed', action='store_true',
+                        help="drop all tables and insert fresh users")
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-ngram', action='store_true',
+                        help="skip the in-process index (it holds every "
+                             "user's fields in memory)")
+    args = parser.parse_args()
+
+    terms = ["soup", "Paris", "ee", "music12", "quiet happy", "zzzz"]
+
+    # no context stays pushed around the timed calls: they'd share its `g`
+    with app.app_context():
+        if args.seed:
+            seed(args.users)
+
+        count = User.query.count()
+        trigram = search.has_trigram()
+
+    print(f"{count} users\n")
+    print(f"{'backend':<10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+
+    report('like', time_backend(like_search, terms, args.repeat))
+
+    if trigram:
+        report('trigram', time_backend(
+            lambda term: search._trigram_search(term, 0, 51),
+            terms, args.repeat))
+    else:
+        print("trigram   (pg_trgm not installed)")
+
+    if not args.skip_ngram:
+        index = search.NgramIndex(ttl=float('inf'))
+        start = perf_counter()
+        with app.test_request_context():
+            index.search("warm")
+        built = perf_counter() - start
+        report('ngram', time_backend(
+            lambda term: index.search(term, 0, 51), terms, args.repeat))
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        print(f"\nn-gram index built in {built:.1f}s; "
+              f"peak RSS {rss} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Compare home timeline engines.
+
+Times `timeline.home_timeline()` under each TIMELINE_ENGINE for a sample of
+users. Run it from the project root against a scratch database:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_timeline --seed --users 2000 --follows 200
+
+--seed drops and recreates every table, then inserts synthetic users,
+messages and follows. Without it the current contents of the database
+(e.g. from seed.py) are used.
+"""
+
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+from time import perf_counter
+from types import SimpleNamespace
+
+from app import app
+from models import db, User, Message, Follows
+import timeline
+
+ENGINES = ['query', 'materialized', 'ring']
+
+
+def seed(num_users, messages_per_user, follows_per_user):
+    """Fill the database with a synthetic social graph."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(User.__table__.insert(), [
+        dict(email=f"bench{i}@example.com",
+             username=f"bench{i}",
+             password="x")
+        for i in range(num_users)])
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    start = datetime.utcnow() - timedelta(days=365)
+
+    rows = []
+    for user_id in user_ids:
+        for _ in range(messages_per_user):
+            rows.append(dict(
+                text="benchmark warble",
+                user_id=user_id,
+                timestamp=start + timedelta(
+                    seconds=random.randrange(365 * 24 * 3600))))
+        if len(rows) >= 50000:
+            db.session.execute(Message.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Message.__table__.insert(), rows)
+
+    follows = []
+    for user_id in user_ids:
+        for followed_id in random.sample(user_ids, follows_per_user):
+            if followed_id != user_id:
+                follows.append(dict(user_following_id=user_id,
+                                    user_being_followed_id=followed_id))
+    db.session.execute(Follows.__table__.insert(), follows)
+
+    db.session.commit()
+
+
+def time_engine(engine, users, repeat):
+    """Return per-call latencies in ms of `engine` over `users`."""
+
+    app.config['TIMELINE_ENGINE'] = engine
+
+    if engine == 'materialized':
+        with app.app_context():
+            timeline.rebuild()
+            db.session.commit()
+
+    # a fresh request context (`g`, db session) per call, like a request
+    timings = []
+    for _ in range(repeat):
+        for user in users:
+            with app.test_request_context():
+                start = perf_counter()
+                timeline.home_timeline(user)
+                timings.append((perf_counter() - start) * 1000)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--seed', action='store_true',
+                        help="drop all tables and generate fresh data")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=50,
+                        help="messages per user when seeding")
+    parser.add_argument('--follows', type=int, default=100,
+                        help="follows per user when seeding")
+    parser.add_argument('--sample', type=int, default=50,
+                        help="number of users whose timelines are timed")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    args = parser.parse_args()
+
+    # no context stays pushed around the timed calls: they'd share its `g`
+    with app.app_context():
+        if args.seed:
+            seed(args.users, args.messages, args.follows)
+
+        user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    sample = random.sample(user_ids, min(args.sample, len(user_ids)))
+
+    print(f"{'engine':<14}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for engine in args.engines.split(','):
+        users = [SimpleNamespace(id=user_id) for user_id in sample]
+        timings = sorted(time_engine(engine, users, args.repeat))
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{engine:<14}{statistics.median(timings):>10.2f}"
+              f"{p95:>10.2f}{timings[-1]:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Conditional GET for pages built from users and messages.
+
+A page's version is the ids and `updated_at` of every row it shows, plus
+the viewer's row (their follows and likes change what a page shows, and
+bump their own counters). Validators read just those columns in one
+statement, with the same cursor window the page would use, so a request
+carrying a matching `If-None-Match` gets a 304 before the full rows load or
+the template renders.
+
+Only pages of a fixed set of rows (a message and its author) also send
+`Last-Modified` and honour `If-Modified-Since`. On list pages the newest
+`updated_at` doesn't move when a row leaves the window (an unfollow, a
+deleted user or message), so a date would call a changed page fresh; the
+ETag, which covers the ids, doesn't.
+
+`updated_at` changes on every UPDATE, including the counter bumps in
+counters.py, so e.g. a like changes the version of the liked message's
+pages and of the liker's. Set `ETAG_SALT` to something new when a deploy
+changes templates.
+"""
+
+from datetime import datetime
+from functools import wraps
+from hashlib import blake2b
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import literal, select, union_all
+
+from models import db, Follows, Message, User
+from pagination import window
+
+
+def _rows(kind, query):
+    """`query` of (id, updated_at) as a subquery tagged with `kind`."""
+
+    return query.add_columns(literal(kind).label('kind')).subquery()
+
+
+def _user(kind, user_id):
+    return _rows(kind, db.session
+                 .query(User.id, User.updated_at)
+                 .filter(User.id == user_id, User.deleted_at.is_(None)))
+
+
+def _version(required, *subqueries):
+    """Run `subqueries` and the viewer's row as one UNION ALL statement.
+
+    Returns the sorted (kind, id, updated_at) rows, or None if a kind in
+    `required` has no rows (so the view can 404).
+    """
+
+    if g.user:
+        subqueries += (_user('viewer', g.user.id),)
+
+    statement = union_all(*[select(sq.c.kind, sq.c.id, sq.c.updated_at)
+                            for sq in subqueries])
+    rows = sorted(tuple(row) for row in db.session.execute(statement))
+
+    if not set(required) <= {kind for (kind, _, _) in rows}:
+        return None
+
+    return rows
+
+
+##############################################################################
+# Validators: view kwargs -> version rows, or None to skip (the view then
+# redirects, 404s, etc. as usual)
+
+
+def profile_version(user_id):
+    """users_show: the user and their messages on the requested page."""
+
+    return _version(
+        ['owner'],
+        _user('owner', user_id),
+        _rows('message', window(
+            db.session
+            .query(Message.id, Message.updated_at)
+            .filter(Message.user_id == user_id),
+            [Message.timestamp, Message.id])))
+
+
+def message_version(message_id):
+    """messages_show: the message and its author."""
+
+    return _version(
+        ['message', 'author'],
+        _rows('message', db.session
+              .query(Message.id, Message.updated_at)
+              .filter(Message.id == message_id)),
+        _rows('author', db.session
+              .query(User.id, User.updated_at)
+              .join(Message, Message.user_id == User.id)
+              .filter(Message.id == message_id,
+                      User.deleted_at.is_(None))))
+
+
+def _follow_version(user_id, listed, owner):
+    if not g.user:
+        return None
+
+    return _version(
+        ['owner'],
+        _user('owner', user_id),
+        _rows('listed', window(
+            db.session
+            .query(User.id, User.updated_at)
+            .join(Follows, listed == User.id)
+            .filter(owner == user_id),
+            [User.id], descending=False)))
+
+
+def following_version(user_id):
+    return _follow_version(user_id, Follows.user_being_followed_id,
+                           Follows.user_following_id)
+
+
+def followers_version(user_id):
+    return _follow_version(user_id, Follows.user_following_id,
+                           Follows.user_being_followed_id)
+
+
+def users_version():
+    """list_users without a search term (ranked searches aren't cached)."""
+
+    if request.args.get('q'):
+        return None
+
+    return _version(
+        [],
+        _rows('listed', window(db.session
+                               .query(User.id, User.updated_at)
+                               .filter(User.deleted_at.is_(None)),
+                               [User.id], descending=False)))
+
+
+##############################################################################
+# Decorator
+
+
+def etag_for(rows):
+    digest = blake2b(digest_size=16)
+    digest.update(current_app.config.get('ETAG_SALT', '').encode())
+    digest.update(request.full_path.encode())
+    digest.update(repr(rows).encode())
+    return digest.hexdigest()
+
+
+def is_fresh(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    since = request.if_modified_since
+    if since and last_modified:
+        return last_modified.replace(microsecond=0) <= since.replace(
+            tzinfo=None)
+
+    return False
+
+
+def versioned(validator, dated=False):
+    """Answer GETs of the decorated view with 304 when the version rows
+    from `validator(**view_args)` are unchanged since the client's copy.
+
+    With `dated`, for pages whose rows can only change, not come and go,
+    the newest `updated_at` is sent as Last-Modified too.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # a pending flash message must be rendered, not revalidated
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(**kwargs)
+
+            rows = validator(**kwargs)
+            if rows is None:
+                return view(**kwargs)
+
+            etag = etag_for(rows)
+            last_modified = dated and max(
+                (row[-1] for row in rows if isinstance(row[-1], datetime)),
+                default=None)
+
+            if is_fresh(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.vary.add('Cookie')
+
+            return response
+
+        return wrapper
+
+    return decorator
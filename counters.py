@@ -0,0 +1,178 @@
+"""Maintenance of the denormalized counter columns on users and messages.
+
+Each helper only adds UPDATE statements to the current session, so counter
+changes commit or roll back together with the write that caused them. Call
+the ones that select what they count *before* those rows are deleted.
+
+The cached principals of the users they change are dropped once the
+transaction commits: dropped any earlier, a concurrent request could cache
+the old counts again before the new ones are visible.
+"""
+
+from collections import Counter, defaultdict
+
+from sqlalchemy import event, func, select, update
+
+from models import db, Follows, LikedMessage, Message, User
+from principal import principals
+
+# session.info key of the ids of users whose counters the transaction changed
+STALE_PRINCIPALS = 'stale_principals'
+
+
+def _bump(model, ids, **deltas):
+    """Add `deltas` to counter columns of the `model` rows with `ids`.
+
+    `ids` is an id, a list of ids or a select of ids.
+    """
+
+    if isinstance(ids, int):
+        ids = [ids]
+
+    # cached principals of other users just expire; these are the ones
+    # a request can know it changed
+    if model is User and isinstance(ids, list):
+        db.session.info.setdefault(STALE_PRINCIPALS, set()).update(ids)
+
+    values = {getattr(model, column): getattr(model, column) + delta
+              for column, delta in deltas.items()}
+
+    db.session.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values(values)
+        .execution_options(synchronize_session=False))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_principals(session):
+    for user_id in session.info.pop(STALE_PRINCIPALS, ()):
+        principals().invalidate(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_principals(session):
+    session.info.pop(STALE_PRINCIPALS, None)
+
+
+def message_added(message):
+    _bump(User, message.user_id, messages_count=1)
+
+
+def message_removed(message):
+    _bump(User, message.user_id, messages_count=-1)
+    _bump(User,
+          select(LikedMessage.user_id)
+          .where(LikedMessage.message_id == message.id),
+          likes_count=-1)
+
+
+def follow_added(follower_id, followed_id):
+    _bump(User, follower_id, following_count=1)
+    _bump(User, followed_id, followers_count=1)
+
+
+def follow_removed(follower_id, followed_id):
+    _bump(User, follower_id, following_count=-1)
+    _bump(User, followed_id, followers_count=-1)
+
+
+def like_added(user_id, message_id):
+    _bump(User, user_id, likes_count=1)
+    _bump(Message, message_id, likes_count=1)
+
+
+def like_removed(user_id, message_id):
+    _bump(User, user_id, likes_count=-1)
+    _bump(Message, message_id, likes_count=-1)
+
+
+def _subtract(model, column, ids):
+    """Take one off `column` of the `model` row with each id in `ids`, as
+    often as it's listed, in one UPDATE per distinct count."""
+
+    by_count = defaultdict(list)
+    for id, count in Counter(ids).items():
+        by_count[count].append(id)
+
+    for count, same in by_count.items():
+        _bump(model, same, **{column: -count})
+
+
+# Batch versions for the purge of deleted accounts (see purge.py). They're
+# given the keys of rows already deleted (DELETE ... RETURNING), so rows
+# some other transaction deleted first aren't counted twice.
+
+def messages_removed(user_id, count):
+    _bump(User, user_id, messages_count=-count)
+
+
+def follows_removed(pairs):
+    """`pairs` of (follower id, followed id)."""
+
+    _subtract(User, 'following_count', [follower for (follower, _) in pairs])
+    _subtract(User, 'followers_count', [followed for (_, followed) in pairs])
+
+
+def likes_removed(pairs):
+    """`pairs` of (user id, message id)."""
+
+    _subtract(User, 'likes_count', [user_id for (user_id, _) in pairs])
+    _subtract(Message, 'likes_count',
+              [message_id for (_, message_id) in pairs])
+
+
+##############################################################################
+# Reconciliation
+
+def _count(model, *criteria):
+    return (select(func.count())
+            .select_from(model)
+            .where(*criteria)
+            .scalar_subquery())
+
+
+def _actual_counts():
+    """Pairs of (counter column, correlated subquery of its true value)."""
+
+    return [
+        (User.messages_count,
+         _count(Message, Message.user_id == User.id)),
+        (User.following_count,
+         _count(Follows, Follows.user_following_id == User.id)),
+        (User.followers_count,
+         _count(Follows, Follows.user_being_followed_id == User.id)),
+        (User.likes_count,
+         _count(LikedMessage, LikedMessage.user_id == User.id)),
+        (Message.likes_count,
+         _count(LikedMessage, LikedMessage.message_id == Message.id)),
+    ]
+
+
+def reconcile(fix=True):
+    """Find counters that drifted from the rows they count.
+
+    Returns a dict of "table.column" to the number of drifted rows. If `fix`
+    is true the drifted counters are also reset to their true values (the
+    caller commits).
+    """
+
+    drift = {}
+
+    for column, actual in _actual_counts():
+        model = column.class_
+        name = f"{model.__tablename__}.{column.key}"
+
+        drift[name] = (db.session
+                       .query(func.count(model.id))
+                       .filter(column != actual)
+                       .scalar())
+
+        if fix and drift[name]:
+            db.session.execute(
+                update(model)
+                .where(column != actual)
+                .values({column: actual})
+                .execution_options(synchronize_session=False))
+
+    return drift
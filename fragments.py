@@ -0,0 +1,334 @@
+"""Cached rendering of message and user cards.
+
+Templates wrap the parts of a card that look the same to every viewer in
+
+    {% cache 'message', msg.id, msg.updated_at, author.username %}
+      ...
+    {% endcache %}
+
+The first argument names the kind of entity, the second its id and the
+rest make up its version. A lookup whose stored version differs is a miss
+and re-renders, so an edited row is never served stale; each entity keeps
+one entry, so old versions don't pile up. Viewer-specific markup (like and
+follow buttons) stays outside the cached block.
+
+Backends (`FRAGMENT_CACHE`):
+
+- "lru": per worker, bounded by `FRAGMENT_CACHE_SIZE` entries (default)
+- "shared": files under `FRAGMENT_CACHE_DIR` (default: "fragments" in the
+  instance folder), shared by every worker on the host; a fragment
+  rendered by one worker is a hit in the others. Entries are plain text,
+  kept for `FRAGMENT_CACHE_MAX_AGE` seconds and at most
+  `FRAGMENT_CACHE_SIZE` of them. The directory must be private to the
+  app's user: it's created with mode 0700, and one owned by anyone else
+  is refused.
+- "none": always render
+
+Hits and misses are counted per worker (`fragment_cache().hits`) and, for
+requests sampled by instrumentation.py, reported in Server-Timing. Write
+routes call `invalidate()` to drop the entries of rows they change or
+delete. Entries are also keyed by `ETAG_SALT`, which changes on deploys
+that change templates.
+"""
+
+import os
+import tempfile
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from time import time
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from instrumentation import current_stats
+
+DEFAULT_BACKEND = 'lru'
+DEFAULT_CACHE_SIZE = 20000
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+##############################################################################
+# Backends: key -> (version, html)
+
+
+class LRUBackend:
+    """This worker's most recently used `size` fragments."""
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, version, html):
+        with self._lock:
+            self._entries[key] = (version, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileBackend:
+    """Fragments as files in `directory`, shared across processes.
+
+    Each file is the version on its first line and the html after it.
+    Writes go to a temporary file that is renamed into place, so readers
+    in other workers see either the old entry or the new one. Entries older
+    than `max_age` seconds are misses; every `PRUNE_EVERY` writes, expired
+    entries and then the oldest beyond `size` are deleted.
+    """
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, directory, size=DEFAULT_CACHE_SIZE,
+                 max_age=DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.size = size
+        self.max_age = max_age
+        self._writes = 0
+        _private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            blake2b(key.encode(), digest_size=16).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                if time() - os.fstat(f.fileno()).st_mtime > self.max_age:
+                    return None
+                version, newline, html = f.read().partition('\n')
+        except FileNotFoundError:
+            return None
+
+        return (version, html) if newline else None
+
+    def set(self, key, version, html):
+        fd, temp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # versions are reprs, so never contain a newline
+            f.write(f"{version}\n{html}")
+        os.replace(temp, self._path(key))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Delete expired entries, then the oldest beyond `size`."""
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+
+        entries.sort()
+        expired = time() - self.max_age
+        excess = len(entries) - self.size
+
+        for position, (mtime, path) in enumerate(entries):
+            if mtime >= expired and position >= excess:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return len(os.listdir(self.directory))
+
+
+def _private_directory(directory):
+    """Create `directory` with mode 0700, or make sure an existing one is
+    this user's and private: other users mustn't plant entries in it."""
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+
+    if info.st_uid != os.geteuid():
+        raise PermissionError(
+            f"fragment cache directory {directory} belongs to another user")
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+class NullBackend:
+    """Caches nothing."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, version, html):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+##############################################################################
+# Cache
+
+
+class FragmentCache:
+    """Versioned fragments on a backend, with hit/miss counts."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, entity_id):
+        return f"{current_app.config.get('ETAG_SALT', '')}:{kind}:{entity_id}"
+
+    def fetch(self, kind, entity_id, version, render):
+        """The cached html of `kind` `entity_id` at `version`, rendering it
+        with `render()` on a miss."""
+
+        key = self.key(kind, entity_id)
+        version = repr(version)
+        entry = self.backend.get(key)
+        stats = current_stats()
+
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            if stats is not None:
+                stats.fragment_hits += 1
+            return entry[1]
+
+        self.misses += 1
+        if stats is not None:
+            stats.fragment_misses += 1
+
+        html = str(render())
+        self.backend.set(key, version, html)
+        return html
+
+    def invalidate(self, kind, entity_id):
+        self.backend.delete(self.key(kind, entity_id))
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+_fragment_cache = None
+
+
+def fragment_cache():
+    """Return this worker's FragmentCache, built from the app config."""
+
+    global _fragment_cache
+
+    if _fragment_cache is None:
+        config = current_app.config
+        name = config.get('FRAGMENT_CACHE', DEFAULT_BACKEND)
+
+        if name == 'lru':
+            backend = LRUBackend(
+                config.get('FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        elif name == 'shared':
+            backend = FileBackend(
+                config.get('FRAGMENT_CACHE_DIR',
+                           os.path.join(current_app.instance_path,
+                                        'fragments')),
+                size=config.get('FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                max_age=config.get('FRAGMENT_CACHE_MAX_AGE',
+                                   DEFAULT_MAX_AGE))
+        elif name == 'none':
+            backend = NullBackend()
+        else:
+            raise ValueError(f"unknown FRAGMENT_CACHE {name!r}")
+
+        _fragment_cache = FragmentCache(backend)
+
+    return _fragment_cache
+
+
+def reset():
+    """Drop this worker's cache, e.g. after changing FRAGMENT_CACHE."""
+
+    global _fragment_cache
+    _fragment_cache = None
+
+
+def invalidate(kind, entity_id):
+    """Drop the cached fragment of `kind` `entity_id` (after a write)."""
+
+    fragment_cache().invalidate(kind, entity_id)
+
+
+##############################################################################
+# Template tag
+
+
+class FragmentCacheExtension(Extension):
+    """`{% cache kind, id, *version %}...{% endcache %}`"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        kind = parser.parse_expression()
+        parser.stream.expect('comma')
+        entity_id = parser.parse_expression()
+
+        version = []
+        while parser.stream.skip_if('comma'):
+            version.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_fetch', [kind, entity_id,
+                                        nodes.Tuple(version, 'load')]),
+            [], [], body).set_lineno(lineno)
+
+    def _fetch(self, kind, entity_id, version, caller):
+        return Markup(fragment_cache().fetch(kind, entity_id, version,
+                                             caller))
+
+
+def init_app(app):
+    """Enable the `{% cache %}` tag in `app`'s templates."""
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -2,76 +2,295 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --scale 1000 --jobs 8
+
+Output depends only on the arguments (not on --jobs) and needs no network
+access. Popularity follows a power law: a few "celebrity" accounts collect
+most follows and likes, and most users have few. Users and messages get
+explicit ids, and each user's messages have consecutive ids, so likes can
+be drawn without holding every message in memory.
+
+Rows are written by parallel workers in chunks of users, each to its own
+part file, and the parts are then joined in order. Load the result with
+`python loader.py`.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import random
+import shutil
+from array import array
+from datetime import datetime
+from multiprocessing import Pool
+from time import perf_counter
+
+from helpers import (CITIES, DOMAINS, HEADER_IMAGE_URL, IMAGE_URLS, PASSWORD,
+                     WORDS, get_random_datetime, pick, power_law_degree,
+                     sentence, zipf_weights)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password',
+                     'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['message_id', 'user_id']
 
+# row counts at --scale 1
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 3000
 
-fake = Faker()
+# Zipf exponents of how followed/liked and how prolific users are
+POPULARITY_ALPHA = 1.0
+ACTIVITY_ALPHA = 0.8
 
-# Generate random profile image URLs to use for users
+CHUNK_USERS = 10000
 
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
+OUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Plan:
+    """Who is popular and who wrote which message ids, shared by every
+    worker so chunks can be generated independently."""
+
+    def __init__(self, num_users, num_messages, num_follows, num_likes,
+                 celebrities, seed, end):
+        self.num_users = num_users
+        self.seed = seed
+        self.end = end
+        self.follows_per_user = num_follows / num_users
+        self.likes_per_user = num_likes / num_users
+
+        rng = random.Random(f"{seed}:plan")
+
+        # by_popularity[rank] is a user id; rank 0 is the most followed
+        ids = list(range(1, num_users + 1))
+        rng.shuffle(ids)
+        self.by_popularity = array('l', ids)
+        self.popularity = array('d', zipf_weights(
+            num_users, POPULARITY_ALPHA, boosted=celebrities))
+
+        # celebrities post a lot too, but activity is otherwise independent
+        activity_rank = {user_id: rank for rank, user_id in
+                         enumerate(ids[:celebrities] +
+                                   rng.sample(ids[celebrities:],
+                                              num_users - celebrities))}
+        weights = [1.0 / (activity_rank[user_id] + 1) ** ACTIVITY_ALPHA
+                   for user_id in range(1, num_users + 1)]
+        total = sum(weights)
+
+        # user u wrote message ids first_message[u] .. first_message[u+1]-1
+        self.first_message = array('l', [1, 1])
+        for weight in weights:
+            expected = num_messages * weight / total
+            count = int(expected) + (rng.random() < expected % 1)
+            self.first_message.append(self.first_message[-1] + count)
+
+    def messages_of(self, user_id):
+        return range(self.first_message[user_id],
+                     self.first_message[user_id + 1])
+
+    def popular_user(self, rng):
+        return self.by_popularity[pick(rng, self.popularity)]
+
+
+_plan = None
+
+
+def _init_worker(plan):
+    global _plan
+    _plan = plan
+
+
+##############################################################################
+# Chunk writers: each writes the rows for users lo..hi-1 to `path`
+
+
+def write_users(rng, writer, lo, hi):
+    for user_id in range(lo, hi):
+        username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{user_id}"
+        writer.writerow([
+            user_id,
+            f"{username}@{rng.choice(DOMAINS)}",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD,
+            sentence(rng, 3, 12),
+            HEADER_IMAGE_URL,
+            rng.choice(CITIES),
+        ])
+
+
+def write_messages(rng, writer, lo, hi):
+    for user_id in range(lo, hi):
+        for message_id in _plan.messages_of(user_id):
+            writer.writerow([
+                message_id,
+                sentence(rng, 4, 24, MAX_WARBLER_LENGTH),
+                get_random_datetime(rng, _plan.end),
+                user_id,
+            ])
+
+
+def write_follows(rng, writer, lo, hi):
+    cap = _plan.num_users - 1
+
+    for follower in range(lo, hi):
+        wanted = power_law_degree(rng, _plan.follows_per_user, cap)
+        followed = set()
+
+        for _ in range(wanted * 3):
+            if len(followed) == wanted:
+                break
+            user_id = _plan.popular_user(rng)
+            if user_id != follower:
+                followed.add(user_id)
+
+        writer.writerows([user_id, follower] for user_id in sorted(followed))
+
+
+def write_likes(rng, writer, lo, hi):
+    cap = _plan.first_message[-1] - 1
 
-# Generate random header image URLs to use for users
+    for liker in range(lo, hi):
+        wanted = power_law_degree(rng, _plan.likes_per_user, cap)
+        liked = set()
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+        for _ in range(wanted * 3):
+            if len(liked) == wanted:
+                break
+            author = _plan.popular_user(rng)
+            messages = _plan.messages_of(author)
+            # users can't like their own messages
+            if author != liker and messages:
+                liked.add(messages[rng.randrange(len(messages))])
+
+        writer.writerows([message_id, liker] for message_id in sorted(liked))
+
+
+TABLES = [
+    ('users.csv', USERS_CSV_HEADERS, write_users),
+    ('messages.csv', MESSAGES_CSV_HEADERS, write_messages),
+    ('follows.csv', FOLLOWS_CSV_HEADERS, write_follows),
+    ('liked_messages.csv', LIKES_CSV_HEADERS, write_likes),
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def write_chunk(task):
+    """Write one chunk to its part file; returns (path, rows written)."""
+
+    table_index, chunk, lo, hi, path = task
+    filename, _, write = TABLES[table_index]
+    rng = random.Random(f"{_plan.seed}:{filename}:{chunk}")
+
+    with open(path, 'w', newline='') as f:
+        counter = _CountingWriter(csv.writer(f))
+        write(rng, counter, lo, hi)
+
+    return path, counter.rows
+
+
+class _CountingWriter:
+    def __init__(self, writer):
+        self.writer = writer
+        self.rows = 0
+
+    def writerow(self, row):
+        self.rows += 1
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+##############################################################################
+# Main
+
+
+def generate(plan, out_dir=OUT_DIR, jobs=None, report=print):
+    """Write every CSV into `out_dir`; returns {filename: rows}."""
+
+    chunks = [(lo, min(lo + CHUNK_USERS, plan.num_users + 1))
+              for lo in range(1, plan.num_users + 1, CHUNK_USERS)]
+    written = {}
+
+    pool = Pool(jobs, initializer=_init_worker, initargs=(plan,))
+    _init_worker(plan)
+
+    try:
+        for table_index, (filename, headers, _) in enumerate(TABLES):
+            start = perf_counter()
+            path = os.path.join(out_dir, filename)
+            tasks = [(table_index, chunk, lo, hi, f"{path}.{chunk:05}.part")
+                     for chunk, (lo, hi) in enumerate(chunks)]
+            rows = 0
+
+            with open(path, 'w', newline='') as out:
+                csv.writer(out).writerow(headers)
+
+                for part, count in pool.imap(write_chunk, tasks):
+                    with open(part, newline='') as f:
+                        shutil.copyfileobj(f, out)
+                    os.remove(part)
+                    rows += count
+
+            written[filename] = rows
+            elapsed = perf_counter() - start
+            report(f"{filename}: {rows:,} rows in {elapsed:.1f}s "
+                   f"({rows / elapsed:,.0f} rows/s)")
+    finally:
+        pool.close()
+        pool.join()
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help=f"multiply the default row counts ({NUM_USERS} "
+                             f"users, {NUM_MESSAGES} messages, {NUM_FOLLOWS} "
+                             f"follows, {NUM_LIKES} likes)")
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--follows', type=int)
+    parser.add_argument('--likes', type=int)
+    parser.add_argument('--celebrities', type=int,
+                        help="accounts as popular as the most popular one "
+                             "(default: 1 per 10,000 users)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2021, 3, 1),
+                        help="latest message timestamp (messages span the "
+                             "two years before it)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="worker processes")
+    parser.add_argument('--out', default=OUT_DIR)
+    args = parser.parse_args()
+
+    def scaled(value, base):
+        return value if value is not None else max(1, round(base * args.scale))
+
+    num_users = max(2, scaled(args.users, NUM_USERS))
+    celebrities = (args.celebrities if args.celebrities is not None
+                   else max(1, num_users // 10000))
+
+    plan = Plan(num_users=num_users,
+                num_messages=scaled(args.messages, NUM_MESSAGES),
+                num_follows=scaled(args.follows, NUM_FOLLOWS),
+                num_likes=scaled(args.likes, NUM_LIKES),
+                celebrities=min(celebrities, num_users),
+                seed=args.seed,
+                end=args.end)
+
+    generate(plan, args.out, args.jobs)
+
+
+if __name__ == '__main__':
+    main()
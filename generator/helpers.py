@@ -1,14 +1,79 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything takes a `random.Random` so output depends only on the seed.
+"""
 
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+WORDS = """
+    soup bread cheese river mountain coffee garden winter summer music paint
+    code forest ocean city quiet happy lucky morning evening coast train
+    book movie dinner lunch friend family weekend holiday rain sun snow
+    walk run bike dog cat bird tea pizza tomato market concert game team
+    goal idea project deadline office meeting travel flight hotel beach
+    park street bridge night light dream story song dance photo camera
+    recipe kitchen window door road hill lake island desert storm cloud
+    """.split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+CITIES = """
+    Oakland Berkeley Paris Lagos Lima Osaka Denver Austin Boston Seattle
+    Porto Lyon Leeds Accra Quito Hanoi Dublin Oslo Perth Cairo Toronto
+    Madrid Nairobi Chicago Portland Kyoto Bogota Lisbon Prague Vienna
+    """.split()
 
-    return datetime.fromtimestamp(random_timestamp)
+DOMAINS = ["example.com", "example.net", "example.org", "mail.test"]
+
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
+
+HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
+
+# bcrypt of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+
+def get_random_datetime(rng, end, year_gap=2):
+    """Get a random datetime within `year_gap` years before `end`."""
+
+    span = timedelta(days=365 * year_gap).total_seconds()
+    return end - timedelta(seconds=rng.uniform(0, span))
+
+
+def sentence(rng, low, high, limit=None):
+    """A capitalized sentence of `low`..`high` random words."""
+
+    text = " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+    text = text.capitalize() + "."
+    return text[:limit] if limit else text
+
+
+def zipf_weights(n, alpha, boosted=0):
+    """Cumulative Zipf weights for ranks 0..n-1 (rank r gets 1/(r+1)^alpha).
+
+    The first `boosted` ranks all get rank 0's weight.
+    """
+
+    return list(accumulate(
+        1.0 if rank < boosted else 1.0 / (rank + 1) ** alpha
+        for rank in range(n)))
+
+
+def pick(rng, cum_weights):
+    """Index drawn in proportion to the weights behind `cum_weights`."""
+
+    return bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+
+def power_law_degree(rng, mean, cap, shape=2.0):
+    """A heavy-tailed count with roughly `mean` average, at most `cap`.
+
+    Pareto(shape) has mean shape / (shape - 1).
+    """
+
+    scale = mean * (shape - 1) / shape
+    return min(int(scale * rng.paretovariate(shape)), cap)
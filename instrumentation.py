@@ -0,0 +1,179 @@
+"""Per-request SQL instrumentation.
+
+For a sample of requests (`SQL_STATS_SAMPLE_RATE`, 0..1) this counts the
+statements a view runs, times them and totals the rows they fetch, using
+SQLAlchemy engine events. In debug mode, or with `SERVER_TIMING` set, the
+totals go out in a `Server-Timing` header:
+
+    Server-Timing: sql;dur=4.1;desc="3 statements, 52 rows", total;dur=9.8
+
+followed, on pages with cached fragments, by their hits and misses:
+`fragments;desc="18 hits, 2 misses"`.
+
+Sampled requests slower than `SLOW_REQUEST_MS` are logged as one JSON
+object on the "warbler.slow" logger, with their slowest statements and,
+if `SLOW_REQUEST_EXPLAIN` is set, the `EXPLAIN ANALYZE` of the slowest
+SELECTs (PostgreSQL only; the query runs again to be explained).
+
+Pages streamed by streaming.py send their headers before the template
+renders, so their totals only cover the work done before the first byte.
+
+Unsampled requests cost one `g` lookup per statement.
+"""
+
+import json
+import logging
+import random
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger('warbler.slow')
+
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_SLOW_MS = 500
+
+# statements kept per request for the slow log
+MAX_RECORDED = 200
+SLOWEST_LOGGED = 5
+EXPLAINED = 2
+
+
+class RequestStats:
+    """SQL totals for one request."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.statements = 0
+        self.rows = 0
+        self.sql_ms = 0.0
+        self.recorded = []
+        # counted by fragments.py
+        self.fragment_hits = 0
+        self.fragment_misses = 0
+
+    def add(self, statement, parameters, elapsed_ms, rows):
+        self.statements += 1
+        self.rows += rows
+        self.sql_ms += elapsed_ms
+        if len(self.recorded) < MAX_RECORDED:
+            self.recorded.append((elapsed_ms, rows, statement, parameters))
+
+    def elapsed_ms(self):
+        return (perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        timing = (f'sql;dur={self.sql_ms:.2f};'
+                  f'desc="{self.statements} statements, {self.rows} rows", '
+                  f'total;dur={self.elapsed_ms():.2f}')
+
+        if self.fragment_hits or self.fragment_misses:
+            timing += (f', fragments;desc="{self.fragment_hits} hits, '
+                       f'{self.fragment_misses} misses"')
+
+        return timing
+
+    def slowest(self, count=SLOWEST_LOGGED):
+        return sorted(self.recorded, key=lambda stmt: -stmt[0])[:count]
+
+
+def current_stats():
+    """The RequestStats of this request, or None if it isn't sampled."""
+
+    if has_request_context():
+        return g.get('sql_stats')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = current_stats()
+    if stats is None or not conn.info.get('query_started'):
+        return
+
+    elapsed_ms = (perf_counter() - conn.info['query_started'].pop()) * 1000
+    rows = cursor.rowcount if cursor.description is not None else 0
+    stats.add(statement, parameters, elapsed_ms, max(rows, 0))
+
+
+def explain(statement, parameters):
+    """EXPLAIN ANALYZE output of a SELECT, as a list of lines."""
+
+    with db.engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        cursor.execute(f"EXPLAIN ANALYZE {statement}", parameters)
+        plan = [line for (line,) in cursor.fetchall()]
+        connection.connection.rollback()
+
+    return plan
+
+
+def log_slow_request(stats, response, app):
+    record = dict(
+        method=request.method,
+        path=request.full_path.rstrip('?'),
+        endpoint=request.endpoint,
+        status=response.status_code,
+        duration_ms=round(stats.elapsed_ms(), 2),
+        sql_ms=round(stats.sql_ms, 2),
+        statements=stats.statements,
+        rows=stats.rows,
+        slowest=[],
+    )
+
+    can_explain = (app.config.get('SLOW_REQUEST_EXPLAIN')
+                   and db.engine.dialect.name == 'postgresql')
+    explained = 0
+
+    for elapsed_ms, rows, statement, parameters in stats.slowest():
+        entry = dict(sql=statement, ms=round(elapsed_ms, 2), rows=rows)
+
+        if (can_explain and explained < EXPLAINED
+                and statement.lstrip().upper().startswith('SELECT')):
+            try:
+                entry['plan'] = explain(statement, parameters)
+            except Exception as error:
+                entry['plan_error'] = str(error)
+            explained += 1
+
+        record['slowest'].append(entry)
+
+    logger.warning(json.dumps(record, default=str))
+
+
+def init_app(app):
+    """Instrument `app`'s requests and database engine."""
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_sql_stats():
+        rate = app.config.get('SQL_STATS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        if rate >= 1 or random.random() < rate:
+            g.sql_stats = RequestStats()
+
+    @app.after_request
+    def finish_sql_stats(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+
+        if app.debug or app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = stats.server_timing()
+
+        slow_ms = app.config.get('SLOW_REQUEST_MS', DEFAULT_SLOW_MS)
+        if stats.elapsed_ms() >= slow_ms:
+            log_slow_request(stats, response, app)
+
+        return response
@@ -0,0 +1,284 @@
+"""Background jobs, queued in the database.
+
+Write paths that have work to put off add a job in their own transaction:
+
+    jobs.enqueue('purge_user', {'user_id': user.id})
+    db.session.commit()
+
+so the job exists exactly when their writes do, with no broker to run or
+keep in step. Functions become tasks with `@jobs.task()`; their args have
+to be JSON.
+
+`flask jobs-work` (the Procfile's worker) runs them. It claims up to
+`JOB_BATCH_SIZE` ready jobs at a time, lowest `priority` first, with one
+UPDATE ... RETURNING over a `SELECT ... FOR UPDATE SKIP LOCKED`, so any
+number of workers can poll the table without blocking on or double-claiming
+each other's rows. A claim moves the job's `run_at` forward by `JOB_LEASE`
+seconds: a worker that dies mid-job leaves it to be claimed again once that
+passes, so tasks have to be safe to run twice and should finish well within
+the lease (long work re-enqueues itself in parts, like the account purge).
+
+A task's writes commit together with the deletion of its job. A task that
+raises is rolled back and retried after `JOB_BACKOFF` seconds, doubling per
+attempt up to `JOB_BACKOFF_MAX`; after its task's `max_attempts` the job is
+kept with `failed_at` and the error, for `flask jobs-stats` to report.
+Every run is logged with its duration, and each worker keeps per-task
+totals (`Worker.stats`), logged when it stops.
+
+The queue needs PostgreSQL: claims use SKIP LOCKED and UPDATE ...
+RETURNING, which SQLAlchemy doesn't offer on SQLite.
+"""
+
+import logging
+import random
+import traceback
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter, sleep
+
+from flask import current_app
+from sqlalchemy import case, delete, func, select, update
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 100
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_LEASE = 300
+DEFAULT_BACKOFF = 5
+DEFAULT_BACKOFF_MAX = 3600
+
+
+def _config(key, default):
+    return current_app.config.get(key, default)
+
+
+##############################################################################
+# Tasks
+
+
+class Task:
+    __slots__ = ('name', 'function', 'priority', 'max_attempts')
+
+    def __init__(self, name, function, priority, max_attempts):
+        self.name = name
+        self.function = function
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+TASKS = {}
+
+
+def task(name=None, priority=DEFAULT_PRIORITY,
+         max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register the decorated function as a task, by default under its own
+    name. `priority` and `max_attempts` apply to all its jobs."""
+
+    def decorator(function):
+        task_name = name or function.__name__
+        TASKS[task_name] = Task(task_name, function, priority, max_attempts)
+        return function
+
+    return decorator
+
+
+def enqueue(task_name, args=None, priority=None, delay=0):
+    """Add a job running `task_name` with keyword `args` to the session.
+
+    It's queued when the caller commits. `priority` overrides the task's;
+    `delay` (seconds) holds the job back.
+    """
+
+    registered = TASKS[task_name]
+    job = Job(task=task_name,
+              args=args or {},
+              priority=(registered.priority if priority is None
+                        else priority),
+              max_attempts=registered.max_attempts,
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts`
+    times: doubling from JOB_BACKOFF, jittered, at most JOB_BACKOFF_MAX."""
+
+    delay = min(_config('JOB_BACKOFF', DEFAULT_BACKOFF) * 2 ** (attempts - 1),
+                _config('JOB_BACKOFF_MAX', DEFAULT_BACKOFF_MAX))
+    return delay * random.uniform(0.75, 1)
+
+
+##############################################################################
+# Worker
+
+
+class TaskStats:
+    __slots__ = ('runs', 'failures', 'given_up', 'seconds', 'slowest')
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.given_up = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def __repr__(self):
+        mean = self.seconds / self.runs if self.runs else 0
+        return (f"{self.runs} runs, {self.failures} failed, "
+                f"{self.given_up} given up, mean {mean * 1000:.0f}ms, "
+                f"slowest {self.slowest * 1000:.0f}ms")
+
+
+class Worker:
+    """Claims and runs jobs until stopped. Needs an app context."""
+
+    def __init__(self, batch_size=None, poll_interval=None, lease=None):
+        self.batch_size = batch_size or _config('JOB_BATCH_SIZE',
+                                                DEFAULT_BATCH_SIZE)
+        self.poll_interval = (
+            _config('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+            if poll_interval is None else poll_interval)
+        self.lease = lease or _config('JOB_LEASE', DEFAULT_LEASE)
+        self.stats = defaultdict(TaskStats)
+        self.stopping = False
+
+    def stop(self, *args):
+        """Stop once the job running now is done (also a signal handler)."""
+
+        self.stopping = True
+
+    def run(self, burst=False):
+        """Work until stopped, or with `burst` until no job is ready."""
+
+        while not self.stopping:
+            if not self.work() and not self.stopping:
+                if burst:
+                    break
+                sleep(self.poll_interval)
+
+        for name, stats in sorted(self.stats.items()):
+            logger.info("%s: %r", name, stats)
+
+    def work(self):
+        """Claim a batch of ready jobs and run them; returns how many."""
+
+        claimed = self.claim()
+
+        for job in claimed:
+            if self.stopping:
+                # unclaimed, so they don't wait out the lease
+                self._release(job)
+                continue
+            self._run(job)
+
+        return len(claimed)
+
+    def claim(self):
+        now = datetime.utcnow()
+        ready = (select(Job.id)
+                 .where(Job.failed_at.is_(None), Job.run_at <= now)
+                 .order_by(Job.priority, Job.run_at, Job.id)
+                 .limit(self.batch_size)
+                 .with_for_update(skip_locked=True))
+
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id.in_(ready.scalar_subquery()))
+            .values(run_at=now + timedelta(seconds=self.lease),
+                    attempts=Job.attempts + 1)
+            .returning(Job.id, Job.task, Job.args, Job.priority,
+                       Job.attempts, Job.max_attempts)
+            .execution_options(synchronize_session=False)).all()
+        db.session.commit()
+
+        return sorted(claimed, key=lambda job: (job.priority, job.id))
+
+    def _run(self, job):
+        stats = self.stats[job.task]
+        started = perf_counter()
+
+        try:
+            registered = TASKS.get(job.task)
+            if registered is None:
+                raise LookupError(f"no task named {job.task!r}")
+
+            registered.function(**job.args)
+            db.session.execute(delete(Job).where(Job.id == job.id))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+        else:
+            error = None
+
+        elapsed = perf_counter() - started
+        stats.runs += 1
+        stats.seconds += elapsed
+        stats.slowest = max(stats.slowest, elapsed)
+
+        if error is None:
+            logger.info("job %s #%s done in %.0fms (attempt %s)",
+                        job.task, job.id, elapsed * 1000, job.attempts)
+            return
+
+        stats.failures += 1
+        values = {'last_error': error}
+
+        if job.attempts >= job.max_attempts:
+            stats.given_up += 1
+            values['failed_at'] = datetime.utcnow()
+            logger.error("job %s #%s failed for good (attempt %s):\n%s",
+                         job.task, job.id, job.attempts, error)
+        else:
+            delay = backoff(job.attempts)
+            values['run_at'] = datetime.utcnow() + timedelta(seconds=delay)
+            logger.warning("job %s #%s failed (attempt %s), retrying in "
+                           "%.0fs:\n%s", job.task, job.id, job.attempts,
+                           delay, error)
+
+        db.session.execute(update(Job).where(Job.id == job.id).values(values)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+
+    def _release(self, job):
+        db.session.execute(
+            update(Job)
+            .where(Job.id == job.id)
+            .values(run_at=datetime.utcnow(), attempts=Job.attempts - 1)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+
+
+##############################################################################
+# Reporting
+
+
+def queue_stats():
+    """Per task: jobs ready, waiting (delayed, retrying or running), failed,
+    and the age in seconds of the oldest ready job."""
+
+    now = datetime.utcnow()
+    live = Job.failed_at.is_(None)
+    ready = live & (Job.run_at <= now)
+
+    def total(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    rows = (db.session
+            .query(Job.task,
+                   total(ready),
+                   total(live & (Job.run_at > now)),
+                   total(~live),
+                   func.min(case((ready, Job.created_at))))
+            .group_by(Job.task)
+            .order_by(Job.task))
+
+    return [dict(task=name, ready=ready_count or 0, waiting=waiting or 0,
+                 failed=failed or 0,
+                 oldest=(now - oldest).total_seconds() if oldest else None)
+            for (name, ready_count, waiting, failed, oldest) in rows]
@@ -0,0 +1,82 @@
+"""Liking and unliking messages.
+
+A like is set with one statement that can't conflict: an INSERT ... ON
+CONFLICT DO NOTHING, or a DELETE, each RETURNING the row it changed, and
+the counters only move when a row did. Repeated or concurrent requests (a
+double click) leave the like and its counts right instead of raising an
+IntegrityError, and the cost is one primary key lookup however many likes
+the viewer has.
+
+A toggle is one statement too: a DELETE and an INSERT in CTEs, the INSERT
+only running if the DELETE found nothing, so it neither takes two round
+trips nor can be split by a concurrent toggle in between.
+"""
+
+from sqlalchemy import delete, exists, literal, select
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, LikedMessage, Message
+import counters
+
+
+def set_like(user_id, message_id, liked):
+    """Make `user_id` like `message_id`, or not; the caller commits.
+
+    Returns whether that changed anything.
+    """
+
+    if liked:
+        statement = (insert(LikedMessage)
+                     .values(user_id=user_id, message_id=message_id)
+                     .on_conflict_do_nothing())
+    else:
+        statement = (delete(LikedMessage)
+                     .where(LikedMessage.user_id == user_id,
+                            LikedMessage.message_id == message_id))
+
+    changed = db.session.execute(
+        statement.returning(LikedMessage.user_id)).first() is not None
+
+    if changed and liked:
+        counters.like_added(user_id, message_id)
+    elif changed:
+        counters.like_removed(user_id, message_id)
+
+    return changed
+
+
+def toggle_like(user_id, message_id):
+    """Unlike `message_id` if `user_id` likes it, else like it; the caller
+    commits.
+
+    Returns whether it's liked now.
+    """
+
+    unliked = (delete(LikedMessage)
+               .where(LikedMessage.user_id == user_id,
+                      LikedMessage.message_id == message_id)
+               .returning(LikedMessage.user_id)
+               .cte('unliked'))
+    liked = (insert(LikedMessage)
+             .from_select(['user_id', 'message_id'],
+                          select(literal(user_id), literal(message_id))
+                          .where(~exists(select(unliked.c.user_id))))
+             .on_conflict_do_nothing()
+             .returning(LikedMessage.user_id)
+             .cte('liked'))
+
+    removed, added = db.session.execute(
+        select(exists(select(unliked.c.user_id)),
+               exists(select(liked.c.user_id)))).one()
+
+    if removed:
+        counters.like_removed(user_id, message_id)
+    elif added:
+        counters.like_added(user_id, message_id)
+
+    return not removed
+
+
+def likes_count(message_id):
+    return db.session.execute(
+        select(Message.likes_count).where(Message.id == message_id)).scalar()
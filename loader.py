@@ -0,0 +1,294 @@
+"""Bulk-load the generator CSVs into the database.
+
+Rows are streamed from each CSV in batches, never held all at once. On
+PostgreSQL each batch goes in with `COPY ... FROM STDIN`; other backends
+get one executemany INSERT per batch. Run it from the project root:
+
+    python loader.py                      # drop, recreate and load
+    python loader.py --mode upsert        # merge into the existing data
+    python loader.py --dir /data/warbler --batch 100000
+
+replace mode (the default) drops every table, loads into tables without
+their foreign keys and secondary indexes, then builds those once at the
+end. upsert mode leaves the schema alone and merges each batch through a
+temporary table: users are matched by `id` (or `username` if the CSV has
+no ids), messages by `id` (appended if the CSV has no ids), and follows
+and likes that already exist are skipped.
+
+Either way the counter columns, message search documents and planner
+statistics are brought up to date afterwards.
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+from sqlalchemy import DateTime, Integer, inspect, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import AddConstraint
+
+from models import db, User, Message, Follows, LikedMessage
+import counters
+import search
+
+DEFAULT_DIR = 'generator'
+DEFAULT_BATCH = 50000
+
+# CSV file, model and the columns an upsert matches existing rows on,
+# in load order
+SOURCES = [
+    ('users.csv', User, ('id',), ('username',)),
+    ('messages.csv', Message, ('id',), None),
+    ('follows.csv', Follows,
+     ('user_being_followed_id', 'user_following_id'), None),
+    ('liked_messages.csv', LikedMessage, ('message_id', 'user_id'), None),
+]
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def read_batches(path, batch_size):
+    """Yield (header, rows) for `path` in lists of up to `batch_size`."""
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+
+        while True:
+            rows = list(islice(reader, batch_size))
+            if not rows:
+                return
+            yield header, rows
+
+
+def conflict_key(header, keys, fallback):
+    """The columns of `header` an upsert can match rows on, if any."""
+
+    if all(key in header for key in keys):
+        return keys
+    if fallback and all(key in header for key in fallback):
+        return fallback
+    return None
+
+
+##############################################################################
+# PostgreSQL: COPY
+
+
+def _copy(cursor, table_name, header, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    columns = ", ".join(f'"{name}"' for name in header)
+    cursor.copy_expert(
+        f'COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def copy_batch(table, header, rows, key=None):
+    """COPY `rows` into `table`; if `key` is given, merge them on it."""
+
+    cursor = db.session.connection().connection.cursor()
+
+    if key is None:
+        _copy(cursor, table.name, header, rows)
+        return
+
+    cursor.execute(
+        f'CREATE TEMP TABLE IF NOT EXISTS "stage_{table.name}" '
+        f'(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+    _copy(cursor, f'"stage_{table.name}"', header, rows)
+
+    columns = ", ".join(f'"{name}"' for name in header)
+    updates = [name for name in header if name not in key]
+    if updates:
+        action = "DO UPDATE SET " + ", ".join(
+            f'"{name}" = EXCLUDED."{name}"' for name in updates)
+    else:
+        action = "DO NOTHING"
+
+    cursor.execute(
+        f'INSERT INTO {table.name} ({columns}) '
+        f'SELECT {columns} FROM "stage_{table.name}" '
+        f'ON CONFLICT ({", ".join(key)}) {action}')
+    cursor.execute(f'TRUNCATE "stage_{table.name}"')
+
+
+def reset_sequences(tables):
+    """Move id sequences past ids loaded explicitly from the CSVs."""
+
+    for table in tables:
+        if 'id' in table.c and table.c.id.autoincrement:
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 1), max(id) IS NOT NULL) "
+                f"FROM {table.name}"))
+
+
+##############################################################################
+# Other backends: executemany
+
+
+def _converter(column):
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, Integer):
+        return int
+    return str
+
+
+def insert_batch(table, header, rows, key=None):
+    """INSERT `rows` with one executemany; with `key`, skip duplicates."""
+
+    convert = [_converter(table.c[name]) for name in header]
+    records = [{name: fn(value) if value != '' else None
+                for name, fn, value in zip(header, convert, row)}
+               for row in rows]
+
+    if key is not None and db.engine.dialect.name == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    else:
+        statement = table.insert()
+
+    db.session.execute(statement, records)
+
+
+##############################################################################
+# Deferred indexes and constraints
+
+
+def drop_deferred(tables):
+    """Drop the foreign keys and secondary indexes of `tables`; return
+    them for `create_deferred`."""
+
+    deferred = []
+    connection = db.session.connection()
+    inspector = inspect(connection)
+
+    for table in tables:
+        # the models don't name their foreign keys; the database did
+        for fk in inspector.get_foreign_keys(table.name):
+            connection.execute(text(
+                f'ALTER TABLE {table.name} DROP CONSTRAINT "{fk["name"]}"'))
+        deferred.extend(AddConstraint(fk)
+                        for fk in table.foreign_key_constraints)
+        for index in table.indexes:
+            index.drop(connection)
+            deferred.append(index)
+
+    return deferred
+
+
+def create_deferred(deferred, report):
+    connection = db.session.connection()
+
+    for item in deferred:
+        start = perf_counter()
+        if isinstance(item, AddConstraint):
+            connection.execute(item)
+            name = item.element.name or f"fk on {item.element.parent.name}"
+        else:
+            item.create(connection)
+            name = item.name
+        report(f"built {name} in {perf_counter() - start:.1f}s")
+
+
+##############################################################################
+# Loading
+
+
+def load(directory=DEFAULT_DIR, mode='replace', batch_size=DEFAULT_BATCH,
+         report=print):
+    """Load the CSVs in `directory`; returns {table name: rows loaded}."""
+
+    postgres = is_postgres()
+    sources = [(os.path.join(directory, filename), model.__table__, keys,
+                fallback)
+               for filename, model, keys, fallback in SOURCES
+               if os.path.exists(os.path.join(directory, filename))]
+    tables = [table for (_, table, _, _) in sources]
+
+    deferred = []
+    if mode == 'replace':
+        db.drop_all()
+        db.create_all()
+        if postgres:
+            deferred = drop_deferred(tables)
+            db.session.commit()
+
+    loaded = {}
+
+    for path, table, keys, fallback in sources:
+        start = perf_counter()
+        count = 0
+
+        for header, rows in read_batches(path, batch_size):
+            key = (conflict_key(header, keys, fallback)
+                   if mode == 'upsert' else None)
+            if postgres:
+                copy_batch(table, header, rows, key)
+            else:
+                insert_batch(table, header, rows, key)
+            db.session.commit()
+
+            count += len(rows)
+            elapsed = perf_counter() - start
+            report(f"{table.name}: {count:,} rows "
+                   f"({count / elapsed:,.0f} rows/s)")
+
+        loaded[table.name] = count
+
+    if postgres:
+        reset_sequences(tables)
+        db.session.commit()
+
+    report(f"search documents: {search.reindex_messages():,} messages")
+
+    create_deferred(deferred, report)
+    db.session.commit()
+
+    drift = counters.reconcile()
+    db.session.commit()
+    report("counters: " + ", ".join(f"{name} {rows:,} fixed"
+                                    for name, rows in drift.items()))
+
+    if postgres:
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+    return loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--dir', default=DEFAULT_DIR,
+                        help="directory holding the CSVs")
+    parser.add_argument('--mode', choices=('replace', 'upsert'),
+                        default='replace')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH,
+                        help="rows per COPY/INSERT")
+    args = parser.parse_args(argv)
+
+    from app import app
+
+    start = perf_counter()
+
+    with app.app_context():
+        loaded = load(args.dir, args.mode, args.batch,
+                      report=lambda line: print(line, file=sys.stderr))
+
+    total = sum(loaded.values())
+    elapsed = perf_counter() - start
+    print(f"loaded {total:,} rows in {elapsed:.1f}s "
+          f"({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Named eager-loading profiles for User and Message queries.
+
+Templates walk relationships (`msg.user.username`, ...) that would
+otherwise be lazy-loaded one row at a time. Each route opts into the
+profile matching what its template touches:
+
+    Message.query.options(*loaders.options('timeline'))
+"""
+
+from sqlalchemy.orm import joinedload, load_only
+
+from models import Message, User
+
+_PROFILES = {
+    # message lists showing each author's name and avatar
+    'timeline': lambda: [
+        joinedload(Message.user).load_only(
+            User.id, User.username, User.image_url),
+    ],
+
+    # a single message page, which also shows follow buttons for the author
+    'message': lambda: [
+        joinedload(Message.user),
+    ],
+
+    # the user shown in a profile page header; collections are paged
+    # separately and counts come from the counter columns
+    'profile': lambda: [
+        load_only(User.id, User.username, User.image_url,
+                  User.header_image_url, User.bio, User.location,
+                  User.messages_count, User.following_count,
+                  User.followers_count, User.likes_count),
+    ],
+
+    # user cards on /users, followers and following
+    'listing': lambda: [
+        load_only(User.id, User.username, User.image_url,
+                  User.header_image_url, User.bio, User.updated_at),
+    ],
+}
+
+
+def options(name):
+    """Return the loader options of the profile called `name`."""
+
+    return _PROFILES[name]()
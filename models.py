@@ -2,10 +2,11 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+import passwords
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -26,6 +27,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with the followed user; this serves lookups
+    # of who a user follows
+    __table_args__ = (
+        db.Index('ix_follows_follower',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -73,6 +81,53 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept up to date by the views that change them
+    # (see counters.py) so pages don't load whole collections to count them.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # bumped by every UPDATE, ORM or bulk (counters too); conditional GETs
+    # use it as the row's version (see conditional.py)
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # set when the account is deleted; its rows are removed later, a batch
+    # at a time, and the user row last (see purge.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
 
     likes = db.relationship('Message', secondary="liked_messages")
@@ -91,20 +146,73 @@ class User(db.Model):
         secondaryjoin=(Follows.user_being_followed_id == id)
     )
 
+    __table_args__ = (
+        # the purge's queue; live users aren't in it
+        db.Index('ix_users_deleted', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @classmethod
+    def active(cls):
+        """Query of users that haven't deleted their account."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follow_state([other_user.id])[1]
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follow_state([other_user.id])[0]
+
+    def follow_state(self, user_ids):
+        """Which of `user_ids` does this user follow, and which follow them?
+
+        Returns a pair of sets (following, followers) using a single query
+        over the follows primary key, however big either list is.
+        """
+
+        following = set()
+        followers = set()
+
+        if not user_ids:
+            return following, followers
+
+        user_ids = list(user_ids)
+        rows = (db.session
+                .query(Follows.user_following_id,
+                       Follows.user_being_followed_id)
+                .filter(((Follows.user_following_id == self.id) &
+                         Follows.user_being_followed_id.in_(user_ids)) |
+                        ((Follows.user_being_followed_id == self.id) &
+                         Follows.user_following_id.in_(user_ids))))
+
+        for follower_id, followed_id in rows:
+            if follower_id == self.id:
+                following.add(followed_id)
+            if followed_id == self.id:
+                followers.add(follower_id)
+
+        return following, followers
+
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set."""
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(LikedMessage.message_id)
+                .filter(LikedMessage.user_id == self.id,
+                        LikedMessage.message_id.in_(list(message_ids))))
+
+        return {message_id for (message_id,) in rows}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -113,7 +221,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -134,13 +242,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with an outdated cost is replaced with a fresh one; the
+        caller commits.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -165,7 +278,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -174,10 +287,43 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # full-text search document (PostgreSQL only; see search.py)
+    search_vector = db.Column(
+        TSVECTOR().with_variant(db.Text(), 'sqlite'),
+    )
+
     user = db.relationship('User')
 
     users_liked = db.relationship('User', secondary="liked_messages")
 
+    __table_args__ = (
+        db.Index('ix_messages_user_recent', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+    )
+
+    @classmethod
+    def visible(cls):
+        """Query of messages whose author hasn't deleted their account
+        (they stay until the account's purge reaches them)."""
+
+        return cls.query.filter(cls.user.has(deleted_at=None))
+
     def check_valid_like(self, user):
 
         return self.user_id != user.id
@@ -203,6 +349,119 @@ class LikedMessage(db.Model):
         primary_key=True
     )
 
+    # the primary key leads with the message; this serves a user's likes
+    __table_args__ = (
+        db.Index('ix_liked_messages_user', 'user_id', 'message_id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written on message creation (fan-out-on-write) for the author
+    and each of their followers, so the home page can read one ordered slice
+    instead of querying every followed user's messages.
+    """
+
+    __tablename__ = "timeline_entries"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_recent',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+
+class Job(db.Model):
+    """Deferred work for the job worker (see jobs.py).
+
+    A job is ready once `run_at` has passed; claiming it moves `run_at` to
+    the end of its lease. Jobs are deleted when they succeed, and kept with
+    `failed_at` set once they run out of attempts.
+    """
+
+    __tablename__ = "jobs"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    task = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # lower runs first
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        default=100,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    failed_at = db.Column(
+        db.DateTime,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # the claim's ORDER BY, over live jobs only
+    __table_args__ = (
+        db.Index('ix_jobs_ready', 'priority', 'run_at', 'id',
+                 postgresql_where=db.text('failed_at IS NULL')),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.task} {self.args}>"
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
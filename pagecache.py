@@ -0,0 +1,242 @@
+"""Whole-response cache for logged-out visitors.
+
+Anonymous GETs of the homepage, profiles, messages and /users render the
+same HTML for everyone, so views decorated with `@anonymous(...)` keep
+their 200 responses per worker, keyed by path and query string:
+
+- younger than `PAGE_CACHE_TTL` seconds: served as is
+- up to `PAGE_CACHE_STALE` seconds older: served as is, and re-rendered
+  once the stale response has been sent (stale-while-revalidate), so a
+  spike on a popular page never waits on the database
+- older: rendered again
+
+Entries carry tags ("user:5", "message:9", "users") naming what they show.
+Write routes `purge()` the tags they change; other workers keep their copy
+until it goes stale, so `PAGE_CACHE_TTL` bounds how long a write can go
+unseen there. Requests with a logged-in user or a pending flash message
+skip the cache, as does anything that sets a cookie.
+"""
+
+import logging
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, g, make_response, request, session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30
+DEFAULT_STALE = 300
+DEFAULT_SIZE = 2000
+
+# set in the environ of the request re-rendering a stale entry
+REFRESH = 'warbler.page_cache.refresh'
+
+
+class Entry:
+    __slots__ = ('stored', 'body', 'status', 'headers', 'tags', 'refreshing')
+
+    def __init__(self, response, tags):
+        self.stored = monotonic()
+        self.body = response.get_data()
+        self.status = response.status_code
+        self.headers = [(name, value) for (name, value) in response.headers
+                        if name not in ('Set-Cookie', 'Content-Length')]
+        self.tags = tags
+        self.refreshing = False
+
+    def response(self):
+        response = current_app.response_class(self.body, status=self.status,
+                                              headers=self.headers)
+        response.age = int(monotonic() - self.stored)
+        return response
+
+
+class PageCache:
+    """LRU of anonymous responses by URL, purged by tag."""
+
+    def __init__(self, ttl=DEFAULT_TTL, stale=DEFAULT_STALE,
+                 size=DEFAULT_SIZE):
+        self.ttl = ttl
+        self.stale = stale
+        self.size = size
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tagged = {}
+        self._lock = Lock()
+
+    def lookup(self, key):
+        """(entry, needs_refresh) for `key`, or (None, False) on a miss.
+
+        Only the first caller to see an entry go stale is told to refresh.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            age = entry and monotonic() - entry.stored
+
+            if entry is None or age >= self.ttl + self.stale:
+                self.misses += 1
+                return None, False
+
+            self._entries.move_to_end(key)
+
+            if age < self.ttl:
+                self.hits += 1
+                return entry, False
+
+            self.stale_hits += 1
+            refresh = not entry.refreshing
+            entry.refreshing = True
+            return entry, refresh
+
+    def store(self, key, response, tags):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = Entry(response, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.size:
+                self._discard(next(iter(self._entries)))
+
+    def refresh_done(self, key):
+        """Drop `key` if the refresh didn't store a new entry for it."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.refreshing:
+                self._discard(key)
+
+    def purge(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tagged.pop(tag, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry.tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_page_cache = None
+
+
+def page_cache():
+    """Return this worker's PageCache, built from the app config."""
+
+    global _page_cache
+
+    if _page_cache is None:
+        config = current_app.config
+        _page_cache = PageCache(
+            ttl=config.get('PAGE_CACHE_TTL', DEFAULT_TTL),
+            stale=config.get('PAGE_CACHE_STALE', DEFAULT_STALE),
+            size=config.get('PAGE_CACHE_SIZE', DEFAULT_SIZE))
+
+    return _page_cache
+
+
+def reset():
+    """Drop this worker's cache, e.g. after changing its config."""
+
+    global _page_cache
+    _page_cache = None
+
+
+def purge(*tags):
+    """Drop this worker's cached pages tagged with any of `tags`."""
+
+    if _page_cache is not None:
+        _page_cache.purge(*tags)
+
+
+def tag(*tags):
+    """Add `tags` to the page being rendered, for tags that are only known
+    once the view has loaded its rows."""
+
+    g.setdefault('page_tags', []).extend(tags)
+
+
+def _refresh(app, environ, key):
+    """Render a stale page again, after its response has been sent."""
+
+    environ = {name: value for (name, value) in environ.items()
+               if name not in ('werkzeug.request', 'HTTP_IF_NONE_MATCH',
+                               'HTTP_IF_MODIFIED_SINCE')}
+    environ[REFRESH] = True
+
+    try:
+        with app.request_context(environ):
+            app.full_dispatch_request()
+    except Exception:
+        logger.exception("refreshing %s failed", key)
+
+    # not stored again (an error, a 404 now...): stop serving it
+    with app.app_context():
+        page_cache().refresh_done(key)
+
+
+def anonymous(*tags):
+    """Cache the decorated view's anonymous GET responses.
+
+    `tags` are formatted with the view's arguments, e.g. "user:{user_id}".
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if (request.method != 'GET' or g.user
+                    or session.get('_flashes')
+                    or not current_app.config.get('PAGE_CACHE_ENABLED',
+                                                  True)):
+                return view(**kwargs)
+
+            cache = page_cache()
+            key = current_app.config.get('ETAG_SALT', '') + request.full_path
+
+            if not request.environ.get(REFRESH):
+                entry, refresh = cache.lookup(key)
+
+                if entry is not None:
+                    response = entry.response().make_conditional(request)
+                    if refresh:
+                        app = current_app._get_current_object()
+                        environ = request.environ
+                        response.call_on_close(
+                            lambda: _refresh(app, environ, key))
+                    return response
+
+            response = make_response(view(**kwargs))
+
+            if (response.status_code == 200
+                    and 'Set-Cookie' not in response.headers):
+                cache.store(key, response,
+                            [pattern.format(**kwargs) for pattern in tags]
+                            + g.get('page_tags', []))
+
+            return response
+
+        return wrapper
+
+    return decorator
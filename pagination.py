@@ -0,0 +1,131 @@
+"""Keyset (cursor) pagination for Warbler list pages.
+
+Pages are addressed by the sort key of an edge row rather than an offset,
+so fetching page 1000 costs the same as fetching page 1:
+
+- `?before=<cursor>` returns the rows that sort after the cursor (older
+  messages, or higher user ids);
+- `?after=<cursor>` returns the rows that sort before it (newer messages).
+
+Every ordering ends in a primary key, so rows that share a timestamp still
+have a stable, total order.
+"""
+
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import tuple_
+
+PER_PAGE = 50
+CURSOR_SEP = "_"
+
+
+class Page:
+    """One page of results plus the cursors of its neighbours."""
+
+    def __init__(self, items, before=None, after=None):
+        self.items = items
+        self.before = before
+        self.after = after
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Turn a sort key tuple into a URL-safe cursor string."""
+
+    return CURSOR_SEP.join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values)
+
+
+def decode_cursor(cursor, types):
+    """Parse `cursor` back into a tuple of `types`. Aborts 400 if invalid."""
+
+    parts = cursor.split(CURSOR_SEP)
+
+    if len(parts) != len(types):
+        abort(400)
+
+    try:
+        return tuple(
+            datetime.fromisoformat(part) if type_ is datetime else type_(part)
+            for part, type_ in zip(parts, types))
+    except ValueError:
+        abort(400)
+
+
+def paginate(query, columns, per_page=PER_PAGE, descending=True,
+             key=None):
+    """Return a Page of `query` ordered by `columns`.
+
+    `columns` are the sort key columns, ending with a unique one. The cursor
+    is read from the request's `before`/`after` arguments. `key` maps a
+    result row to its sort key tuple; by default the column attributes of
+    the row are read.
+    """
+
+    if key is None:
+        key = (lambda row: tuple(getattr(row, column.key)
+                                 for column in columns))
+
+    rows = window(query, columns, per_page, descending).all()
+    return page_of(rows, per_page, key)
+
+
+def page_of(rows, per_page, key):
+    """Make a Page of `rows` read as `window` reads them for this request:
+    up to `per_page + 1`, nearest the cursor first. `key` maps a row to its
+    sort key tuple.
+    """
+
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if after:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(before), has_more
+
+    return Page(
+        rows,
+        before=encode_cursor(key(rows[-1])) if rows and has_older else None,
+        after=encode_cursor(key(rows[0])) if rows and has_newer else None,
+    )
+
+
+def window(query, columns, per_page=PER_PAGE, descending=True):
+    """`query` limited to the rows `paginate` reads for this request: the
+    page plus one row to tell whether there's another.
+
+    Conditional GETs (see conditional.py) use this to version a page
+    without loading it.
+    """
+
+    types = [column.type.python_type for column in columns]
+    before = request.args.get('before')
+    after = request.args.get('after')
+    row_key = tuple_(*columns)
+
+    if after:
+        cursor = decode_cursor(after, types)
+        # walk backwards from the cursor, then flip back into page order
+        query = query.filter(
+            row_key > cursor if descending else row_key < cursor)
+        order = [c.asc() if descending else c.desc() for c in columns]
+    else:
+        if before:
+            cursor = decode_cursor(before, types)
+            query = query.filter(
+                row_key < cursor if descending else row_key > cursor)
+        order = [c.desc() if descending else c.asc() for c in columns]
+
+    return query.order_by(*order).limit(per_page + 1)
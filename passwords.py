@@ -0,0 +1,169 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately slow, so hashes are computed on a small per-worker
+thread pool (bcrypt releases the GIL while it works). The pool admits at
+most `workers + queue` hashes at a time; past that `hash_password` and
+`check_password` raise `PoolBusy` at once instead of letting logins pile
+up behind each other, and the app answers 503.
+
+That only helps with a threaded server. The pool's threads don't free the
+request's thread, which waits on the hash, so under gunicorn's default sync
+workers (one request per process at a time) there is never more than one
+hash per process and `PoolBusy` can't happen. The Procfile runs gthread
+workers, whose `--threads` should stay above the pool's `workers + queue`:
+a burst of logins then takes at most that many threads and the rest keep
+serving pages.
+
+The cost is `BCRYPT_LOG_ROUNDS`. If `BCRYPT_TARGET_MS` is set, `init_app`
+instead picks the highest cost whose hash takes at most that long on this
+machine. Hashes made with a lower cost are upgraded on the next login
+(see `User.authenticate`).
+"""
+
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+DEFAULT_QUEUE = 16
+
+# cost used to time this machine; cheap, but slow enough to measure
+CALIBRATION_ROUNDS = 8
+
+
+class PoolBusy(Exception):
+    """Too many passwords are waiting to be hashed; try again later."""
+
+
+class HashPool:
+    """Thread pool that runs bcrypt, rejecting work beyond a queue limit."""
+
+    def __init__(self, workers=None, queue=DEFAULT_QUEUE):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = queue
+        self._slots = BoundedSemaphore(self.workers + queue)
+        self._executor = ThreadPoolExecutor(self.workers,
+                                            thread_name_prefix='bcrypt')
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for its result."""
+
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy()
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_settings = dict(rounds=DEFAULT_ROUNDS, workers=None, queue=DEFAULT_QUEUE)
+_pool = None
+_pool_pid = None
+_pool_lock = Lock()
+
+
+def init_app(app):
+    """Read the hashing settings from `app.config`, calibrating if asked."""
+
+    target_ms = app.config.get('BCRYPT_TARGET_MS')
+
+    if target_ms:
+        app.config['BCRYPT_LOG_ROUNDS'] = calibrate(float(target_ms))
+        logger.info("bcrypt cost calibrated to %s for %sms",
+                    app.config['BCRYPT_LOG_ROUNDS'], target_ms)
+
+    _settings.update(
+        rounds=int(app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)),
+        workers=app.config.get('PASSWORD_POOL_WORKERS'),
+        queue=app.config.get('PASSWORD_POOL_QUEUE', DEFAULT_QUEUE))
+
+
+def calibrate(target_ms, samples=3):
+    """Return the highest cost whose hash takes at most `target_ms` here.
+
+    Each extra round doubles the work, so one timing at a cheap cost is
+    enough to extrapolate. The result is clamped to MIN_ROUNDS..MAX_ROUNDS.
+    """
+
+    salt = bcrypt.gensalt(CALIBRATION_ROUNDS)
+    elapsed = []
+
+    for _ in range(samples):
+        start = perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        elapsed.append((perf_counter() - start) * 1000)
+
+    doublings = math.floor(math.log2(target_ms / min(elapsed)))
+
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, CALIBRATION_ROUNDS + doublings))
+
+
+def rounds():
+    """The bcrypt cost new hashes are made with."""
+
+    return _settings['rounds']
+
+
+def hash_pool():
+    """Return this process's HashPool (a new one after a fork)."""
+
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = HashPool(workers=_settings['workers'],
+                             queue=_settings['queue'])
+            _pool_pid = os.getpid()
+
+    return _pool
+
+
+def _hash(password, cost):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(cost)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_password(password):
+    """Return the bcrypt hash of `password` as a str."""
+
+    return hash_pool().run(_hash, password, rounds())
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt hash `hashed`?"""
+
+    return hash_pool().run(_check, hashed, password)
+
+
+def cost_of(hashed):
+    """The cost a bcrypt hash was made with: "$2b$12$..." -> 12."""
+
+    return int(hashed.split('$')[2])
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a lower cost than new hashes use?"""
+
+    return cost_of(hashed) < rounds()
@@ -0,0 +1,127 @@
+"""The logged-in user of a request, kept small and cached per worker.
+
+Most requests only need the current user's id, name, pictures and counts
+(for the nav bar and home page aside). Loading a full `User`, with lazy
+relationships, on every request is wasted work, so `g.user` is a slim
+`Principal` served from an LRU+TTL cache. Views that change the user load
+the ORM object with `current_user()`.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, g
+from sqlalchemy.orm import load_only
+
+from models import User
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60
+
+PRINCIPAL_FIELDS = (
+    'id', 'username', 'image_url', 'header_image_url',
+    'messages_count', 'following_count', 'followers_count', 'likes_count',
+)
+
+
+class Principal:
+    """Read-only snapshot of the columns of a `User` that pages show."""
+
+    __slots__ = PRINCIPAL_FIELDS
+
+    def __init__(self, **fields):
+        for name in PRINCIPAL_FIELDS:
+            setattr(self, name, fields[name])
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{name: getattr(user, name) for name in PRINCIPAL_FIELDS})
+
+    def __repr__(self):
+        return f"<Principal #{self.id}: {self.username}>"
+
+    # These User methods only read `self.id`, so they work unchanged on a
+    # Principal and spare loading the full user for follow/like checks.
+    is_following = User.is_following
+    is_followed_by = User.is_followed_by
+    follow_state = User.follow_state
+    liked_message_ids = User.liked_message_ids
+
+
+class PrincipalCache:
+    """LRU cache of Principals by user id whose entries expire after `ttl`.
+
+    The cache is per worker process: other workers see a change once their
+    copy expires, so `ttl` bounds how stale a name or count can be.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Return the Principal for `user_id`, or None if there's no user."""
+
+        now = monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        user = (User.active()
+                .options(load_only(*PRINCIPAL_FIELDS))
+                .filter_by(id=user_id)
+                .first())
+
+        if user is None:
+            return None
+
+        principal = Principal.from_user(user)
+
+        with self._lock:
+            self._entries[user_id] = (now, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_principals = None
+
+
+def principals():
+    """Return this worker's PrincipalCache, built from the app config."""
+
+    global _principals
+
+    if _principals is None:
+        _principals = PrincipalCache(
+            size=current_app.config.get('PRINCIPAL_CACHE_SIZE',
+                                        DEFAULT_CACHE_SIZE),
+            ttl=current_app.config.get('PRINCIPAL_CACHE_TTL',
+                                       DEFAULT_CACHE_TTL))
+
+    return _principals
+
+
+def current_user():
+    """Load the full ORM `User` behind `g.user`, once per request."""
+
+    if 'user_record' not in g:
+        g.user_record = User.query.get(g.user.id) if g.user else None
+
+    return g.user_record
@@ -0,0 +1,202 @@
+"""Purge of deleted accounts.
+
+Deleting an account only sets `users.deleted_at`: the user is gone from
+logins, profiles, listings, search and the API at once, and so are their
+messages, which every listing reads through `Message.visible()` (or the
+same filter) until they're purged. The request doesn't wait on those
+messages, likes and follows, which for a popular account can be hundreds
+of thousands of rows (and as many counter updates). Counters, such as
+their followers' following counts, only catch up as the purge runs.
+
+`purge_deleted()` removes those rows afterwards, `PURGE_BATCH_SIZE` at a
+time. Each batch is one transaction: a DELETE ... RETURNING and the counter
+updates for exactly the rows it returned (see counters.py), so counters
+stay right even if two purges run at once, and no lock is held for longer
+than a batch takes. `PURGE_BATCH_PAUSE` seconds between batches leave the
+database to the site. The rows still there are all the state a purge
+needs, so one that's interrupted carries on where it stopped next time.
+It takes PostgreSQL, for the DELETE ... RETURNING.
+
+Messages go first, as they're most of what those filters hide; the user
+row goes last.
+
+Deleting an account queues a `purge_user` job (see jobs.py), which does
+up to `PURGE_JOB_BATCHES` batches and queues itself again until the user
+is gone. `flask purge-deleted-users` purges every deleted user at once,
+e.g. to sweep up after jobs that failed for good.
+"""
+
+from time import sleep
+
+from flask import current_app
+from sqlalchemy import delete, select, tuple_
+
+import counters
+import jobs
+from models import db, Follows, LikedMessage, Message, TimelineEntry, User
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_PAUSE = 0.1
+DEFAULT_JOB_BATCHES = 100
+
+
+def _delete(model, key, batch):
+    """Delete the `model` rows whose `key` columns are in the `batch`
+    select; returns the keys of the rows deleted."""
+
+    return db.session.execute(
+        delete(model)
+        .where(tuple_(*key).in_(batch))
+        .returning(*key)
+        .execution_options(synchronize_session=False)).all()
+
+
+##############################################################################
+# Steps: each deletes one batch of a user's rows, returning how many
+
+
+def _likes_received(user_id, limit):
+    key = (LikedMessage.user_id, LikedMessage.message_id)
+    pairs = _delete(LikedMessage, key,
+                    select(*key)
+                    .join(Message, Message.id == LikedMessage.message_id)
+                    .where(Message.user_id == user_id)
+                    .limit(limit))
+    counters.likes_removed(pairs)
+    return len(pairs)
+
+
+def _messages(user_id, limit):
+    # their likes are gone already; timeline entries cascade
+    key = (Message.id,)
+    deleted = _delete(Message, key,
+                      select(*key)
+                      .where(Message.user_id == user_id)
+                      .limit(limit))
+    counters.messages_removed(user_id, len(deleted))
+    return len(deleted)
+
+
+def _likes_given(user_id, limit):
+    key = (LikedMessage.user_id, LikedMessage.message_id)
+    pairs = _delete(LikedMessage, key,
+                    select(*key)
+                    .where(LikedMessage.user_id == user_id)
+                    .limit(limit))
+    counters.likes_removed(pairs)
+    return len(pairs)
+
+
+def _following(user_id, limit):
+    key = (Follows.user_following_id, Follows.user_being_followed_id)
+    pairs = _delete(Follows, key,
+                    select(*key)
+                    .where(Follows.user_following_id == user_id)
+                    .limit(limit))
+    counters.follows_removed(pairs)
+    return len(pairs)
+
+
+def _followers(user_id, limit):
+    key = (Follows.user_following_id, Follows.user_being_followed_id)
+    pairs = _delete(Follows, key,
+                    select(*key)
+                    .where(Follows.user_being_followed_id == user_id)
+                    .limit(limit))
+    counters.follows_removed(pairs)
+    return len(pairs)
+
+
+def _timeline(user_id, limit):
+    key = (TimelineEntry.user_id, TimelineEntry.message_id)
+    return len(_delete(TimelineEntry, key,
+                       select(*key)
+                       .where(TimelineEntry.user_id == user_id)
+                       .limit(limit)))
+
+
+STEPS = [
+    ('likes received', _likes_received),
+    ('messages', _messages),
+    ('likes', _likes_given),
+    ('following', _following),
+    ('followers', _followers),
+    ('timeline entries', _timeline),
+]
+
+
+##############################################################################
+# Purging
+
+
+def _is_deleted(user_id):
+    return db.session.query(User.query
+                            .filter(User.id == user_id,
+                                    User.deleted_at.isnot(None))
+                            .exists()).scalar()
+
+
+def purge_user(user_id, batch_size=None, pause=None, max_batches=None):
+    """Delete deleted user `user_id` and their rows, a batch at a time.
+
+    Returns a dict of step name to rows deleted. With `max_batches`, stops
+    after that many, leaving the rest for next time. A user that isn't
+    marked deleted is left alone.
+    """
+
+    config = current_app.config
+    batch_size = batch_size or config.get('PURGE_BATCH_SIZE',
+                                          DEFAULT_BATCH_SIZE)
+    if pause is None:
+        pause = config.get('PURGE_BATCH_PAUSE', DEFAULT_BATCH_PAUSE)
+
+    deleted = {}
+    batches = 0
+
+    if not _is_deleted(user_id):
+        return deleted
+
+    for name, step in STEPS:
+        deleted[name] = 0
+        while True:
+            count = step(user_id, batch_size)
+            db.session.commit()
+            deleted[name] += count
+            batches += 1
+            if count < batch_size:
+                break
+            if max_batches and batches >= max_batches:
+                return deleted
+            sleep(pause)
+
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+
+    return deleted
+
+
+def purge_deleted(batch_size=None, pause=None):
+    """Purge every deleted user, oldest deletion first.
+
+    Yields (user id, rows deleted per step) as each user is done.
+    """
+
+    user_ids = [user_id for (user_id,) in
+                db.session.query(User.id)
+                .filter(User.deleted_at.isnot(None))
+                .order_by(User.deleted_at)]
+    db.session.commit()
+
+    for user_id in user_ids:
+        yield user_id, purge_user(user_id, batch_size, pause)
+
+
+@jobs.task('purge_user', priority=200)
+def purge_user_job(user_id):
+    """Purge part of a deleted user; queues the rest as a new job."""
+
+    purge_user(user_id, max_batches=current_app.config.get(
+        'PURGE_JOB_BATCHES', DEFAULT_JOB_BATCHES))
+
+    if _is_deleted(user_id):
+        jobs.enqueue('purge_user', {'user_id': user_id})
@@ -0,0 +1,659 @@
+"""User search for `/users?q=` and message search for `/messages/search`.
+
+A leading-wildcard LIKE can't use a B-tree index, so substring search over
+users has two backends:
+
+- PostgreSQL with the pg_trgm extension: GIN trigram indexes on username,
+  bio and location serve the ILIKE filter, and `similarity()` ranks hits.
+- Anything else (SQLite, test databases, Postgres without pg_trgm): an
+  in-process n-gram index per worker, built from the users table on first
+  use and kept current by the views that change users. It's rebuilt every
+  `SEARCH_INDEX_TTL` seconds on a background thread, and searches use the
+  old index until the new one is swapped in.
+
+Message search is full-text (whole words) and also has two backends:
+
+- PostgreSQL: a `tsvector` column on messages with a GIN index, filled in
+  as messages are inserted; `flask reindex-messages` fills it for rows that
+  were bulk loaded.
+- Anything else: an in-process inverted index from words to message ids,
+  maintained and rebuilt like the n-gram index.
+
+Hits are ranked by relevance decayed by age. Users are paged by offset, up
+to MAX_RESULTS. Messages are paged by a (rank, id) cursor, like the other
+lists (see pagination.py), for which the rank has to stay put between
+requests: it's the log of the relevance plus the message's age in
+half-lives since the epoch, which orders hits the same as relevance
+decayed to now but doesn't change as now moves.
+"""
+
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import partial
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import abort, current_app, request
+from sqlalchemy import (DDL, Float, event, func, literal, or_, text,
+                        type_coerce)
+
+import loaders
+from models import db, Message, User
+from pagination import Page, PER_PAGE, decode_cursor, page_of, window
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 1000
+NGRAM = 3
+DEFAULT_INDEX_TTL = 300
+
+SEARCH_FIELDS = ('username', 'bio', 'location')
+
+# how much a hit in each field counts towards a result's rank
+FIELD_WEIGHTS = {'username': 2.0, 'bio': 1.0, 'location': 1.0}
+
+TRIGRAM_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS ix_users_{field}_trgm "
+    f"ON users USING gin ({field} gin_trgm_ops)"
+    for field in SEARCH_FIELDS
+]
+
+
+def install_trigram_indexes(connection):
+    """Create pg_trgm and the GIN trigram indexes, if the server allows it.
+
+    Returns whether trigram search is available afterwards.
+    """
+
+    if connection.dialect.name != 'postgresql':
+        return False
+
+    try:
+        with connection.begin_nested():
+            connection.execute(DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for statement in TRIGRAM_INDEXES:
+                connection.execute(DDL(statement))
+    except Exception as exc:
+        logger.warning("trigram search unavailable, using n-gram index: %s",
+                       exc)
+        return False
+
+    return True
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _create_trigram_indexes(target, connection, **kw):
+    install_trigram_indexes(connection)
+
+
+_has_trigram = None
+
+
+def has_trigram():
+    """Is the pg_trgm extension installed in this database?"""
+
+    global _has_trigram
+
+    if _has_trigram is None:
+        _has_trigram = (
+            db.engine.dialect.name == 'postgresql' and
+            db.session.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+            )).first() is not None)
+
+    return _has_trigram
+
+
+def _offset():
+    """Read the result offset from the `before`/`after` page cursors."""
+
+    cursor = request.args.get('before') or request.args.get('after') or 0
+
+    try:
+        offset = int(cursor)
+    except ValueError:
+        abort(400)
+
+    return max(0, min(offset, MAX_RESULTS))
+
+
+def search_users(term, per_page=PER_PAGE):
+    """Return a ranked Page of users whose username, bio or location
+    contain `term`."""
+
+    offset = _offset()
+
+    if has_trigram():
+        users = _trigram_search(term, offset, per_page + 1)
+    else:
+        users = ngram_index().search(term, offset, per_page + 1)
+
+    return _ranked_page(users, offset, per_page)
+
+
+def _ranked_page(results, offset, per_page):
+    """Page `per_page + 1` ranked `results` read from `offset`."""
+
+    has_more = len(results) > per_page and offset + per_page < MAX_RESULTS
+
+    return Page(
+        results[:per_page],
+        before=str(offset + per_page) if has_more else None,
+        after=str(max(offset - per_page, 0)) if offset else None,
+    )
+
+
+def _trigram_search(term, offset, limit):
+    pattern = f"%{_escape_like(term)}%"
+    fields = [getattr(User, field) for field in SEARCH_FIELDS]
+
+    rank = sum(FIELD_WEIGHTS[field.key] *
+               func.similarity(func.coalesce(field, ''), literal(term))
+               for field in fields)
+
+    return (User.active()
+            .options(*loaders.options('listing'))
+            .filter(or_(*(field.ilike(pattern, escape='\\')
+                          for field in fields)))
+            .order_by(rank.desc(), User.id)
+            .offset(offset)
+            .limit(limit)
+            .all())
+
+
+def _escape_like(term):
+    return (term.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+##############################################################################
+# In-process indexes
+
+
+class RebuiltIndex:
+    """Base for the per-worker indexes, rebuilt from the database every
+    `ttl` seconds.
+
+    The first build runs on the request that needs it, as there's nothing
+    to search yet. Later ones run on a background thread, one at a time,
+    while searches keep using the old index; changes made meanwhile are
+    replayed onto the new one when it's swapped in. Subclasses implement
+    `_load()`, which builds a new index without touching this one, and
+    `_swap()`, which takes over its contents with the lock held.
+    """
+
+    def __init__(self, ttl=DEFAULT_INDEX_TTL):
+        self.ttl = ttl
+        self._built_at = None
+        # changes to replay on the build running; None when none is
+        self._changes = None
+        # bumped by clear(), so a build already running is thrown away
+        self._generation = 0
+        self._lock = Lock()
+        # held by the one build running at a time
+        self._build_lock = Lock()
+
+    def _change(self, change):
+        """Apply `change()` now if built, and to the build running if any.
+        Call with the lock held."""
+
+        if self._built_at is not None:
+            change()
+        if self._changes is not None:
+            self._changes.append(change)
+
+    def _cleared(self):
+        """Forget the index. Call with the lock held."""
+
+        self._built_at = None
+        self._generation += 1
+
+    def _ensure_built(self):
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self._build()
+            return
+
+        if monotonic() - self._built_at < self.ttl:
+            return
+        if not self._build_lock.acquire(blocking=False):
+            return
+
+        try:
+            Thread(target=self._build_in_background,
+                   args=(current_app._get_current_object(),),
+                   name=type(self).__name__, daemon=True).start()
+        except BaseException:
+            self._build_lock.release()
+            raise
+
+    def _build_in_background(self, app):
+        try:
+            with app.app_context():
+                self._build()
+        except Exception:
+            logger.exception("%s rebuild failed", type(self).__name__)
+        finally:
+            self._build_lock.release()
+
+    def _build(self):
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+
+        try:
+            fresh = self._load()
+        finally:
+            with self._lock:
+                changes, self._changes = self._changes, None
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._swap(fresh)
+            for change in changes:
+                change()
+            self._built_at = monotonic()
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _swap(self, fresh):
+        raise NotImplementedError
+
+
+##############################################################################
+# In-process n-gram index
+
+
+def ngrams(text, n=NGRAM):
+    """The set of lower-cased n-character substrings of `text`."""
+
+    text = text.lower()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex(RebuiltIndex):
+    """Inverted index from n-grams to the ids of users containing them.
+
+    A query's candidates are the users holding every n-gram of the term;
+    candidates are then checked for the actual substring (n-grams can match
+    out of order) and ranked by which fields matched. Terms shorter than
+    `n` fall back to a scan of the stored documents.
+    """
+
+    def __init__(self, ttl=DEFAULT_INDEX_TTL):
+        super().__init__(ttl)
+        self._postings = defaultdict(set)
+        self._documents = {}
+
+    def search(self, term, offset=0, limit=PER_PAGE):
+        """Return up to `limit` ranked Users matching `term`."""
+
+        self._ensure_built()
+        term = term.lower()
+
+        with self._lock:
+            grams = ngrams(term)
+            if grams:
+                postings = sorted((self._postings.get(gram, set())
+                                   for gram in grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self._documents.keys()
+
+            scored = []
+            for user_id in candidates:
+                score = self._score(self._documents[user_id], term)
+                if score:
+                    scored.append((-score, user_id))
+
+        scored.sort()
+        user_ids = [user_id for (_, user_id) in scored[offset:offset + limit]]
+
+        if not user_ids:
+            return []
+
+        by_id = {user.id: user for user in
+                 User.active()
+                 .options(*loaders.options('listing'))
+                 .filter(User.id.in_(user_ids))}
+
+        return [by_id[user_id] for user_id in user_ids if user_id in by_id]
+
+    def add(self, user):
+        """Index (or re-index) `user`. A no-op until the index is built."""
+
+        values = [getattr(user, field) for field in SEARCH_FIELDS]
+
+        with self._lock:
+            self._change(partial(self._reindex, user.id, values))
+
+    def remove(self, user_id):
+        with self._lock:
+            self._change(partial(self._remove, user_id))
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._cleared()
+
+    def _score(self, document, term):
+        return sum(FIELD_WEIGHTS[field] * (1.5 if value == term else 1)
+                   for field, value in zip(SEARCH_FIELDS, document)
+                   if term in value)
+
+    def _reindex(self, user_id, values):
+        self._remove(user_id)
+        self._add(user_id, values)
+
+    def _add(self, user_id, values):
+        document = tuple((value or '').lower() for value in values)
+        self._documents[user_id] = document
+
+        for value in document:
+            for gram in ngrams(value):
+                self._postings[gram].add(user_id)
+
+    def _remove(self, user_id):
+        document = self._documents.pop(user_id, None)
+
+        for value in document or ():
+            for gram in ngrams(value):
+                self._postings[gram].discard(user_id)
+
+    def _load(self):
+        fresh = NgramIndex(self.ttl)
+        rows = (db.session
+                .query(User.id, *(getattr(User, field)
+                                  for field in SEARCH_FIELDS))
+                .filter(User.deleted_at.is_(None))
+                .yield_per(10000))
+
+        for (user_id, *values) in rows:
+            fresh._add(user_id, values)
+
+        return fresh
+
+    def _swap(self, fresh):
+        self._postings = fresh._postings
+        self._documents = fresh._documents
+
+
+_ngram_index = None
+
+
+def ngram_index():
+    """Return this worker's NgramIndex."""
+
+    global _ngram_index
+
+    if _ngram_index is None:
+        _ngram_index = NgramIndex(
+            ttl=current_app.config.get('SEARCH_INDEX_TTL', DEFAULT_INDEX_TTL))
+
+    return _ngram_index
+
+
+def user_changed(user):
+    """Keep the n-gram index current after `user` was added or edited."""
+
+    if _ngram_index is not None:
+        _ngram_index.add(user)
+
+
+def user_removed(user_id):
+    if _ngram_index is not None:
+        _ngram_index.remove(user_id)
+
+
+##############################################################################
+# Message full-text search
+
+TS_CONFIG = 'english'
+
+# a message's relevance halves every this many days
+RECENCY_HALF_LIFE_DAYS = 30
+# so a day newer adds this to its log rank
+RANK_PER_DAY = math.log(2) / RECENCY_HALF_LIFE_DAYS
+
+EPOCH = datetime(1970, 1, 1)
+# floor for ts_rank_cd, whose log is taken
+MIN_RELEVANCE = 1e-30
+
+REINDEX_BATCH = 5000
+
+WORD_RE = re.compile(r"\w+")
+
+
+def uses_tsvector():
+    return db.engine.dialect.name == 'postgresql'
+
+
+@event.listens_for(Message, 'before_insert')
+def _set_search_vector(mapper, connection, message):
+    """Build the tsvector of each message in the INSERT itself."""
+
+    if connection.dialect.name == 'postgresql':
+        message.search_vector = func.to_tsvector(TS_CONFIG, message.text)
+
+
+def search_messages(term, per_page=PER_PAGE):
+    """Return a Page of messages matching the words of `term`, best and
+    most recent first."""
+
+    if uses_tsvector():
+        rows = _tsvector_search(term, per_page)
+    else:
+        rows = message_index().search(term, per_page + 1,
+                                      **_rank_cursors())
+
+    page = page_of(rows, per_page,
+                   key=lambda row: (row[1], row[0].id))
+    page.items = [message for (message, _) in page.items]
+    return page
+
+
+def _rank_cursors():
+    """The request's `before`/`after` (rank, id) cursors, decoded."""
+
+    return {name: decode_cursor(request.args[name], (float, int))
+            for name in ('before', 'after') if request.args.get(name)}
+
+
+def _tsvector_search(term, per_page):
+    """(Message, rank) rows for this request's page of `term`."""
+
+    query = func.plainto_tsquery(TS_CONFIG, term)
+    relevance = func.greatest(func.ts_rank_cd(Message.search_vector, query),
+                              MIN_RELEVANCE)
+    days = func.extract('epoch', Message.timestamp) / 86400
+    rank = type_coerce(func.ln(relevance) + days * RANK_PER_DAY, Float)
+
+    return window(db.session
+                  .query(Message, rank)
+                  .options(*loaders.options('timeline'))
+                  .filter(Message.search_vector.op('@@')(query),
+                          Message.user.has(deleted_at=None)),
+                  [rank, Message.id], per_page).all()
+
+
+def reindex_messages(only_missing=True):
+    """Rebuild message search documents in batches; returns rows updated.
+
+    On PostgreSQL this fills `search_vector` (only where it is NULL when
+    `only_missing`). Otherwise it rebuilds this process's inverted index.
+    """
+
+    if not uses_tsvector():
+        message_index().clear()
+        message_index().search("")
+        return len(message_index())
+
+    updated = 0
+    last_id = 0
+
+    while True:
+        batch = db.session.query(Message.id).filter(Message.id > last_id)
+        if only_missing:
+            batch = batch.filter(Message.search_vector.is_(None))
+
+        ids = [message_id for (message_id,) in
+               batch.order_by(Message.id).limit(REINDEX_BATCH)]
+        if not ids:
+            return updated
+
+        (Message.query
+         .filter(Message.id.in_(ids))
+         .update({Message.search_vector:
+                  func.to_tsvector(TS_CONFIG, Message.text)},
+                 synchronize_session=False))
+        db.session.commit()
+
+        updated += len(ids)
+        last_id = ids[-1]
+
+
+def words(text):
+    """Lower-cased words of `text`."""
+
+    return WORD_RE.findall(text.lower())
+
+
+class InvertedIndex(RebuiltIndex):
+    """Inverted index from words to the ids of messages containing them.
+
+    Matches must contain every word of the query. They are scored by
+    tf-idf, halved every RECENCY_HALF_LIFE_DAYS of age.
+    """
+
+    def __init__(self, ttl=DEFAULT_INDEX_TTL):
+        super().__init__(ttl)
+        self._postings = defaultdict(dict)
+        self._timestamps = {}
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def search(self, term, limit=PER_PAGE, before=None, after=None):
+        """Return up to `limit` (Message, rank) pairs containing all of
+        `term`, best first; or those ranked below the (rank, id) cursor
+        `before`, or, nearest it first, above `after`."""
+
+        self._ensure_built()
+        query = set(words(term))
+
+        with self._lock:
+            postings = [self._postings.get(word, {}) for word in query]
+            if not postings or not all(postings):
+                return []
+
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            total = len(self._timestamps)
+
+            scored = []
+            for message_id in candidates:
+                relevance = sum(
+                    math.log(1 + total / len(posting)) *
+                    posting[message_id] / (posting[message_id] + 1)
+                    for posting in postings)
+                days = ((self._timestamps[message_id] - EPOCH)
+                        .total_seconds() / 86400)
+                scored.append((math.log(relevance) + days * RANK_PER_DAY,
+                               message_id))
+
+        if after:
+            scored = sorted(key for key in scored if key > after)
+        else:
+            scored = sorted((key for key in scored
+                             if not before or key < before), reverse=True)
+        scored = scored[:limit]
+
+        if not scored:
+            return []
+
+        by_id = {msg.id: msg for msg in
+                 Message.visible()
+                 .options(*loaders.options('timeline'))
+                 .filter(Message.id.in_([message_id for (_, message_id)
+                                         in scored]))}
+
+        return [(by_id[message_id], rank) for (rank, message_id) in scored
+                if message_id in by_id]
+
+    def add(self, message):
+        """Index `message`. A no-op until the index is built."""
+
+        with self._lock:
+            self._change(partial(self._add, message.id, message.text,
+                                 message.timestamp))
+
+    def remove(self, message_id):
+        with self._lock:
+            self._change(partial(self._remove, message_id))
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._timestamps.clear()
+            self._cleared()
+
+    def _add(self, message_id, text, timestamp):
+        self._timestamps[message_id] = timestamp
+        for word, count in Counter(words(text)).items():
+            self._postings[word][message_id] = count
+
+    def _remove(self, message_id):
+        if self._timestamps.pop(message_id, None) is None:
+            return
+        for posting in self._postings.values():
+            posting.pop(message_id, None)
+
+    def _load(self):
+        fresh = InvertedIndex(self.ttl)
+        rows = (db.session
+                .query(Message.id, Message.text, Message.timestamp)
+                .yield_per(10000))
+
+        for (message_id, text, timestamp) in rows:
+            fresh._add(message_id, text, timestamp)
+
+        return fresh
+
+    def _swap(self, fresh):
+        self._postings = fresh._postings
+        self._timestamps = fresh._timestamps
+
+
+_message_index = None
+
+
+def message_index():
+    """Return this worker's InvertedIndex of messages."""
+
+    global _message_index
+
+    if _message_index is None:
+        _message_index = InvertedIndex(
+            ttl=current_app.config.get('SEARCH_INDEX_TTL', DEFAULT_INDEX_TTL))
+
+    return _message_index
+
+
+def message_added(message):
+    """Index a newly committed `message` for non-PostgreSQL backends."""
+
+    if _message_index is not None:
+        _message_index.add(message)
+
+
+def message_removed(message_id):
+    if _message_index is not None:
+        _message_index.remove(message_id)
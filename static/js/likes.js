@@ -0,0 +1,19 @@
+// Like buttons: post the state we want and update the button from the
+// JSON reply, instead of reloading the page. Without this the form still
+// works, as a plain POST that toggles the like.
+$(document).on('submit', '.like-btn-container form', function (event) {
+  event.preventDefault();
+
+  var $form = $(this);
+  var $icon = $form.find('.fa-thumbs-up');
+
+  $.ajax({
+    url: $form.attr('action'),
+    method: 'POST',
+    data: {liked: $icon.hasClass('fas') ? '0' : '1'},
+    dataType: 'json'
+  }).done(function (data) {
+    $icon.toggleClass('fas', data.liked).toggleClass('far', !data.liked);
+    $form.find('.like-count').text(data.likes_count);
+  });
+});
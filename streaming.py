@@ -0,0 +1,162 @@
+"""Streamed rendering of listing pages.
+
+`stream_template()` is Flask 1.1's missing `stream_template`: the template
+is rendered chunk by chunk as the response is sent, so the page head and
+layout go out before the listing's rows have even been queried.
+
+`stream_page()` is `pagination.paginate()` for such pages. Its rows are
+read lazily with `yield_per` (a server-side cursor on PostgreSQL) while
+the template iterates them, `STREAM_BATCH` at a time; `on_batch` is called
+with each batch first, so viewer state (follows, likes) is still loaded
+in one query per batch. Neither the result set nor the document is held in
+memory whole, so time to first byte and peak memory stay flat however
+large a page is.
+
+Views that call these return a streamed response: everything the template
+needs from the request must be read before returning, and
+`stream_with_context` keeps the request (and its db session) alive until
+the last chunk is sent. The session cookie goes out with the headers, so
+a page with flashed messages to show (which the template pops) is rendered
+whole instead, just as pagecache.py won't cache one.
+"""
+
+from itertools import islice
+
+from flask import (Response, current_app, render_template, request, session,
+                   stream_with_context, template_rendered)
+
+from pagination import PER_PAGE, encode_cursor, paginate, window
+
+STREAM_BATCH = PER_PAGE
+# Output is sent in chunks of about STREAM_CHUNK characters, except the
+# first: that goes out at FIRST_CHUNK, so the <head> (and its stylesheet
+# links) reaches the browser before the page's rows are queried.
+FIRST_CHUNK = 512
+STREAM_CHUNK = 8192
+
+
+class StreamingPage:
+    """A `pagination.Page` whose rows are fetched as they're iterated.
+
+    Iterate it once. `before`, `after` and truthiness can be read at any
+    point; reading the cursors before iterating fetches the rest.
+    """
+
+    def __init__(self, query, columns, per_page, descending, key, on_batch):
+        # runs on the first fetch, once the template gets to the rows
+        self._query = (window(query, columns, per_page, descending)
+                       .yield_per(STREAM_BATCH))
+        self._rows = None
+        self._per_page = per_page
+        self._key = key
+        self._on_batch = on_batch
+        self._pending = []
+        self._seen = 0
+        self._first = self._last = None
+        self._has_more = False
+        self._done = False
+        self._had_cursor = bool(request.args.get('before'))
+
+    def _fetch(self):
+        """Read the next batch of this page's rows into `_pending`."""
+
+        if self._rows is None:
+            self._rows = iter(self._query)
+
+        wanted = min(STREAM_BATCH, self._per_page - self._seen)
+        batch = list(islice(self._rows, wanted)) if wanted else []
+
+        if len(batch) < wanted or self._seen + len(batch) == self._per_page:
+            # the row after the page only tells whether there's another
+            self._has_more = next(self._rows, None) is not None
+            self._done = True
+
+        if batch:
+            self._on_batch(batch)
+            if self._first is None:
+                self._first = batch[0]
+            self._last = batch[-1]
+            self._seen += len(batch)
+            self._pending.extend(batch)
+
+    def __iter__(self):
+        while True:
+            if not self._pending:
+                if self._done:
+                    return
+                self._fetch()
+                continue
+
+            yield from self._pending
+            self._pending = []
+
+    def __bool__(self):
+        if not self._pending and not self._done:
+            self._fetch()
+        return self._first is not None
+
+    def _drain(self):
+        while not self._done:
+            self._fetch()
+
+    @property
+    def before(self):
+        self._drain()
+        if self._last is None or not self._has_more:
+            return None
+        return encode_cursor(self._key(self._last))
+
+    @property
+    def after(self):
+        self._drain()
+        if self._first is None or not self._had_cursor:
+            return None
+        return encode_cursor(self._key(self._first))
+
+
+def stream_page(query, columns, per_page=PER_PAGE, descending=True,
+                on_batch=lambda rows: None):
+    """`paginate()` whose rows stream as a StreamingPage.
+
+    Pages walked backwards (`?after=`) come out in reverse and have to be
+    flipped, so those are read whole, as a plain Page.
+    """
+
+    key = (lambda row: tuple(getattr(row, column.key) for column in columns))
+
+    if request.args.get('after'):
+        page = paginate(query, columns, per_page, descending, key=key)
+        on_batch(page.items)
+        return page
+
+    return StreamingPage(query, columns, per_page, descending, key, on_batch)
+
+
+def stream_template(template_name, **context):
+    """A response that renders `template_name` while it's being sent."""
+
+    if session.get('_flashes'):
+        # popped as the page renders, which has to be before the session
+        # is saved
+        return render_template(template_name, **context)
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+
+    def generate():
+        buffer, size, limit = [], 0, FIRST_CHUNK
+
+        for piece in template.generate(context):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= limit:
+                yield ''.join(buffer)
+                buffer, size, limit = [], 0, STREAM_CHUNK
+
+        if buffer:
+            yield ''.join(buffer)
+
+        template_rendered.send(app, template=template, context=context)
+
+    return Response(stream_with_context(generate()))
@@ -0,0 +1,143 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import json
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import api
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        author = User.signup(**TEST_GEN_USER)
+        reader = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        db.session.add_all([Message(text=f'say "{i}"', user_id=author.id)
+                            for i in range(5)])
+        db.session.add(Follows(user_following_id=reader.id,
+                               user_being_followed_id=author.id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.reader_id = reader.id
+        self.msg_ids = sorted(id for (id,) in db.session.query(Message.id))
+
+        db.session.add(LikedMessage(user_id=reader.id,
+                                    message_id=self.msg_ids[0]))
+        db.session.commit()
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_timeline_pages(self):
+        with app.test_client() as c:
+            self.assertEqual(c.get("/api/v1/timeline").status_code, 401)
+
+            self.login(c, self.reader_id)
+            resp = c.get("/api/v1/timeline?limit=3")
+            page = resp.get_json()
+
+            self.assertEqual(resp.mimetype, "application/json")
+            self.assertEqual([msg["id"] for msg in page["data"]],
+                             self.msg_ids[:-4:-1])
+            self.assertEqual(page["data"][0]["username"], "avocadoTOAST")
+            self.assertEqual(page["data"][0]["text"], 'say "4"')
+            self.assertIsNone(page["after"])
+
+            older = c.get(f"/api/v1/timeline?limit=3&before={page['before']}")
+            self.assertEqual([msg["id"] for msg in older.get_json()["data"]],
+                             self.msg_ids[1::-1])
+
+    def test_sparse_fields(self):
+        with app.test_client() as c:
+            resp = c.get(f"/api/v1/users/{self.author_id}/messages"
+                         f"?fields=text,username&limit=1")
+            self.assertEqual(resp.get_json()["data"], [
+                {"text": 'say "4"', "username": "avocadoTOAST"}])
+
+            resp = c.get(f"/api/v1/users/{self.author_id}?fields=id,bio")
+            self.assertEqual(resp.get_json(), {"id": self.author_id,
+                                               "bio": None})
+
+            resp = c.get(f"/api/v1/users/{self.author_id}?fields=password")
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn("password", resp.get_json()["error"])
+
+    def test_ndjson_export(self):
+        with app.test_client() as c:
+            resp = c.get(f"/api/v1/users/{self.author_id}/messages",
+                         headers={"Accept": "application/x-ndjson"})
+            lines = resp.get_data(as_text=True).splitlines()
+
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            self.assertEqual([json.loads(line)["id"] for line in lines],
+                             self.msg_ids[::-1])
+
+    def test_ndjson_batches(self):
+        old_batch = api.EXPORT_BATCH
+        api.EXPORT_BATCH = 2
+        try:
+            with app.test_client() as c:
+                resp = c.get(f"/api/v1/users/{self.author_id}/messages"
+                             f"?format=ndjson&fields=id")
+                ids = [json.loads(line)["id"]
+                       for line in resp.get_data(as_text=True).splitlines()]
+        finally:
+            api.EXPORT_BATCH = old_batch
+
+        self.assertEqual(ids, self.msg_ids[::-1])
+
+    def test_follows_and_likes(self):
+        with app.test_client() as c:
+            self.login(c, self.author_id)
+
+            followers = c.get(f"/api/v1/users/{self.author_id}/followers"
+                              f"?fields=id,username").get_json()
+            self.assertEqual(followers["data"], [
+                {"id": self.reader_id, "username": "TJSMAKESTHEBESTONES"}])
+
+            following = c.get(f"/api/v1/users/{self.reader_id}/following"
+                              f"?fields=id").get_json()
+            self.assertEqual(following["data"], [{"id": self.author_id}])
+
+            likes = c.get(f"/api/v1/users/{self.reader_id}/likes"
+                          f"?fields=id").get_json()
+            self.assertEqual(likes["data"], [{"id": self.msg_ids[0]}])
+
+    def test_message(self):
+        with app.test_client() as c:
+            msg = c.get(f"/api/v1/messages/{self.msg_ids[1]}").get_json()
+            self.assertEqual(msg["user_id"], self.author_id)
+            self.assertEqual(msg["likes_count"], 0)
+
+            resp = c.get("/api/v1/messages/0")
+            self.assertEqual(resp.status_code, 404)
+            self.assertIn("error", resp.get_json())
+
+            resp = c.get(f"/api/v1/users/{self.author_id}/messages"
+                         f"?before=garbage")
+            self.assertEqual(resp.status_code, 400)
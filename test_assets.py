@@ -0,0 +1,131 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from flask import render_template_string
+
+from app import app
+import assets
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+CSS = 'body { background: url("/static/images/bg.png"); }\n' * 20
+
+
+class AssetsTestCase(TestCase):
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.source, 'images'))
+        os.makedirs(os.path.join(self.source, 'stylesheets'))
+
+        with open(os.path.join(self.source, 'images', 'bg.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        with open(os.path.join(self.source, 'stylesheets', 'style.css'),
+                  'w') as f:
+            f.write(CSS)
+
+        self.out = os.path.join(self.source, 'dist')
+        self.manifest = assets.build(self.source, self.out)
+
+        self.old_dir = app.config['ASSETS_DIR']
+        app.config['ASSETS_DIR'] = self.out
+        assets.load_manifest(app)
+
+    def tearDown(self):
+        app.config['ASSETS_DIR'] = self.old_dir
+        assets.load_manifest(app)
+        shutil.rmtree(self.source)
+
+    def read(self, path, mode='rb'):
+        with open(os.path.join(self.out, path), mode) as f:
+            return f.read()
+
+    def test_build(self):
+        css = self.manifest['stylesheets/style.css']
+        png = self.manifest['images/bg.png']
+
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertEqual(json.loads(self.read('manifest.json')),
+                         self.manifest)
+
+        # references inside CSS point at the hashed files
+        self.assertIn(f'url("/assets/{png}")', self.read(css, 'r'))
+
+        # text is precompressed, images aren't
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')),
+                         self.read(css))
+        self.assertFalse(os.path.exists(os.path.join(self.out, png + '.gz')))
+
+    def test_rebuild_is_stable(self):
+        self.assertEqual(assets.build(self.source, self.out), self.manifest)
+
+        with open(os.path.join(self.source, 'images', 'bg.png'), 'ab') as f:
+            f.write(b'changed')
+        rebuilt = assets.build(self.source, self.out)
+
+        # the CSS name changes with the image it references
+        self.assertNotEqual(rebuilt['stylesheets/style.css'],
+                            self.manifest['stylesheets/style.css'])
+
+    def test_asset_url(self):
+        with app.test_request_context():
+            self.assertEqual(
+                assets.asset_url('stylesheets/style.css'),
+                f"/assets/{self.manifest['stylesheets/style.css']}")
+            self.assertEqual(assets.asset_url('missing.js'),
+                             "/static/missing.js")
+
+    def test_static_url(self):
+        with app.test_request_context():
+            self.assertEqual(
+                render_template_string("{{ url|static_url }}",
+                                       url="/static/images/bg.png"),
+                f"/assets/{self.manifest['images/bg.png']}")
+            self.assertEqual(assets.static_url("https://x.test/me.png"),
+                             "https://x.test/me.png")
+            self.assertIsNone(assets.static_url(None))
+
+    def test_serve_compressed(self):
+        css = self.manifest['stylesheets/style.css']
+
+        with app.test_client() as c:
+            resp = c.get(f"/assets/{css}",
+                         headers={"Accept-Encoding": "gzip, deflate"})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertEqual(resp.mimetype, "text/css")
+            self.assertEqual(resp.headers["Cache-Control"],
+                             "public, max-age=31536000, immutable")
+            self.assertIn("Accept-Encoding", resp.headers["Vary"])
+            self.assertEqual(gzip.decompress(resp.get_data()).decode(),
+                             self.read(css, 'r'))
+            resp.close()
+
+            resp = c.get(f"/assets/{css}")
+            self.assertNotIn("Content-Encoding", resp.headers)
+            self.assertEqual(resp.get_data(as_text=True), self.read(css, 'r'))
+            resp.close()
+
+            self.assertEqual(c.get("/assets/nope.css").status_code, 404)
+            self.assertEqual(c.get("/assets/../app.py").status_code, 404)
+
+    def test_pages_link_hashed_files(self):
+        with app.test_client() as c:
+            html = c.get("/login").get_data(as_text=True)
+            self.assertIn(
+                f"/assets/{self.manifest['stylesheets/style.css']}", html)
@@ -0,0 +1,180 @@
+"""Username/email availability tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_availability.py
+
+
+import os
+from unittest import TestCase, mock
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+import availability
+import passwords
+from test_seed import USER_DATA, USER_DATA2
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class BloomFilterTestCase(TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = availability.BloomFilter(1000)
+        names = [f"user{i}" for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+
+    def test_false_positive_rate(self):
+        bloom = availability.BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(f"user{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class AvailabilityTestCase(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            availability.taken_names().clear()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user = User.signup(**USER_DATA)
+        other = User.signup(**USER_DATA2)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.other_id = other.id
+
+    def test_taken(self):
+        with app.app_context():
+            self.assertTrue(availability.username_taken("minestrone"))
+            self.assertTrue(availability.email_taken("bisque@gmail.com"))
+            self.assertFalse(availability.username_taken("gazpacho"))
+            self.assertFalse(availability.username_taken(
+                "minestrone", exclude_id=self.user_id))
+
+    def test_queries_until_built(self):
+        with app.app_context():
+            names = availability.taken_names()
+
+            # as if the background build were still running
+            with names._build_lock:
+                self.assertTrue(availability.username_taken("minestrone"))
+                self.assertFalse(availability.username_taken("gazpacho"))
+                self.assertIsNone(names._filter)
+
+            names.rebuild()
+            self.assertIn("username:minestrone", names._filter)
+            self.assertNotIn("username:gazpacho", names._filter)
+            self.assertFalse(availability.username_taken("gazpacho"))
+
+    def taken_elsewhere(self, username):
+        """Build the filter, then add `username` as another worker would:
+        to the database but not to this worker's filter."""
+
+        with app.app_context():
+            availability.taken_names().rebuild()
+
+        db.session.add(User(username=username, email=f"{username}@x.com",
+                            password="x"))
+        db.session.commit()
+
+    def test_api_confirms_misses(self):
+        self.taken_elsewhere("gazpacho")
+
+        with app.app_context():
+            # the filter alone can't know
+            self.assertFalse(availability.username_taken("gazpacho"))
+
+        with app.test_client() as c:
+            resp = c.get("/api/username-available?username=gazpacho")
+            self.assertFalse(resp.get_json()["available"])
+
+    def test_rename_to_name_taken_elsewhere(self):
+        self.taken_elsewhere("gazpacho")
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.post("/users/profile", data={
+                "username": "gazpacho",
+                "email": USER_DATA["email"],
+                "password": USER_DATA["password"],
+            })
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("already taken", resp.get_data(as_text=True))
+
+        db.session.expire_all()
+        self.assertEqual(User.query.get(self.user_id).username,
+                         USER_DATA["username"])
+
+    def test_api(self):
+        with app.test_client() as c:
+            resp = c.get("/api/username-available?username=minestrone")
+            self.assertEqual(resp.get_json(),
+                             {"username": "minestrone", "available": False})
+
+            resp = c.get("/api/username-available?username=gazpacho")
+            self.assertTrue(resp.get_json()["available"])
+
+            resp = c.get("/api/username-available")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_duplicate_signup_skips_hashing(self):
+        with app.test_client() as c:
+            with mock.patch.object(passwords, 'hash_password') as hash_pw:
+                resp = c.post("/signup", data={
+                    "username": "minestrone",
+                    "email": "new@gmail.com",
+                    "password": "password",
+                })
+
+            self.assertIn("Username already taken",
+                          resp.get_data(as_text=True))
+            hash_pw.assert_not_called()
+
+    def test_new_signup_is_remembered(self):
+        with app.test_client() as c:
+            c.get("/api/username-available?username=warmup")
+            c.post("/signup", data={
+                "username": "gazpacho",
+                "email": "gazpacho@gmail.com",
+                "password": "password",
+            })
+
+            resp = c.get("/api/username-available?username=gazpacho")
+            self.assertFalse(resp.get_json()["available"])
+
+    def test_rename_to_taken_name(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.post("/users/profile", data={
+                "username": USER_DATA2["username"],
+                "email": USER_DATA["email"],
+                "password": USER_DATA["password"],
+            })
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Username already taken",
+                          resp.get_data(as_text=True))
+
+        self.assertEqual(User.query.get(self.user_id).username,
+                         USER_DATA["username"])
@@ -0,0 +1,136 @@
+"""Conditional GET and cache policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_conditional.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class ConditionalGetTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        author = User.signup(**TEST_GEN_USER)
+        viewer = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        msg = Message(text="cache me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.viewer_id = viewer.id
+        self.msg_id = msg.id
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def revalidate(self, client, url):
+        first = client.get(url)
+        self.assertEqual(first.status_code, 200)
+        return client.get(url,
+                          headers={"If-None-Match": first.headers["ETag"]})
+
+    def test_profile_not_modified(self):
+        with app.test_client() as c:
+            self.assertNotIn("Last-Modified",
+                             c.get(f"/users/{self.author_id}").headers)
+            resp = self.revalidate(c, f"/users/{self.author_id}")
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+            self.assertEqual(resp.headers["Cache-Control"],
+                             "private, no-cache")
+
+    def test_like_changes_version(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            url = f"/messages/{self.msg_id}"
+
+            etag = c.get(url).headers["ETag"]
+            c.post(f"/messages/{self.msg_id}/like",
+                   headers={"Referer": "/"})
+            resp = c.get(url, headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_viewer_is_part_of_version(self):
+        with app.test_client() as c:
+            etag = c.get(f"/users/{self.author_id}").headers["ETag"]
+
+            self.login(c, self.viewer_id)
+            resp = c.get(f"/users/{self.author_id}",
+                         headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_new_message_changes_profile(self):
+        with app.test_client() as c:
+            self.login(c, self.author_id)
+            url = f"/users/{self.author_id}"
+
+            etag = c.get(url).headers["ETag"]
+            c.post("/messages/new", data={"text": "another"})
+            resp = c.get(url, headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("another", resp.get_data(as_text=True))
+
+    def test_if_modified_since(self):
+        with app.test_client() as c:
+            first = c.get(f"/messages/{self.msg_id}")
+            resp = c.get(f"/messages/{self.msg_id}", headers={
+                "If-Modified-Since": first.headers["Last-Modified"]})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_list_pages_ignore_if_modified_since(self):
+        # a user leaving the list doesn't make its newest row any newer
+        with app.test_client() as c:
+            first = c.get("/users")
+            self.assertNotIn("Last-Modified", first.headers)
+
+            resp = c.get("/users", headers={
+                "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_follow_pages(self):
+        with app.test_client() as c:
+            resp = c.get(f"/users/{self.author_id}/following")
+            self.assertEqual(resp.status_code, 302)
+            self.assertNotIn("ETag", resp.headers)
+
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            for page in ("following", "followers"):
+                resp = self.revalidate(c, f"/users/{self.author_id}/{page}")
+                self.assertEqual(resp.status_code, 304)
+
+    def test_uncached_pages(self):
+        with app.test_client() as c:
+            resp = c.get("/users?q=avocado")
+            self.assertNotIn("ETag", resp.headers)
+
+            resp = c.get("/login")
+            self.assertEqual(resp.headers["Cache-Control"], "no-store")
+
+            self.assertEqual(c.get("/users/0").status_code, 404)
@@ -0,0 +1,126 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+import counters
+import purge
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class CounterTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user1 = User.signup(**TEST_GEN_USER)
+        user2 = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_follow_and_unfollow(self):
+        with app.test_client() as c:
+            self.login(c, self.user1_id)
+
+            c.post(f"/users/follow/{self.user2_id}")
+            self.assertEqual(self.counts(self.user1_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.user2_id}")
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+
+            # a second submit (or an unfollow of a stranger) changes nothing
+            resp = c.post(f"/users/stop-following/{self.user2_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+
+            self.assertEqual(c.post("/users/stop-following/0").status_code,
+                             404)
+
+    def test_messages_and_likes(self):
+        with app.test_client() as c:
+            self.login(c, self.user2_id)
+            c.post("/messages/new", data={"text": "count me"})
+            msg_id = Message.query.filter_by(text="count me").one().id
+            self.assertEqual(self.counts(self.user2_id), (1, 0, 0, 0))
+
+            self.login(c, self.user1_id)
+            c.post(f"/messages/{msg_id}/like", headers={"Referer": "/"})
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 1))
+            self.assertEqual(Message.query.get(msg_id).likes_count, 1)
+
+            self.login(c, self.user2_id)
+            c.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.user1_id), (0, 0, 0, 0))
+
+    def test_delete_user(self):
+        with app.test_client() as c:
+            self.login(c, self.user1_id)
+            c.post("/messages/new", data={"text": "from user1"})
+            msg_id = Message.query.filter_by(text="from user1").one().id
+
+            self.login(c, self.user2_id)
+            c.post(f"/users/follow/{self.user1_id}")
+            c.post(f"/messages/{msg_id}/like", headers={"Referer": "/"})
+
+            self.login(c, self.user1_id)
+            c.post(f"/users/follow/{self.user2_id}")
+            c.post("/users/delete")
+
+        # counters change as the purge deletes the rows
+        self.assertEqual(self.counts(self.user2_id), (0, 1, 1, 1))
+
+        with app.app_context():
+            list(purge.purge_deleted(pause=0))
+
+        self.assertEqual(self.counts(self.user2_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        db.session.add(Message(text="drift", user_id=self.user1_id))
+        db.session.add(Follows(user_following_id=self.user1_id,
+                               user_being_followed_id=self.user2_id))
+        db.session.commit()
+
+        with app.app_context():
+            drift = counters.reconcile(fix=False)
+            self.assertEqual(drift["users.messages_count"], 1)
+            self.assertEqual(drift["users.followers_count"], 1)
+            self.assertEqual(drift["messages.likes_count"], 0)
+
+            counters.reconcile()
+            db.session.commit()
+
+        self.assertEqual(self.counts(self.user1_id), (1, 1, 0, 0))
+        self.assertEqual(self.counts(self.user2_id), (0, 0, 1, 0))
@@ -0,0 +1,199 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import fragments
+import pagecache
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class BackendTestCase(TestCase):
+
+    def test_lru_evicts_oldest(self):
+        backend = fragments.LRUBackend(size=2)
+        backend.set('a', '1', 'A')
+        backend.set('b', '1', 'B')
+        backend.get('a')
+        backend.set('c', '1', 'C')
+
+        self.assertEqual(backend.get('a'), ('1', 'A'))
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(len(backend), 2)
+
+    def test_file_backend_is_shared(self):
+        directory = tempfile.mkdtemp()
+        try:
+            fragments.FileBackend(directory).set('a', '1', 'A')
+            other = fragments.FileBackend(directory)
+
+            self.assertEqual(other.get('a'), ('1', 'A'))
+            other.delete('a')
+            self.assertIsNone(other.get('a'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_file_backend_caps(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = fragments.FileBackend(directory, size=2, max_age=60)
+            for key in 'abc':
+                backend.set(key, '1', key.upper())
+            old = backend._path('a')
+            os.utime(old, (0, 0))
+
+            self.assertIsNone(backend.get('a'))
+            backend.prune()
+            self.assertEqual(len(backend), 2)
+            self.assertFalse(os.path.exists(old))
+            self.assertEqual(backend.get('c'), ('1', 'C'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_file_backend_directory_is_private(self):
+        parent = tempfile.mkdtemp()
+        try:
+            directory = os.path.join(parent, 'fragments')
+            fragments.FileBackend(directory)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+            os.chmod(directory, 0o777)
+            fragments.FileBackend(directory)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+            if os.geteuid() == 0:
+                os.chown(directory, 65534, -1)
+                with self.assertRaises(PermissionError):
+                    fragments.FileBackend(directory)
+        finally:
+            shutil.rmtree(parent)
+
+    def test_version_mismatch_rerenders(self):
+        cache = fragments.FragmentCache(fragments.LRUBackend())
+
+        with app.app_context():
+            self.assertEqual(cache.fetch('user', 1, (1,), lambda: 'one'),
+                             'one')
+            self.assertEqual(cache.fetch('user', 1, (1,), lambda: 'other'),
+                             'one')
+            self.assertEqual(cache.fetch('user', 1, (2,), lambda: 'two'),
+                             'two')
+
+            cache.invalidate('user', 1)
+            self.assertEqual(cache.fetch('user', 1, (2,), lambda: 'three'),
+                             'three')
+
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+class FragmentViewsTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        author = User.signup(**TEST_GEN_USER)
+        viewer = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        msg = Message(text="render me once", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.viewer_id = viewer.id
+        self.msg_id = msg.id
+
+        fragments.reset()
+        with app.app_context():
+            pagecache.page_cache().clear()
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_cached_cards(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            first = c.get("/users").get_data(as_text=True)
+            misses = fragments.fragment_cache().misses
+
+            self.assertEqual(c.get("/users").get_data(as_text=True), first)
+            self.assertEqual(fragments.fragment_cache().misses, misses)
+            self.assertEqual(fragments.fragment_cache().hits, 2)
+
+    def test_viewer_bits_not_cached(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            c.post(f"/users/follow/{self.author_id}")
+            html = c.get("/users").get_data(as_text=True)
+            self.assertIn(f'action="/users/stop-following/{self.author_id}"',
+                          html)
+
+        with app.test_client() as c:
+            self.login(c, self.author_id)
+            html = c.get(f"/users/{self.author_id}/followers").get_data(
+                as_text=True)
+            self.assertIn(f'action="/users/follow/{self.viewer_id}"', html)
+
+            html = c.get(f"/users/{self.author_id}").get_data(as_text=True)
+            self.assertIn("render me once", html)
+            self.assertNotIn("like-btn", html)
+
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            html = c.get(f"/users/{self.author_id}").get_data(as_text=True)
+            self.assertIn("render me once", html)
+            self.assertIn("like-btn", html)
+
+    def test_profile_edit_invalidates(self):
+        with app.test_client() as c:
+            self.login(c, self.author_id)
+            self.assertIn("@avocadoTOAST", c.get(f"/users/{self.author_id}")
+                          .get_data(as_text=True))
+
+            c.post("/users/profile", data={
+                "username": "renamed",
+                "email": TEST_GEN_USER["email"],
+                "password": TEST_GEN_USER["password"],
+            })
+
+            html = c.get(f"/users/{self.author_id}").get_data(as_text=True)
+            self.assertIn("@renamed", html)
+            self.assertNotIn("@avocadoTOAST", html)
+
+    def test_server_timing(self):
+        # the home timeline isn't streamed, so its cards are rendered before
+        # the headers go out
+        saved = {key: app.config[key] for key in
+                 ('SQL_STATS_SAMPLE_RATE', 'SERVER_TIMING')}
+        app.config.update(SQL_STATS_SAMPLE_RATE=1.0, SERVER_TIMING=True)
+
+        try:
+            with app.test_client() as c:
+                self.login(c, self.author_id)
+                c.get("/")
+                timing = c.get("/").headers["Server-Timing"]
+        finally:
+            app.config.update(saved)
+
+        self.assertIn('fragments;desc="1 hits, 0 misses"', timing)
@@ -0,0 +1,83 @@
+"""Per-request SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import json
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+from test_seed import TEST_GEN_USER
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user = User.signup(**TEST_GEN_USER)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.config = {key: app.config[key] for key in
+                       ('SQL_STATS_SAMPLE_RATE', 'SERVER_TIMING',
+                        'SLOW_REQUEST_MS', 'SLOW_REQUEST_EXPLAIN')}
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def test_server_timing(self):
+        app.config.update(SQL_STATS_SAMPLE_RATE=1.0, SERVER_TIMING=True)
+
+        with app.test_client() as c:
+            timing = c.get("/users").headers["Server-Timing"]
+
+        self.assertRegex(timing,
+                         r'^sql;dur=[\d.]+;desc="\d+ statements, \d+ rows", '
+                         r'total;dur=[\d.]+'
+                         r'(, fragments;desc="\d+ hits, \d+ misses")?$')
+
+    def test_no_server_timing_unless_asked(self):
+        app.config.update(SQL_STATS_SAMPLE_RATE=1.0, SERVER_TIMING=False)
+
+        with app.test_client() as c:
+            self.assertNotIn("Server-Timing", c.get("/users").headers)
+
+    def test_unsampled(self):
+        app.config.update(SQL_STATS_SAMPLE_RATE=0.0, SERVER_TIMING=True)
+
+        with app.test_client() as c:
+            self.assertNotIn("Server-Timing", c.get("/users").headers)
+
+    def test_slow_request_log(self):
+        app.config.update(SQL_STATS_SAMPLE_RATE=1.0, SLOW_REQUEST_MS=0,
+                          SLOW_REQUEST_EXPLAIN=True)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            with self.assertLogs('warbler.slow') as logs:
+                c.get(f"/users/{self.user_id}")
+
+        record = json.loads(logs.records[0].getMessage())
+
+        self.assertEqual(record["endpoint"], "users_show")
+        self.assertEqual(record["status"], 200)
+        self.assertGreaterEqual(record["statements"], len(record["slowest"]))
+        self.assertIn("SELECT", record["slowest"][0]["sql"])
+        self.assertTrue(any("plan" in stmt for stmt in record["slowest"]))
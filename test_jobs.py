@@ -0,0 +1,155 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, Job
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import jobs
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+ran = []
+
+
+@jobs.task('test_record')
+def record(name):
+    ran.append(name)
+    db.session.add(Message(text=name, user_id=User.query.first().id))
+
+
+@jobs.task('test_fail', max_attempts=2)
+def fail():
+    db.session.add(Message(text="rolled back",
+                           user_id=User.query.first().id))
+    raise RuntimeError("nope")
+
+
+class JobQueueTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        Job.query.delete()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        User.signup(**TEST_GEN_USER)
+        db.session.commit()
+        del ran[:]
+
+    def work(self, **options):
+        with app.app_context():
+            worker = jobs.Worker(poll_interval=0, **options)
+            worker.run(burst=True)
+        return worker
+
+    def test_runs_and_deletes_jobs(self):
+        jobs.enqueue('test_record', {'name': 'one'})
+        db.session.commit()
+
+        worker = self.work()
+
+        self.assertEqual(ran, ['one'])
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(Message.query.filter_by(text='one').count(), 1)
+        self.assertEqual(worker.stats['test_record'].runs, 1)
+
+    def test_priority_and_delay(self):
+        jobs.enqueue('test_record', {'name': 'later'}, priority=200)
+        jobs.enqueue('test_record', {'name': 'sooner'}, priority=10)
+        jobs.enqueue('test_record', {'name': 'delayed'}, priority=0,
+                     delay=3600)
+        db.session.commit()
+
+        self.work(batch_size=1)
+
+        self.assertEqual(ran, ['sooner', 'later'])
+        self.assertEqual(Job.query.one().args, {'name': 'delayed'})
+
+    def test_retries_with_backoff_then_gives_up(self):
+        job = jobs.enqueue('test_fail')
+        db.session.commit()
+        job_id = job.id
+
+        worker = self.work()
+        db.session.expire_all()
+        job = Job.query.get(job_id)
+
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.failed_at)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn("RuntimeError: nope", job.last_error)
+        self.assertEqual(Message.query.filter_by(text="rolled back").count(),
+                         0)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        worker = self.work()
+        db.session.expire_all()
+
+        self.assertIsNotNone(Job.query.get(job_id).failed_at)
+        self.assertEqual(worker.stats['test_fail'].given_up, 1)
+
+        with app.app_context():
+            self.assertEqual(jobs.queue_stats()[0]['failed'], 1)
+
+    def test_skips_locked_and_leased_jobs(self):
+        locked = jobs.enqueue('test_record', {'name': 'locked'})
+        leased = jobs.enqueue('test_record', {'name': 'leased'})
+        free = jobs.enqueue('test_record', {'name': 'free'})
+        db.session.flush()
+        leased.run_at = datetime.utcnow() + timedelta(seconds=60)
+        db.session.commit()
+        locked_id, free_id = locked.id, free.id
+
+        # another worker in the middle of claiming `locked`
+        with db.engine.connect() as other:
+            transaction = other.begin()
+            other.execute(db.select(Job.id).where(Job.id == locked_id)
+                          .with_for_update())
+
+            with app.app_context():
+                claimed = jobs.Worker().claim()
+
+            transaction.rollback()
+
+        self.assertEqual([job.id for job in claimed], [free_id])
+
+    def test_delete_account_queues_purge(self):
+        other = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+        other_id = other.id
+        user_id = User.query.filter_by(
+            username=TEST_GEN_USER['username']).one().id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            c.post("/messages/new", data={"text": "gone soon"})
+            c.post(f"/users/follow/{other_id}")
+            c.post("/users/delete")
+
+        self.assertEqual(Job.query.one().task, 'purge_user')
+
+        app.config['PURGE_JOB_BATCHES'] = 1
+        try:
+            self.work()
+        finally:
+            del app.config['PURGE_JOB_BATCHES']
+
+        self.assertIsNone(User.query.get(user_id))
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(Job.query.count(), 0)
@@ -0,0 +1,117 @@
+"""Like toggle tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import likes
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+JSON = {"Accept": "application/json"}
+
+
+class LikeToggleTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        author = User.signup(**TEST_GEN_USER)
+        viewer = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        msg = Message(text="like me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.viewer_id = viewer.id
+        self.msg_id = msg.id
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self):
+        db.session.expire_all()
+        return (User.query.get(self.viewer_id).likes_count,
+                Message.query.get(self.msg_id).likes_count)
+
+    def test_toggle_json(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+
+            resp = c.post(f"/messages/{self.msg_id}/like", headers=JSON)
+            self.assertEqual(resp.json, {"message_id": self.msg_id,
+                                         "liked": True, "likes_count": 1})
+            self.assertEqual(self.counts(), (1, 1))
+
+            resp = c.post(f"/messages/{self.msg_id}/like", headers=JSON)
+            self.assertEqual(resp.json["liked"], False)
+            self.assertEqual(self.counts(), (0, 0))
+
+    def test_explicit_state_is_idempotent(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+
+            for _ in range(2):
+                resp = c.post(f"/messages/{self.msg_id}/like",
+                              data={"liked": "1"}, headers=JSON)
+                self.assertEqual(resp.json["likes_count"], 1)
+            self.assertEqual(self.counts(), (1, 1))
+
+            for _ in range(2):
+                resp = c.post(f"/messages/{self.msg_id}/like",
+                              data={"liked": "0"}, headers=JSON)
+                self.assertEqual(resp.json["liked"], False)
+            self.assertEqual(self.counts(), (0, 0))
+
+    def test_set_like_reports_changes(self):
+        with app.app_context():
+            self.assertTrue(likes.set_like(self.viewer_id, self.msg_id, True))
+            self.assertFalse(likes.set_like(self.viewer_id, self.msg_id,
+                                            True))
+            db.session.commit()
+
+        self.assertEqual(LikedMessage.query.count(), 1)
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_form_post_redirects(self):
+        with app.test_client() as c:
+            self.login(c, self.viewer_id)
+            resp = c.post(f"/messages/{self.msg_id}/like",
+                          headers={"Referer": "/users"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.location.endswith("/users"))
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_errors(self):
+        with app.test_client() as c:
+            resp = c.post(f"/messages/{self.msg_id}/like", headers=JSON)
+            self.assertEqual(resp.status_code, 401)
+
+            self.login(c, self.author_id)
+            resp = c.post(f"/messages/{self.msg_id}/like", headers=JSON)
+            self.assertEqual(resp.status_code, 403)
+
+            resp = c.post("/messages/0/like", headers=JSON)
+            self.assertEqual(resp.status_code, 404)
+
+        self.assertEqual(LikedMessage.query.count(), 0)
@@ -0,0 +1,107 @@
+"""CSV bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from sqlalchemy import inspect
+
+from app import app
+from models import db, User, Message, Follows, LikedMessage
+import loader
+
+db.create_all()
+
+app.config["TESTING"] = True
+
+
+def write_csv(directory, name, header, rows):
+    with open(os.path.join(directory, name), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+class LoaderTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+        write_csv(self.dir.name, 'users.csv',
+                  ['id', 'email', 'username', 'password', 'bio'],
+                  [[1, 'a@test.com', 'alpha', 'x', 'first'],
+                   [2, 'b@test.com', 'beta', 'x', '']])
+        write_csv(self.dir.name, 'messages.csv',
+                  ['id', 'text', 'timestamp', 'user_id'],
+                  [[1, 'hello soup', '2020-01-01 10:00:00', 1],
+                   [2, 'more soup', '2020-01-02 10:00:00', 1],
+                   [3, 'hi', '2020-01-03 10:00:00', 2]])
+        write_csv(self.dir.name, 'follows.csv',
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[1, 2]])
+        write_csv(self.dir.name, 'liked_messages.csv',
+                  ['message_id', 'user_id'], [[1, 2], [2, 2]])
+
+        db.session.rollback()
+        db.session.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def load(self, **kw):
+        with app.test_request_context():
+            return loader.load(self.dir.name, batch_size=2,
+                               report=lambda line: None, **kw)
+
+    def test_replace(self):
+        loaded = self.load()
+
+        self.assertEqual(loaded, {"users": 2, "messages": 3, "follows": 1,
+                                  "liked_messages": 2})
+
+        alpha = User.query.get(1)
+        self.assertEqual(alpha.messages_count, 2)
+        self.assertEqual(alpha.followers_count, 1)
+        self.assertEqual(User.query.get(2).likes_count, 2)
+        self.assertIsNone(User.query.get(2).bio)
+        self.assertEqual(Message.query.get(1).likes_count, 1)
+
+        # deferred constraints and indexes are back
+        inspector = inspect(db.engine)
+        self.assertEqual(len(inspector.get_foreign_keys('follows')), 2)
+        self.assertIn('ix_messages_user_recent',
+                      [ix['name'] for ix in inspector.get_indexes('messages')])
+
+        # sequences continue after the loaded ids
+        user = User(username="gamma", email="c@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user.id, 3)
+
+    def test_upsert(self):
+        self.load()
+
+        write_csv(self.dir.name, 'users.csv',
+                  ['id', 'email', 'username', 'password', 'bio'],
+                  [[2, 'b@test.com', 'beta', 'x', 'updated'],
+                   [3, 'c@test.com', 'gamma', 'x', '']])
+        write_csv(self.dir.name, 'follows.csv',
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[1, 2], [1, 3]])
+
+        self.load(mode='upsert')
+
+        self.assertEqual(User.query.count(), 3)
+        self.assertEqual(User.query.get(2).bio, "updated")
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(Follows.query.count(), 2)
+        self.assertEqual(LikedMessage.query.count(), 2)
+        self.assertEqual(User.query.get(1).followers_count, 2)
@@ -114,6 +114,22 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 302)
             self.assertEqual(len(self.testuser.likes), 1)
 
+    def test_liked_state_on_profile(self):
+        msg = self.testuser2.messages[0]
+        self.testuser.likes.append(msg)
+        db.session.commit()
+        user_id, user2_id = self.testuser.id, self.testuser2.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.get(f"/users/{user2_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<i  class="fas fa-thumbs-up fa-2x"></i>', html)
+
     def test_invalid_like_message(self):
         with self.client as c:
             with c.session_transaction() as sess:
@@ -0,0 +1,168 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagecache.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import pagecache
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        author = User.signup(**TEST_GEN_USER)
+        other = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        msg = Message(text="first post", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.other_id = other.id
+        self.msg_id = msg.id
+
+        pagecache.reset()
+
+    def tearDown(self):
+        app.config.update(PAGE_CACHE_TTL=30, PAGE_CACHE_STALE=300)
+        pagecache.reset()
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def sneak_message(self, text):
+        """Add a message behind the write routes' purges."""
+
+        db.session.add(Message(text=text, user_id=self.author_id))
+        db.session.commit()
+
+    def test_anonymous_hit(self):
+        url = f"/users/{self.author_id}"
+
+        with app.test_client() as c:
+            first = c.get(url)
+            self.assertNotIn("Age", first.headers)
+
+            self.sneak_message("unseen")
+            resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Age", resp.headers)
+            self.assertEqual(resp.get_data(), first.get_data())
+            self.assertEqual(resp.headers["Cache-Control"],
+                             "private, no-cache")
+
+            resp = c.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual(resp.status_code, 304)
+
+        with app.app_context():
+            self.assertEqual(pagecache.page_cache().hits, 2)
+
+    def test_logged_in_bypasses(self):
+        url = f"/users/{self.author_id}"
+
+        with app.test_client() as c:
+            c.get(url)
+
+        with app.test_client() as c:
+            self.login(c, self.other_id)
+            self.sneak_message("seen")
+            self.assertIn("seen", c.get(url).get_data(as_text=True))
+
+    def test_writes_purge(self):
+        url = f"/users/{self.author_id}"
+
+        with app.test_client() as anon:
+            anon.get(url)
+            anon.get(f"/messages/{self.msg_id}")
+            anon.get("/users")
+
+            with app.test_client() as c:
+                self.login(c, self.author_id)
+                c.post("/messages/new", data={"text": "purged"})
+                c.post("/users/profile", data={
+                    "username": "renamed",
+                    "email": TEST_GEN_USER["email"],
+                    "password": TEST_GEN_USER["password"],
+                })
+
+            self.assertIn("purged", anon.get(url).get_data(as_text=True))
+            self.assertIn("@renamed", anon.get(f"/messages/{self.msg_id}")
+                          .get_data(as_text=True))
+            self.assertIn("@renamed", anon.get("/users")
+                          .get_data(as_text=True))
+
+            with app.test_client() as c:
+                self.login(c, self.other_id)
+                c.post(f"/users/follow/{self.author_id}")
+
+            html = anon.get(url).get_data(as_text=True)
+            self.assertIn(f'<a href="/users/{self.author_id}/followers">1</a>',
+                          html)
+
+    def test_stale_while_revalidate(self):
+        app.config.update(PAGE_CACHE_TTL=0, PAGE_CACHE_STALE=60)
+        url = f"/users/{self.author_id}"
+
+        with app.test_client() as c:
+            c.get(url)
+            self.sneak_message("refreshed")
+
+            stale = c.get(url)
+            self.assertNotIn("refreshed", stale.get_data(as_text=True))
+            # the refresh runs once the stale response has been sent
+            stale.close()
+
+        with app.app_context():
+            cache = pagecache.page_cache()
+            self.assertEqual(cache.stale_hits, 1)
+            self.assertEqual(len(cache), 1)
+
+        with app.test_client() as c:
+            self.assertIn("refreshed", c.get(url).get_data(as_text=True))
+
+    def test_not_cached(self):
+        with app.test_client() as c:
+            self.assertEqual(c.get("/users/0").status_code, 404)
+
+            # a flash for the next page
+            c.get(f"/users/{self.author_id}/following")
+            c.get("/")
+
+        with app.app_context():
+            self.assertEqual(len(pagecache.page_cache()), 0)
+
+    def test_purge_by_tag(self):
+        cache = pagecache.PageCache()
+
+        with app.test_request_context():
+            response = app.response_class("hi")
+            cache.store("/a", response, ["user:1", "users"])
+            cache.store("/b", response, ["user:2"])
+
+        cache.purge("users")
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.lookup("/b")[0].body, b"hi")
+        self.assertEqual(cache.lookup("/a"), (None, False))
@@ -0,0 +1,105 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+from pagination import PER_PAGE, encode_cursor
+import pagecache
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+SAME_TIME = datetime(2021, 3, 1, 12, 0, 0)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        # plain inserts: bcrypt-hashing this many passwords is slow
+        db.session.execute(User.__table__.insert(), [
+            dict(email=f"page{i}@test.com", username=f"page{i:03}",
+                 password="x")
+            for i in range(PER_PAGE + 5)])
+
+        self.user = User.query.order_by(User.id).first()
+
+        # all messages share one timestamp, so only the id breaks ties
+        db.session.execute(Message.__table__.insert(), [
+            dict(text=f"msg {i:03}", user_id=self.user.id,
+                 timestamp=SAME_TIME)
+            for i in range(PER_PAGE + 5)])
+        db.session.commit()
+
+        self.user_id = self.user.id
+
+        # rows were written behind the write routes' purges
+        with app.app_context():
+            pagecache.page_cache().clear()
+
+    def test_users_pages(self):
+        with app.test_client() as c:
+            first = c.get("/users").get_data(as_text=True)
+            self.assertIn("@page000", first)
+            self.assertNotIn(f"@page{PER_PAGE:03}", first)
+
+            last_id = (User.query.order_by(User.id)
+                       .offset(PER_PAGE - 1).first().id)
+            resp = c.get(f"/users?before={last_id}")
+            second = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"@page{PER_PAGE:03}", second)
+            self.assertNotIn("@page000", second)
+            self.assertIn("after=", second)
+
+    def test_tied_timestamps_are_stable(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            newest = Message.query.order_by(Message.id.desc()).all()
+            cursor = encode_cursor((SAME_TIME, newest[PER_PAGE - 1].id))
+
+            first = c.get(f"/users/{self.user_id}").get_data(as_text=True)
+            second = c.get(f"/users/{self.user_id}?before={cursor}")
+            second = second.get_data(as_text=True)
+
+            for msg in newest[:PER_PAGE]:
+                self.assertIn(f"<p>{msg.text}</p>", first)
+                self.assertNotIn(f"<p>{msg.text}</p>", second)
+            for msg in newest[PER_PAGE:]:
+                self.assertIn(f"<p>{msg.text}</p>", second)
+
+    def test_after_returns_newer_page(self):
+        with app.test_client() as c:
+            newest = Message.query.order_by(Message.id.desc()).all()
+            cursor = encode_cursor((SAME_TIME, newest[2].id))
+
+            html = c.get(f"/users/{self.user_id}?after={cursor}")
+            html = html.get_data(as_text=True)
+
+            self.assertIn(f"<p>{newest[0].text}</p>", html)
+            self.assertIn(f"<p>{newest[1].text}</p>", html)
+            self.assertNotIn(f"<p>{newest[2].text}</p>", html)
+
+    def test_invalid_cursor(self):
+        with app.test_client() as c:
+            resp = c.get(f"/users/{self.user_id}?before=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
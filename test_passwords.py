@@ -0,0 +1,151 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from threading import Barrier, Event, Thread
+from unittest import TestCase
+
+import bcrypt
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from models import db, User, Message, Follows
+import passwords
+from test_seed import USER_DATA
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class HashPoolTestCase(TestCase):
+
+    def test_hash_and_check(self):
+        hashed = passwords.hash_password("secret")
+
+        self.assertEqual(passwords.cost_of(hashed), passwords.rounds())
+        self.assertTrue(passwords.check_password(hashed, "secret"))
+        self.assertFalse(passwords.check_password(hashed, "Secret"))
+
+    def test_sheds_load_when_full(self):
+        pool = passwords.HashPool(workers=1, queue=0)
+        started = Event()
+        release = Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        thread = Thread(target=pool.run, args=(block,))
+        thread.start()
+        started.wait()
+
+        with self.assertRaises(passwords.PoolBusy):
+            pool.run(lambda: None)
+
+        release.set()
+        thread.join()
+        self.assertEqual(pool.run(lambda: 42), 42)
+        pool.shutdown()
+
+    def test_calibrate_is_clamped(self):
+        self.assertEqual(passwords.calibrate(0.001), passwords.MIN_ROUNDS)
+        self.assertEqual(passwords.calibrate(10 ** 9), passwords.MAX_ROUNDS)
+
+    def test_needs_rehash(self):
+        weak = bcrypt.hashpw(b"pw", bcrypt.gensalt(4)).decode()
+
+        self.assertEqual(passwords.cost_of(weak), 4)
+        self.assertTrue(passwords.needs_rehash(weak))
+        self.assertFalse(passwords.needs_rehash(passwords.hash_password("pw")))
+
+
+class RehashOnLoginTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        weak = bcrypt.hashpw(USER_DATA["password"].encode(),
+                             bcrypt.gensalt(4)).decode()
+        user = User(username=USER_DATA["username"],
+                    email=USER_DATA["email"], password=weak)
+        db.session.add(user)
+        db.session.commit()
+
+        self.user_id = user.id
+
+    def test_login_upgrades_hash(self):
+        with app.test_client() as c:
+            resp = c.post("/login", data={"username": USER_DATA["username"],
+                                          "password": USER_DATA["password"]})
+            self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        hashed = User.query.get(self.user_id).password
+        self.assertEqual(passwords.cost_of(hashed), passwords.rounds())
+        self.assertTrue(passwords.check_password(hashed,
+                                                 USER_DATA["password"]))
+
+    def test_busy_pool_is_503(self):
+        pool = passwords.hash_pool()
+        pool._slots = passwords.BoundedSemaphore(1)
+        pool._slots.acquire()
+
+        try:
+            with app.test_client() as c:
+                resp = c.post("/login",
+                              data={"username": USER_DATA["username"],
+                                    "password": USER_DATA["password"]})
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers["Retry-After"], "1")
+        finally:
+            pool._slots = passwords.BoundedSemaphore(
+                pool.workers + pool.queue)
+
+    def test_concurrent_logins_past_the_pool_get_503(self):
+        """As under gthread workers: logins on their own threads share the
+        process's pool, and those beyond its limit are turned away."""
+
+        user = User.query.get(self.user_id)
+        user.password = passwords.hash_password(USER_DATA["password"])
+        db.session.commit()
+
+        logins = 4
+        ready = Barrier(logins)
+        statuses = []
+
+        def login():
+            with app.test_client() as c:
+                ready.wait()
+                resp = c.post("/login",
+                              data={"username": USER_DATA["username"],
+                                    "password": USER_DATA["password"]})
+                statuses.append(resp.status_code)
+
+        saved = passwords._settings.copy()
+        passwords._settings.update(workers=1, queue=0)
+        passwords._pool = None
+
+        try:
+            threads = [Thread(target=login) for _ in range(logins)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            passwords._settings.update(saved)
+            passwords._pool.shutdown()
+            passwords._pool = None
+
+        self.assertIn(302, statuses)
+        self.assertIn(503, statuses)
+        self.assertEqual(len(statuses), logins)
@@ -0,0 +1,101 @@
+"""Request principal cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_principal.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+import counters
+from principal import Principal, PrincipalCache, principals
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class PrincipalCacheTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user1 = User.signup(**TEST_GEN_USER)
+        user2 = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def test_principal_is_slim(self):
+        with app.app_context():
+            principal = PrincipalCache().get(self.user1_id)
+
+        self.assertIsInstance(principal, Principal)
+        self.assertEqual(principal.username, TEST_GEN_USER["username"])
+        with self.assertRaises(AttributeError):
+            principal.password = "nope"
+
+    def test_cache_hit_ttl_and_eviction(self):
+        cache = PrincipalCache(size=1, ttl=60)
+
+        with app.app_context():
+            first = cache.get(self.user1_id)
+            self.assertIs(cache.get(self.user1_id), first)
+
+            cache.get(self.user2_id)
+            self.assertIsNot(cache.get(self.user1_id), first)
+
+            cache.ttl = 0
+            self.assertIsNot(cache.get(self.user1_id), cache.get(self.user1_id))
+
+            self.assertIsNone(cache.get(0))
+
+    def test_profile_edit_invalidates(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1_id
+
+            c.get("/")
+            c.post("/users/profile", data={
+                "email": TEST_GEN_USER["email"],
+                "username": "renamed",
+                "password": TEST_GEN_USER["password"],
+            })
+
+            with app.app_context():
+                self.assertEqual(principals().get(self.user1_id).username,
+                                 "renamed")
+
+    def test_new_message_updates_count(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1_id
+
+            c.get("/")
+            c.post("/messages/new", data={"text": "counted"})
+
+            with app.app_context():
+                self.assertEqual(
+                    principals().get(self.user1_id).messages_count, 1)
+
+    def test_counters_invalidate_on_commit(self):
+        with app.app_context():
+            cached = principals().get(self.user1_id)
+
+            counters.follow_added(self.user1_id, self.user2_id)
+            self.assertIs(principals().get(self.user1_id), cached)
+
+            db.session.commit()
+            self.assertEqual(
+                principals().get(self.user1_id).following_count, 1)
@@ -0,0 +1,148 @@
+"""Account deletion and purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purge.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, LikedMessage
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+import counters
+import pagecache
+import purge
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class PurgeTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        LikedMessage.query.delete()
+
+        doomed = User.signup(**TEST_GEN_USER)
+        other = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        self.doomed_id = doomed.id
+        self.other_id = other.id
+
+        with app.app_context():
+            pagecache.page_cache().clear()
+
+        with app.test_client() as c:
+            self.login(c, self.doomed_id)
+            for n in range(5):
+                c.post("/messages/new", data={"text": f"doomed {n}"})
+            c.post(f"/users/follow/{self.other_id}")
+            c.post("/messages/new", data={"text": "still here"})
+
+            self.login(c, self.other_id)
+            c.post("/messages/new", data={"text": "other's"})
+            c.post(f"/users/follow/{self.doomed_id}")
+            for msg in Message.query.filter_by(user_id=self.doomed_id):
+                c.post(f"/messages/{msg.id}/like", headers={"Referer": "/"})
+
+            self.login(c, self.doomed_id)
+            msg = Message.query.filter_by(text="other's").one()
+            c.post(f"/messages/{msg.id}/like", headers={"Referer": "/"})
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def delete_account(self):
+        with app.test_client() as c:
+            self.login(c, self.doomed_id)
+            c.post("/users/delete")
+
+    def test_deleted_account_is_hidden(self):
+        msg_id = Message.query.filter_by(user_id=self.doomed_id).first().id
+        self.delete_account()
+
+        self.assertIsNotNone(User.query.get(self.doomed_id).deleted_at)
+        self.assertFalse(User.authenticate(TEST_GEN_USER["username"],
+                                           TEST_GEN_USER["password"]))
+
+        with app.test_client() as c:
+            self.assertEqual(c.get(f"/users/{self.doomed_id}").status_code,
+                             404)
+            self.assertEqual(c.get(f"/messages/{msg_id}").status_code, 404)
+            self.assertNotIn("@avocadoTOAST",
+                             c.get("/users").get_data(as_text=True))
+            self.assertEqual(c.get(f"/api/v1/users/{self.doomed_id}")
+                             .status_code, 404)
+
+            # their messages are gone from what followers and likers see,
+            # long before the purge gets to them
+            self.login(c, self.other_id)
+            for url in ("/", f"/users/{self.other_id}/likes",
+                        "/messages/search?q=doomed"):
+                self.assertNotIn("doomed 0", c.get(url).get_data(as_text=True),
+                                 url)
+            data = c.get("/api/v1/timeline").get_json()["data"]
+            self.assertEqual([msg for msg in data
+                              if "doomed" in msg["text"]], [])
+
+            # a session left open elsewhere is logged out
+            self.login(c, self.doomed_id)
+            self.assertEqual(c.get("/users/profile").status_code, 302)
+
+    def test_purge_in_batches(self):
+        self.delete_account()
+
+        with app.app_context():
+            results = dict(purge.purge_deleted(batch_size=2, pause=0))
+
+        self.assertEqual(results[self.doomed_id], {
+            'likes received': 6,
+            'messages': 6,
+            'likes': 1,
+            'following': 1,
+            'followers': 1,
+            'timeline entries': 0,
+        })
+        self.assertIsNone(User.query.get(self.doomed_id))
+        self.assertEqual(LikedMessage.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+
+        other = User.query.get(self.other_id)
+        self.assertEqual((other.messages_count, other.following_count,
+                          other.followers_count, other.likes_count),
+                         (1, 0, 0, 0))
+        self.assertEqual(Message.query.filter_by(text="other's").one()
+                         .likes_count, 0)
+
+    def test_resumes_where_it_stopped(self):
+        self.delete_account()
+
+        with app.app_context():
+            # a purge that died after its first batch
+            purge._likes_received(self.doomed_id, 4)
+            db.session.commit()
+
+            deleted = purge.purge_user(self.doomed_id, pause=0)
+            self.assertEqual(deleted['likes received'], 2)
+            self.assertEqual(deleted['messages'], 6)
+
+            drift = counters.reconcile(fix=False)
+            self.assertEqual(set(drift.values()), {0})
+
+    def test_live_users_are_left_alone(self):
+        with app.app_context():
+            self.assertEqual(purge.purge_user(self.doomed_id), {})
+
+        self.assertEqual(Message.query.filter_by(user_id=self.doomed_id)
+                         .count(), 6)
@@ -0,0 +1,148 @@
+"""SQL statement budgets for the main pages.
+
+Each route must render with a fixed number of statements, however many
+users or messages are on the page. A lazy-loaded relationship in a template
+shows up here as a count that grows with the data.
+"""
+
+# run these tests like:
+#
+#    python -m unittest test_query_counts.py
+
+
+import os
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+NUM_AUTHORS = 12
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run inside the block into a list."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute",
+                     before_cursor_execute)
+
+
+class QueryCountTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.execute(User.__table__.insert(), [
+            dict(email=f"count{i}@test.com", username=f"count{i}",
+                 password="x")
+            for i in range(NUM_AUTHORS + 1)])
+
+        viewer, *authors = User.query.order_by(User.id).all()
+
+        for author in authors:
+            viewer.following.append(author)
+            author.following.append(viewer)
+            for i in range(3):
+                author.messages.append(Message(text=f"{author.username} {i}"))
+        db.session.flush()
+
+        for author in authors[::2]:
+            viewer.likes.append(author.messages[0])
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.message_id = authors[0].messages[0].id
+
+    def assertMaxQueries(self, url, limit, status=200, headers=None):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            # the first request also fills the per-worker principal cache
+            first = c.get(url)
+
+            with count_queries() as statements:
+                resp = c.get(url, headers=headers and headers(first))
+                # streamed pages query while their body is read
+                resp.get_data()
+
+        self.assertEqual(resp.status_code, status)
+        self.assertLessEqual(len(statements), limit,
+                             f"{url} ran {len(statements)} statements")
+
+    # pages with conditional GET (see conditional.py) run one extra statement
+    # for their version, and only that one to answer 304
+
+    def test_homepage(self):
+        self.assertMaxQueries("/", 2)
+
+    def test_users_show(self):
+        self.assertMaxQueries(f"/users/{self.viewer_id}", 3)
+
+    def test_list_users(self):
+        self.assertMaxQueries("/users", 3)
+
+    def test_followers(self):
+        self.assertMaxQueries(f"/users/{self.viewer_id}/followers", 4)
+
+    def test_following(self):
+        self.assertMaxQueries(f"/users/{self.viewer_id}/following", 4)
+
+    def test_likes(self):
+        self.assertMaxQueries(f"/users/{self.viewer_id}/likes", 3)
+
+    def test_messages_show(self):
+        self.assertMaxQueries(f"/messages/{self.message_id}", 3)
+
+    def test_not_modified(self):
+        for url in (f"/users/{self.viewer_id}", "/users",
+                    f"/users/{self.viewer_id}/followers",
+                    f"/messages/{self.message_id}"):
+            self.assertMaxQueries(
+                url, 1, status=304,
+                headers=lambda first: {"If-None-Match": first.headers["ETag"]})
+
+    def test_like_toggle(self):
+        # liking takes the same statements however many likes the viewer has
+        author_id = Message.query.get(self.message_id).user_id
+        unliked = (Message.query
+                   .filter(Message.user_id == author_id,
+                           Message.id != self.message_id)
+                   .first().id)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+            c.get("/")
+
+            for message_id in (self.message_id, unliked):
+                with count_queries() as statements:
+                    resp = c.post(f"/messages/{message_id}/like",
+                                  headers={"Accept": "application/json"})
+
+                self.assertEqual(resp.status_code, 200)
+                # user, author, toggle, two counter updates, count
+                self.assertLessEqual(len(statements), 6,
+                                     f"{len(statements)} statements")
@@ -0,0 +1,295 @@
+"""User and message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+import search
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class NgramIndexTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.add_all([
+            User(username="soupfan", email="a@test.com", password="x",
+                 bio="I like bread", location="Oakland"),
+            User(username="breadfan", email="b@test.com", password="x",
+                 bio="soup is fine", location="Soup City"),
+            User(username="other", email="c@test.com", password="x",
+                 bio=None, location="Berkeley"),
+        ])
+        db.session.commit()
+
+        self.index = search.NgramIndex()
+
+    def names(self, term, **kw):
+        with app.app_context():
+            return [user.username for user in self.index.search(term, **kw)]
+
+    def test_ngrams(self):
+        self.assertEqual(search.ngrams("Soup"), {"sou", "oup"})
+        self.assertEqual(search.ngrams("so"), set())
+
+    def test_ranks_username_hits_first(self):
+        self.assertEqual(self.names("soup"), ["soupfan", "breadfan"])
+        self.assertEqual(self.names("BREAD"), ["breadfan", "soupfan"])
+
+    def test_substring_must_match(self):
+        self.assertEqual(self.names("oupf"), ["soupfan"])
+        self.assertEqual(self.names("zzz"), [])
+
+    def test_short_terms_scan(self):
+        self.assertEqual(self.names("be"), ["other"])
+
+    def test_offset_and_limit(self):
+        self.assertEqual(self.names("fan", offset=1, limit=1), ["breadfan"])
+
+    def test_updates(self):
+        with app.app_context():
+            self.index.search("x")
+            user = User.query.filter_by(username="other").one()
+            user.bio = "soup forever"
+            self.index.add(user)
+            self.assertEqual(len(self.index.search("soup")), 3)
+
+            self.index.remove(user.id)
+            self.assertEqual(len(self.index.search("soup")), 2)
+
+    def test_rebuilds_in_background(self):
+        self.names("x")
+        db.session.add(User(username="souper", email="d@test.com",
+                            password="x"))
+        db.session.commit()
+        self.index.ttl = 0
+
+        # a rebuild already running: the old index is searched meanwhile
+        with self.index._build_lock:
+            self.assertEqual(self.names("soup"), ["soupfan", "breadfan"])
+
+        self.names("soup")
+        for thread in threading.enumerate():
+            if thread.name == "NgramIndex":
+                thread.join()
+
+        self.index.ttl = search.DEFAULT_INDEX_TTL
+        self.assertEqual(len(self.names("soup")), 3)
+
+
+class SearchViewTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.add_all([
+            User(username="quiche", email="q@test.com", password="x",
+                 location="Paris"),
+            User(username="parisian", email="p@test.com", password="x"),
+        ])
+        db.session.commit()
+
+        with app.app_context():
+            search.ngram_index().clear()
+
+    def test_search_page(self):
+        with app.test_client() as c:
+            resp = c.get("/users?q=paris")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("<p>@parisian</p>", html)
+            self.assertIn("<p>@quiche</p>", html)
+            self.assertLess(html.index("@parisian"), html.index("@quiche"))
+
+    def test_no_results(self):
+        with app.test_client() as c:
+            resp = c.get("/users?q=nothing-here")
+            self.assertIn("Sorry, no users found", resp.get_data(as_text=True))
+
+    def test_bad_page_cursor(self):
+        with app.test_client() as c:
+            resp = c.get("/users?q=paris&before=abc")
+            self.assertEqual(resp.status_code, 400)
+
+
+class MessageSearchTestCase(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            search.message_index().clear()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user = User(username="writer", email="w@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+
+        old = datetime.utcnow() - timedelta(days=90)
+        db.session.add_all([
+            Message(text="fresh bread this morning", user_id=user.id),
+            Message(text="bread bread bread", user_id=user.id,
+                    timestamp=old),
+            Message(text="soup and bread", user_id=user.id),
+            Message(text="nothing to see", user_id=user.id),
+        ])
+        db.session.commit()
+
+        self.user_id = user.id
+
+    def texts(self, results):
+        return [msg.text for msg in results]
+
+    def test_words(self):
+        self.assertEqual(search.words("Soup, and BREAD!"),
+                         ["soup", "and", "bread"])
+
+    def hits(self, rows):
+        return [msg.text for (msg, _) in rows]
+
+    def test_inverted_index(self):
+        index = search.InvertedIndex()
+
+        with app.app_context():
+            rows = index.search("bread")
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(self.hits(rows)[-1], "bread bread bread")
+
+            self.assertEqual(self.hits(index.search("soup BREAD")),
+                             ["soup and bread"])
+            self.assertEqual(index.search("soup pizza"), [])
+
+            cursor = (rows[0][1], rows[0][0].id)
+            self.assertEqual(self.hits(index.search("bread", limit=1,
+                                                    before=cursor)),
+                             self.hits(rows[1:2]))
+            cursor = (rows[2][1], rows[2][0].id)
+            self.assertEqual(self.hits(index.search("bread", after=cursor)),
+                             self.hits(rows[1::-1]))
+
+            msg = Message(text="pizza", user_id=self.user_id)
+            db.session.add(msg)
+            db.session.commit()
+            index.add(msg)
+            self.assertEqual(self.hits(index.search("pizza")), ["pizza"])
+
+            index.remove(msg.id)
+            self.assertEqual(index.search("pizza"), [])
+
+    def test_index_rebuilds_in_background(self):
+        index = search.InvertedIndex(ttl=0)
+
+        with app.app_context():
+            index.search("x")
+            msg = Message(text="pizza", user_id=self.user_id)
+            db.session.add(msg)
+            db.session.commit()
+
+            # a rebuild already running: the old index is searched meanwhile
+            with index._build_lock:
+                self.assertEqual(index.search("pizza"), [])
+
+            index.search("pizza")
+            for thread in threading.enumerate():
+                if thread.name == "InvertedIndex":
+                    thread.join()
+
+            index.ttl = search.DEFAULT_INDEX_TTL
+            self.assertEqual(self.hits(index.search("pizza")), ["pizza"])
+
+    def test_search_vector_on_insert(self):
+        with app.test_request_context():
+            page = search.search_messages("soups")
+            self.assertEqual(self.texts(page), ["soup and bread"])
+
+    def test_reindex(self):
+        db.session.execute(Message.__table__.update().values(
+            search_vector=None))
+        db.session.commit()
+
+        with app.test_request_context():
+            self.assertEqual(search.reindex_messages(), 4)
+            self.assertEqual(len(search.search_messages("bread")), 3)
+
+    def test_search_page(self):
+        with app.test_client() as c:
+            resp = c.get("/messages/search?q=bread")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("fresh bread this morning", html)
+            self.assertNotIn("nothing to see", html)
+
+            resp = c.get("/messages/search?q=zebra")
+            self.assertIn("Sorry, no messages found",
+                          resp.get_data(as_text=True))
+
+    def test_search_json(self):
+        with app.test_client() as c:
+            data = c.get("/messages/search.json?q=bread").get_json()
+
+            self.assertEqual(len(data["messages"]), 3)
+            self.assertEqual(data["messages"][0]["username"], "writer")
+            self.assertIsNone(data["before"])
+
+    def test_search_pages_by_rank_cursor(self):
+        with app.test_request_context():
+            ids = [msg.id for msg in search.search_messages("bread")]
+
+        seen = []
+        cursor = ""
+        while True:
+            with app.test_request_context(f"/?before={cursor}"):
+                page = search.search_messages("bread", per_page=1)
+            seen.extend(msg.id for msg in page)
+            if page.before is None:
+                break
+            cursor = page.before
+
+        self.assertEqual(seen, ids)
+
+        with app.test_request_context(f"/?after={page.after}"):
+            page = search.search_messages("bread", per_page=2)
+        self.assertEqual([msg.id for msg in page], ids[:2])
+        self.assertIsNone(page.after)
+
+        with app.test_client() as c:
+            resp = c.get("/messages/search.json?q=bread&before=abc")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_search_after_add_and_delete(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post("/messages/new", data={"text": "zebra sighting"})
+            data = c.get("/messages/search.json?q=zebra").get_json()
+            self.assertEqual(len(data["messages"]), 1)
+
+            c.post(f"/messages/{data['messages'][0]['id']}/delete")
+            data = c.get("/messages/search.json?q=zebra").get_json()
+            self.assertEqual(data["messages"], [])
@@ -0,0 +1,122 @@
+"""Streamed listing page tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_streaming.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows
+from pagination import PER_PAGE, paginate
+import pagecache
+import streaming
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class StreamingTestCase(TestCase):
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        db.session.execute(User.__table__.insert(), [
+            dict(email=f"stream{i}@test.com", username=f"stream{i:03}",
+                 password="x")
+            for i in range(PER_PAGE + 5)])
+        db.session.commit()
+
+        self.viewer_id = User.query.order_by(User.id).first().id
+
+        with app.app_context():
+            pagecache.page_cache().clear()
+
+    def test_head_sent_before_rows(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            resp = c.get("/users")
+            self.assertTrue(resp.is_streamed)
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                chunks = iter(resp.response)
+                self.assertIn(b"<head>", next(chunks))
+                self.assertEqual(statements, [])
+
+                html = b"".join(chunks).decode()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertIn("@stream000", html)
+        self.assertNotIn(f"@stream{PER_PAGE:03}", html)
+        # the rows, then the viewer's follow state for them
+        self.assertEqual(len(statements), 2)
+
+    def test_cursors_match_paginate(self):
+        query = User.query.order_by(None)
+
+        for args in ("", f"?before={self.viewer_id + 9}"):
+            with app.test_request_context(f"/users{args}"):
+                batches = []
+                page = streaming.stream_page(query, [User.id],
+                                             descending=False,
+                                             on_batch=batches.append)
+                expected = paginate(query, [User.id], descending=False)
+
+                self.assertTrue(page)
+                self.assertEqual([user.id for user in page],
+                                 [user.id for user in expected])
+                self.assertEqual((page.before, page.after),
+                                 (expected.before, expected.after))
+                self.assertEqual(sum(map(len, batches)), len(expected))
+
+    def test_walking_back(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            html = c.get(f"/users?after={self.viewer_id + PER_PAGE}").get_data(
+                as_text=True)
+
+        self.assertIn("@stream000", html)
+        self.assertIn(f"@stream{PER_PAGE - 1:03}", html)
+
+    def test_empty(self):
+        User.query.delete()
+        db.session.commit()
+
+        with app.test_client() as c:
+            html = c.get("/users").get_data(as_text=True)
+
+        self.assertIn("Sorry, no users found", html)
+
+    def test_flashes_shown_once(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+                sess["_flashes"] = [("danger", "flashed once")]
+
+            resp = c.get("/users")
+            self.assertIn("flashed once", resp.get_data(as_text=True))
+
+            resp = c.get("/users")
+            self.assertNotIn("flashed once", resp.get_data(as_text=True))
@@ -0,0 +1,154 @@
+"""Home timeline engine tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, TimelineEntry
+import timeline
+from test_seed import TEST_GEN_USER, TEST_GEN_USER2
+
+db.create_all()
+
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class MaterializedTimelineTestCase(TestCase):
+    """Test fan-out-on-write timelines."""
+
+    def setUp(self):
+        db.session.rollback()
+        TimelineEntry.query.delete()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        app.config['TIMELINE_ENGINE'] = 'materialized'
+
+        user1 = User.signup(**TEST_GEN_USER)
+        user2 = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def tearDown(self):
+        app.config['TIMELINE_ENGINE'] = 'query'
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_fan_out_to_followers(self):
+        with app.test_client() as c:
+            self.login(c, self.user1_id)
+            c.post(f"/users/follow/{self.user2_id}")
+
+            self.login(c, self.user2_id)
+            c.post("/messages/new", data={"text": "fanned out"})
+
+            entries = TimelineEntry.query.filter_by(user_id=self.user1_id).all()
+            self.assertEqual(len(entries), 1)
+
+            self.login(c, self.user1_id)
+            resp = c.get("/")
+            self.assertIn("fanned out", resp.get_data(as_text=True))
+
+    def test_backfill_and_prune(self):
+        msg = Message(text="before the follow", user_id=self.user2_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with app.test_client() as c:
+            self.login(c, self.user1_id)
+
+            c.post(f"/users/follow/{self.user2_id}")
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.user1_id).count(), 1)
+
+            c.post(f"/users/stop-following/{self.user2_id}")
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.user1_id).count(), 0)
+
+    def test_entries_are_capped(self):
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+
+        try:
+            for i in range(4):
+                db.session.add(Message(text=f"msg {i}", user_id=self.user2_id))
+            db.session.commit()
+
+            with app.test_client() as c:
+                self.login(c, self.user1_id)
+                c.post(f"/users/follow/{self.user2_id}")
+
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.user1_id).count(), 2)
+        finally:
+            app.config['TIMELINE_MAX_ENTRIES'] = 800
+
+
+class RingTimelineTestCase(TestCase):
+    """Test the per-author ring buffer timeline."""
+
+    def setUp(self):
+        app.config['TIMELINE_ENGINE'] = 'ring'
+        with app.app_context():
+            timeline.author_buffers().clear()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        user1 = User.signup(**TEST_GEN_USER)
+        user2 = User.signup(**TEST_GEN_USER2)
+        db.session.commit()
+
+        user1.following.append(user2)
+        db.session.add(Message(text="older", user_id=user2.id))
+        db.session.add(Message(text="own", user_id=user1.id))
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def tearDown(self):
+        app.config['TIMELINE_ENGINE'] = 'query'
+
+    def home_texts(self):
+        with app.test_request_context():
+            user = User.query.get(self.user1_id)
+            return [msg.text for msg in timeline.home_timeline(user).items]
+
+    def test_merges_followed_authors(self):
+        self.assertEqual(self.home_texts(), ["own", "older"])
+
+    def test_matches_query_engine(self):
+        ring = self.home_texts()
+        app.config['TIMELINE_ENGINE'] = 'query'
+
+        self.assertEqual(ring, self.home_texts())
+
+    def test_new_and_deleted_messages(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user2_id
+
+            # warm the buffer, then post into it
+            c.get("/")
+            c.post("/messages/new", data={"text": "newest"})
+            msg = Message.query.filter_by(text="newest").one()
+
+            self.assertEqual(self.home_texts()[0], "newest")
+
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertNotIn("newest", self.home_texts())
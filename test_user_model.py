@@ -109,6 +109,37 @@ class UserModelTestCase(TestCase):
     def test_user_not_follower(self):
         """Test that user2 is not following user1"""
         self.assertNotIn(self.user2, self.user1.followers)
+
+    def test_is_following(self):
+        """Test is_following / is_followed_by checks"""
+        self.user1.following.append(self.user2)
+        db.session.commit()
+        self.assertTrue(self.user1.is_following(self.user2))
+        self.assertTrue(self.user2.is_followed_by(self.user1))
+        self.assertFalse(self.user2.is_following(self.user1))
+
+    def test_follow_state(self):
+        """Test batched follow lookup returns both directions"""
+        self.user1.following.append(self.user2)
+        self.user2.following.append(self.user1)
+        db.session.commit()
+
+        following, followers = self.user1.follow_state([self.user2.id, 0])
+        self.assertEqual(following, {self.user2.id})
+        self.assertEqual(followers, {self.user2.id})
+        self.assertEqual(self.user1.follow_state([]), (set(), set()))
+
+    def test_liked_message_ids(self):
+        """Test batched liked-message lookup"""
+        liked = Message(text="liked", user_id=self.user2.id)
+        other = Message(text="not liked", user_id=self.user2.id)
+        db.session.add_all([liked, other])
+        self.user1.likes.append(liked)
+        db.session.commit()
+
+        self.assertEqual(self.user1.liked_message_ids([liked.id, other.id]),
+                         {liked.id})
+        self.assertEqual(self.user1.liked_message_ids([]), set())
     
     def test_successful_user_signup(self):
         """Test user signup with valid credentials"""
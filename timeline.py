@@ -0,0 +1,383 @@
+"""Home timeline engines for Warbler.
+
+The engine is picked with the TIMELINE_ENGINE config value:
+
+- "query": build the timeline from the messages table on every request.
+- "materialized": read a precomputed slice of `timeline_entries`, which is
+  kept up to date by fanning each new message out to the author's followers.
+- "ring": keep a small in-memory ring buffer of recent message ids for each
+  author and k-way merge the buffers of the people a user follows. Nothing
+  is written per follower, so popular authors cost the same as anyone else.
+  The buffers only cover the newest page; older pages use the "query" engine.
+
+Every engine returns a `pagination.Page` keyed on (timestamp, message id),
+so cursors are interchangeable between them.
+"""
+
+import heapq
+from collections import OrderedDict, deque
+from itertools import islice
+from threading import Lock
+from time import monotonic
+
+from flask import current_app, request
+from sqlalchemy import func, insert, literal, select, tuple_
+
+import loaders
+from models import db, Follows, Message, TimelineEntry
+from pagination import Page, encode_cursor, paginate
+
+TIMELINE_LENGTH = 100
+DEFAULT_MAX_ENTRIES = 800
+DEFAULT_TRIM_EVERY = 50
+DEFAULT_RING_SIZE = TIMELINE_LENGTH
+DEFAULT_RING_AUTHORS = 10000
+DEFAULT_RING_TTL = 30
+
+
+def _config(key, default):
+    return current_app.config.get(key, default)
+
+
+def is_materialized():
+    """Is the materialized (fan-out-on-write) timeline turned on?"""
+
+    return _config('TIMELINE_ENGINE', 'query') == 'materialized'
+
+
+def home_timeline(user, per_page=TIMELINE_LENGTH):
+    """Return a Page of the most recent messages for `user`'s home page."""
+
+    engine = _config('TIMELINE_ENGINE', 'query')
+
+    if engine == 'materialized':
+        return _materialized_timeline(user.id, per_page)
+
+    if engine == 'ring' and not (request.args.get('before') or
+                                 request.args.get('after')):
+        return _ring_timeline(user.id, per_page)
+
+    return _query_timeline(user, per_page)
+
+
+def _query_timeline(user, per_page):
+    """Messages of `user` and the users they follow, newest first."""
+
+    following_ids = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == user.id))
+
+    query = (Message
+             .visible()
+             .options(*loaders.options('timeline'))
+             .filter((Message.user_id == user.id) |
+                     (Message.user_id.in_(following_ids))))
+
+    return paginate(query, [Message.timestamp, Message.id], per_page)
+
+
+def _materialized_timeline(user_id, per_page):
+    """Read `user_id`'s precomputed timeline slice."""
+
+    query = (Message
+             .visible()
+             .options(*loaders.options('timeline'))
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == user_id))
+
+    return paginate(query,
+                    [TimelineEntry.timestamp, TimelineEntry.message_id],
+                    per_page,
+                    key=lambda msg: (msg.timestamp, msg.id))
+
+
+def _ring_timeline(user_id, per_page):
+    """Merge the ring buffers of `user_id` and everyone they follow."""
+
+    author_ids = [user_id] + [
+        followed_id for (followed_id,) in db.session
+        .query(Follows.user_being_followed_id)
+        .filter(Follows.user_following_id == user_id)]
+
+    buffers = author_buffers().get_many(author_ids)
+    newest = heapq.merge(*buffers, reverse=True)
+    message_ids = [message_id for (_, message_id) in islice(newest, per_page)]
+
+    if not message_ids:
+        return Page([])
+
+    by_id = {msg.id: msg
+             for msg in (Message.visible()
+                         .options(*loaders.options('timeline'))
+                         .filter(Message.id.in_(message_ids)))}
+    messages = [by_id[message_id] for message_id in message_ids
+                if message_id in by_id]
+
+    before = None
+    if messages and len(message_ids) == per_page:
+        before = encode_cursor((messages[-1].timestamp, messages[-1].id))
+
+    return Page(messages, before=before)
+
+
+class AuthorBuffers:
+    """Per-worker ring buffers of each author's most recent messages.
+
+    Each buffer is a deque of (timestamp, message_id) pairs, newest first,
+    holding at most `size` entries. At most `max_authors` buffers are kept,
+    evicting the least recently used. Buffers are reloaded from the database
+    once they are older than `ttl` seconds, which bounds how long another
+    worker's writes can go unseen.
+    """
+
+    def __init__(self, size=DEFAULT_RING_SIZE,
+                 max_authors=DEFAULT_RING_AUTHORS, ttl=DEFAULT_RING_TTL):
+        self.size = size
+        self.max_authors = max_authors
+        self.ttl = ttl
+        self._buffers = OrderedDict()
+        self._lock = Lock()
+
+    def get_many(self, author_ids):
+        """Return a buffer for each of `author_ids`, loading any missing."""
+
+        now = monotonic()
+        found = {}
+        missing = []
+
+        with self._lock:
+            for author_id in author_ids:
+                entry = self._buffers.get(author_id)
+                if entry and now - entry[0] < self.ttl:
+                    self._buffers.move_to_end(author_id)
+                    found[author_id] = tuple(entry[1])
+                else:
+                    missing.append(author_id)
+
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                for author_id in missing:
+                    self._store(author_id, loaded[author_id], now)
+                    found[author_id] = tuple(loaded[author_id])
+
+        return [found[author_id] for author_id in author_ids]
+
+    def push(self, author_id, timestamp, message_id):
+        """Add a new message to `author_id`'s buffer, if it is loaded."""
+
+        with self._lock:
+            entry = self._buffers.get(author_id)
+            if entry:
+                entry[1].appendleft((timestamp, message_id))
+
+    def remove(self, author_id, message_id):
+        """Drop a deleted message from `author_id`'s buffer.
+
+        The buffer is discarded so it is refilled from the database.
+        """
+
+        with self._lock:
+            entry = self._buffers.get(author_id)
+            if entry and any(mid == message_id for (_, mid) in entry[1]):
+                del self._buffers[author_id]
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+    def _store(self, author_id, buffer, loaded_at):
+        self._buffers[author_id] = (loaded_at, buffer)
+        self._buffers.move_to_end(author_id)
+
+        while len(self._buffers) > self.max_authors:
+            self._buffers.popitem(last=False)
+
+    def _load(self, author_ids):
+        """Read the newest `size` messages of each author in one query."""
+
+        ranked = (select(Message.user_id,
+                         Message.id,
+                         Message.timestamp,
+                         func.row_number().over(
+                             partition_by=Message.user_id,
+                             order_by=(Message.timestamp.desc(),
+                                       Message.id.desc()),
+                         ).label('position'))
+                  .where(Message.user_id.in_(author_ids))
+                  .subquery())
+
+        rows = db.session.execute(
+            select(ranked.c.user_id, ranked.c.id, ranked.c.timestamp)
+            .where(ranked.c.position <= self.size)
+            .order_by(ranked.c.user_id,
+                      ranked.c.timestamp.desc(),
+                      ranked.c.id.desc()))
+
+        loaded = {author_id: deque(maxlen=self.size)
+                  for author_id in author_ids}
+        for (author_id, message_id, timestamp) in rows:
+            loaded[author_id].append((timestamp, message_id))
+
+        return loaded
+
+
+_author_buffers = None
+
+
+def author_buffers():
+    """Return this worker's AuthorBuffers, built from the app config."""
+
+    global _author_buffers
+
+    if _author_buffers is None:
+        _author_buffers = AuthorBuffers(
+            size=_config('TIMELINE_RING_SIZE', DEFAULT_RING_SIZE),
+            max_authors=_config('TIMELINE_RING_AUTHORS', DEFAULT_RING_AUTHORS),
+            ttl=_config('TIMELINE_RING_TTL', DEFAULT_RING_TTL))
+
+    return _author_buffers
+
+
+##############################################################################
+# Write-side maintenance: each of these only queues statements on the
+# session; the calling view commits them with the rest of its change.
+
+
+def fan_out(message):
+    """Push a new `message` into its author's and followers' timelines.
+
+    `message` must already be flushed so it has an id and timestamp.
+    """
+
+    if _config('TIMELINE_ENGINE', 'query') == 'ring':
+        author_buffers().push(message.user_id, message.timestamp, message.id)
+        return
+
+    if not is_materialized():
+        return
+
+    db.session.add(TimelineEntry(user_id=message.user_id,
+                                 message_id=message.id,
+                                 timestamp=message.timestamp))
+
+    followers = (select(Follows.user_following_id,
+                        literal(message.id),
+                        literal(message.timestamp))
+                 .where(Follows.user_being_followed_id == message.user_id,
+                        Follows.user_following_id != message.user_id))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'timestamp'], followers))
+
+    # Trimming every follower on every post would make popular authors'
+    # writes expensive, so it is amortized over a batch of messages.
+    if message.id % _config('TIMELINE_TRIM_EVERY', DEFAULT_TRIM_EVERY) == 0:
+        trim(select(Follows.user_following_id)
+             .where(Follows.user_being_followed_id == message.user_id)
+             .union(select(literal(message.user_id))))
+
+
+def remove(message):
+    """Forget a deleted `message` in this worker's ring buffers."""
+
+    if _config('TIMELINE_ENGINE', 'query') == 'ring':
+        author_buffers().remove(message.user_id, message.id)
+
+
+def backfill(follower_id, followed_id):
+    """Copy `followed_id`'s recent messages into `follower_id`'s timeline."""
+
+    if not is_materialized() or follower_id == followed_id:
+        return
+
+    max_entries = _config('TIMELINE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+    recent = (select(literal(follower_id), Message.id, Message.timestamp)
+              .where(Message.user_id == followed_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(max_entries))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'timestamp'], recent))
+
+    trim(select(literal(follower_id)))
+
+
+def prune(follower_id, followed_id):
+    """Remove `followed_id`'s messages from `follower_id`'s timeline."""
+
+    if not is_materialized() or follower_id == followed_id:
+        return
+
+    authored = select(Message.id).where(Message.user_id == followed_id)
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.message_id.in_(authored))
+     .delete(synchronize_session=False))
+
+
+def trim(user_ids):
+    """Drop entries beyond TIMELINE_MAX_ENTRIES for each user in `user_ids`.
+
+    `user_ids` is a select of user ids.
+    """
+
+    max_entries = _config('TIMELINE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+    ranked = (select(TimelineEntry.user_id,
+                     TimelineEntry.message_id,
+                     func.row_number().over(
+                         partition_by=TimelineEntry.user_id,
+                         order_by=(TimelineEntry.timestamp.desc(),
+                                   TimelineEntry.message_id.desc()),
+                     ).label('position'))
+              .where(TimelineEntry.user_id.in_(user_ids))
+              .subquery())
+
+    overflow = (select(ranked.c.user_id, ranked.c.message_id)
+                .where(ranked.c.position > max_entries))
+
+    (TimelineEntry
+     .query
+     .filter(tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+             .in_(overflow))
+     .delete(synchronize_session=False))
+
+
+def rebuild():
+    """Rebuild every user's timeline from follows and messages."""
+
+    TimelineEntry.query.delete()
+
+    max_entries = _config('TIMELINE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+    own = select(Message.user_id.label('user_id'),
+                 Message.id.label('message_id'),
+                 Message.timestamp.label('timestamp'))
+    followed = (select(Follows.user_following_id,
+                       Message.id,
+                       Message.timestamp)
+                .join(Message,
+                      Message.user_id == Follows.user_being_followed_id))
+    entries = own.union(followed).subquery()
+
+    ranked = (select(entries.c.user_id,
+                     entries.c.message_id,
+                     entries.c.timestamp,
+                     func.row_number().over(
+                         partition_by=entries.c.user_id,
+                         order_by=(entries.c.timestamp.desc(),
+                                   entries.c.message_id.desc()),
+                     ).label('position'))
+              .subquery())
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'timestamp'],
+            select(ranked.c.user_id, ranked.c.message_id, ranked.c.timestamp)
+            .where(ranked.c.position <= max_entries)))
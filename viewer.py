@@ -0,0 +1,107 @@
+"""Per-request relationship state of the logged-in user ("the viewer").
+
+Listing pages ask the same question for every card they render ("does the
+viewer follow this user?", "has the viewer liked this message?"). Rather
+than walking the viewer's collections once per card, the view batch-loads
+the answers for every id on the page into sets, and templates check
+membership in O(1).
+"""
+
+from flask import g
+
+
+class FollowState:
+    """Which users the viewer follows and is followed by, loaded in batches.
+
+    Ids that were not prefetched with `load()` are looked up on demand, so
+    checks are always correct; prefetching just makes them one query.
+    """
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.following = set()
+        self.followers = set()
+        self._loaded = set()
+
+    def load(self, user_ids):
+        """Look up the follow state of any `user_ids` not yet known."""
+
+        missing = set(user_ids) - self._loaded
+
+        if self.viewer and missing:
+            following, followers = self.viewer.follow_state(missing)
+            self.following |= following
+            self.followers |= followers
+
+        self._loaded |= missing
+
+    def is_following(self, user):
+        """Does the viewer follow `user`?"""
+
+        self.load([user.id])
+        return user.id in self.following
+
+    def is_followed_by(self, user):
+        """Does `user` follow the viewer?"""
+
+        self.load([user.id])
+        return user.id in self.followers
+
+
+class LikeState:
+    """Which messages the viewer has liked, loaded in batches.
+
+    Like counts come from the denormalized `Message.likes_count` column, so
+    they need no query of their own.
+    """
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.liked = set()
+        self._loaded = set()
+
+    def load(self, message_ids):
+        """Look up whether the viewer liked any `message_ids` not yet known."""
+
+        missing = set(message_ids) - self._loaded
+
+        if self.viewer and missing:
+            self.liked |= self.viewer.liked_message_ids(missing)
+
+        self._loaded |= missing
+
+    def is_liked(self, message):
+        """Has the viewer liked `message`?"""
+
+        self.load([message.id])
+        return message.id in self.liked
+
+
+def follow_state():
+    """Return the FollowState of this request's viewer (`g.user`)."""
+
+    if 'follow_state' not in g:
+        g.follow_state = FollowState(g.user)
+
+    return g.follow_state
+
+
+def load_follow_state(users):
+    """Prefetch follow state for `users` (anything with an `id`)."""
+
+    follow_state().load(user.id for user in users)
+
+
+def like_state():
+    """Return the LikeState of this request's viewer (`g.user`)."""
+
+    if 'like_state' not in g:
+        g.like_state = LikeState(g.user)
+
+    return g.like_state
+
+
+def load_like_state(messages):
+    """Prefetch whether the viewer liked each of `messages`."""
+
+    like_state().load(message.id for message in messages)